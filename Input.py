@@ -1,5 +1,12 @@
+import numpy as np
+
+# Structured dtype for storing inputs in arrays
+INPUT_DTYPE = np.dtype([('w_l', np.float64), ('w_r', np.float64)])
+
 class Input:
 
+	__slots__ = ('w_l', 'w_r')
+
 	def __init__(self, w_l=0, w_r=0):
 		self.w_l = w_l
 		self.w_r = w_r
@@ -0,0 +1,258 @@
+import state
+import Input
+import rangefinder
+import noise
+import numpy as np
+
+# Propagate (N,3) states through the differential drive arc model with (N,2) wheel speeds u,
+# returns the new states and the (N,2) derivatives of x and y with respect to theta
+def motion_model(states, u, b, r, d_t):
+
+	w_l = u[:, 0]
+	w_r = u[:, 1]
+	x = states[:, 0]
+	y = states[:, 1]
+	theta = states[:, 2]
+
+	# Update theta
+	theta_new = (d_t * r / b * (w_r - w_l) + theta) % (2 * np.pi)
+
+	cos_theta = np.cos(theta)
+	sin_theta = np.sin(theta)
+	cos_theta_new = np.cos(theta_new)
+	sin_theta_new = np.sin(theta_new)
+
+	# Arc motion, robots driving straight are patched afterwards (their infinite radius times a zero
+	# difference of sines is nan)
+	straight = w_r == w_l
+	new_states = np.empty_like(states)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		R = b / 2.0 * (w_r + w_l) / (w_r - w_l) # Circle radius
+		new_states[:, 0] = x + R * (sin_theta_new - sin_theta)
+		new_states[:, 1] = y - R * (cos_theta_new - cos_theta)
+	new_states[:, 2] = theta_new
+
+	if np.any(straight):
+		new_states[straight, 0] = x[straight] + r * w_r[straight] * d_t * cos_theta[straight]
+		new_states[straight, 1] = y[straight] + r * w_r[straight] * d_t * sin_theta[straight]
+
+	# Derivative of state updates with respect to theta, turning the heading turns the displacement with it
+	df_dtheta = np.empty((len(states), 2))
+	df_dtheta[:, 0] = y - new_states[:, 1]
+	df_dtheta[:, 1] = new_states[:, 0] - x
+
+	return new_states, df_dtheta
+
+
+# Vectorized version of TwoWheeledRobot that runs N independent filters at once
+# States are stored as an (N,3) array of [x, y, theta] rows and covariances as an (N,3,3) array
+class BatchTwoWheeledRobot:
+
+	def __init__(self, n, b=85.0, r=20.0, initial_state=state.State(0,0,0), f_s=1, environment=None, seed=None):
+		self.n = n # Number of robots / filter hypotheses
+		self.b = b # Distance between wheels
+		self.r = r # Radius of wheels
+		initial_states = self.as_states(initial_state)
+		self.real_states = initial_states.copy() # Recording of real states
+		self.estimated_state_means = initial_states.copy() # Recording of estimated state means
+		self.covariances = np.zeros((n,3,3)) # Initial covariance matrices, set to zero for known initial states
+		self.d_t = 1.0/f_s # Time step
+		self.Q = np.eye(2) * (np.pi / 6.0) ** 2 # Process noise variance
+		self.R = np.eye(2) * (9.375) ** 2 # Measurement noise variance
+		self.environment = environment # Room map, None for the default 500x750 rectangle
+		self.noise = noise.RobotNoise(seed, shape=(n, 2)) # Noise of the simulated motion and rangefinders
+
+
+	# Broadcast a State, a (3,) array or an (N,3) array to an (N,3) float array
+	def as_states(self, states_in):
+
+		if isinstance(states_in, state.State):
+			states_in = states_in.get_state()
+		return np.array(np.broadcast_to(np.asarray(states_in, dtype=float), (self.n, 3)))
+
+
+	# Broadcast an Input, a (2,) array or an (N,2) array to an (N,2) float array
+	def as_inputs(self, u):
+
+		if isinstance(u, Input.Input):
+			u = u.get_input()
+		return np.broadcast_to(np.asarray(u, dtype=float), (self.n, 2))
+
+
+	# Movement over dt seconds, one fixed time step by default
+	def time_update(self, u, dt=None):
+
+		u = self.as_inputs(u)
+		# Update the real states - includes noise
+		self.real_state_update(u, dt)
+		# Update the state estimates - does not include noise
+		self.estimated_state_update(u, dt)
+
+
+	# Propagate (N,3) states through the motion model, returns the new states and d(state)/d(theta)
+	def motion_model(self, states, u, dt=None):
+
+		return motion_model(states, u, self.b, self.r, self.d_t if dt is None else dt)
+
+
+	# Updating the real states
+	def real_state_update(self, u, dt=None):
+
+		u = self.as_inputs(u)
+		# Add noise to the input
+		noisy_u = u + np.pi / 6.0 * self.noise.input.next()
+		self.real_states, _ = self.motion_model(self.real_states, noisy_u, dt)
+
+
+	# Updating the state estimates
+	def estimated_state_update(self, u, dt=None):
+
+		u = self.as_inputs(u)
+		W = self.get_process_noise_jacobian(u, dt)
+		self.estimated_state_means, df_dtheta = self.motion_model(self.estimated_state_means, u, dt)
+
+		# Create dynamics jacobians
+		F = np.zeros((self.n, 3, 3))
+		F[:, 0, 0] = 1.0
+		F[:, 1, 1] = 1.0
+		F[:, 2, 2] = 1.0
+		F[:, 0:2, 2] = df_dtheta
+
+		# Update covariances with dynamics and process noise jacobians
+		sigma = self.covariances
+		self.covariances = F @ sigma @ F.transpose(0, 2, 1) + W @ self.Q @ W.transpose(0, 2, 1)
+
+
+	# Calculates the (N,3,2) process noise jacobians given the inputs, over a step of dt (d_t by default)
+	def get_process_noise_jacobian(self, u, dt=None):
+
+		b = self.b
+		r = self.r
+		d_t = self.d_t if dt is None else dt
+		u = self.as_inputs(u)
+		w_l = u[:, 0]
+		w_r = u[:, 1]
+		theta = self.estimated_state_means[:, 2]
+
+		sin_theta = np.sin(theta)
+		cos_theta = np.cos(theta)
+
+		# Same terms as twowheeledrobot.motion_primitive: the derivatives of the arc
+		# x + R (sin(theta + d_theta) - sin(theta)), y - R (cos(theta + d_theta) - cos(theta)), with the radius R
+		# and d_theta = k (w_r - w_l) both depending on the wheel speeds
+		k = d_t * r / b
+		straight = w_r == w_l
+		dw = np.where(straight, 1.0, w_r - w_l)
+		R = b / 2.0 * (w_r + w_l) / dw
+		dR_l = b * w_r / dw**2
+		dR_r = -1.0 * b * w_l / dw**2
+		cos = np.cos(k * (w_r - w_l) + theta)
+		sin = np.sin(k * (w_r - w_l) + theta)
+
+		W = np.empty((self.n, 3, 2))
+		W[:, 0, 0] = dR_l * (sin - sin_theta) - R * cos * k
+		W[:, 0, 1] = dR_r * (sin - sin_theta) + R * cos * k
+		W[:, 1, 0] = -1.0 * dR_l * (cos - cos_theta) - R * sin * k
+		W[:, 1, 1] = -1.0 * dR_r * (cos - cos_theta) + R * sin * k
+		W[:, 2, 0] = -1.0 * k
+		W[:, 2, 1] = k
+
+		if np.any(straight):
+			# Limits of the arc terms as w_r - w_l goes to 0
+			p = r * d_t / 2.0
+			q = r * w_r[straight] * d_t * k / 2.0
+			c_s = cos_theta[straight]
+			s_s = sin_theta[straight]
+			W[straight, 0, 0] = c_s * p + s_s * q
+			W[straight, 0, 1] = c_s * p - s_s * q
+			W[straight, 1, 0] = s_s * p - c_s * q
+			W[straight, 1, 1] = s_s * p + c_s * q
+		return W
+
+
+	# Update states and covariances given measurements
+	def measurement_update(self):
+
+		# Calculate rangefinder results and observation jacobians given the real states in a single pass
+		# Same data association as TwoWheeledRobot with association 'truth': the jacobian uses the walls seen from the real states
+		if self.environment is None:
+			y_t, _, H = rangefinder.measure_and_jacobian(self.real_states)
+		else:
+			y_t, _, H = self.environment.measure_and_jacobian(self.real_states)
+
+		# Add independent noise to each rangefinder of each robot
+		y_t = y_t + self.noise.measurement.next() * (9.375)
+
+		# Create predictions given the estimated states
+		predicted_y_t, _, _ = self.measure(self.estimated_state_means)
+
+		sigma_m = self.covariances
+		H_T = H.transpose(0, 2, 1)
+		sigma_H_T = sigma_m @ H_T
+
+		# Closed form inverse of the (N,2,2) innovation covariances
+		S = H @ sigma_H_T + self.R
+		det = S[:, 0, 0] * S[:, 1, 1] - S[:, 0, 1] * S[:, 1, 0]
+		inv_mat = np.empty_like(S)
+		inv_mat[:, 0, 0] = S[:, 1, 1] / det
+		inv_mat[:, 0, 1] = -1.0 * S[:, 0, 1] / det
+		inv_mat[:, 1, 0] = -1.0 * S[:, 1, 0] / det
+		inv_mat[:, 1, 1] = S[:, 0, 0] / det
+
+		# Update estimates and covariances given observation jacobians
+		K = sigma_H_T @ inv_mat
+		self.estimated_state_means = self.estimated_state_means + np.einsum('nij,nj->ni', K, y_t - predicted_y_t)
+		self.covariances = sigma_m - K @ H @ sigma_m
+
+
+	# Returns the (N,2,3) observation jacobians given the states and which wall each sensor is reading
+	def get_observation_jacobian(self, states, front_wall_idx, right_wall_idx):
+
+		# Walls are numbered as in TwoWheeledRobot.get_observation_jacobian
+		x = states[:, 0]
+		y = states[:, 1]
+		theta = states[:, 2]
+
+		cos_0 = np.cos(theta)
+		cos_1 = np.cos(theta - np.pi / 2.0)
+		cos_2 = np.cos(theta - np.pi)
+		cos_3 = np.cos(theta - np.pi * 3.0 / 2.0)
+		zero = np.zeros_like(theta)
+
+		# dd<a>_d<c>[:, <b> - 1] = partial derivative of rangefinder facing <a> and reading wall <b> with respect to <c>
+		ddf_dx = np.stack([-1.0 / cos_0, zero, 1.0 / cos_2, zero], axis=1)
+		ddf_dy = np.stack([zero, -1.0 / cos_1, zero, 1.0 / cos_3], axis=1)
+		ddf_dtheta = np.stack([(500 - x) * np.tan(theta) / cos_0,
+			(750 - y) * np.tan(theta - np.pi / 2.0) / cos_1,
+			x * np.tan(theta - np.pi) / cos_2,
+			y * np.tan(theta - np.pi * 3.0 / 2.0) / cos_3], axis=1)
+
+		ddr_dx = np.stack([-1.0 / cos_1, zero, 1.0 / cos_3, zero], axis=1)
+		ddr_dy = np.stack([zero, -1.0 / cos_2, zero, 1.0 / cos_0], axis=1)
+		ddr_dtheta = np.stack([(500 - x) * np.tan(theta - np.pi / 2.0) / cos_1,
+			(750 - y) * np.tan(theta - np.pi) / cos_2,
+			x * np.tan(theta - np.pi * 3.0 / 2.0) / cos_3,
+			y * np.tan(theta) / cos_0], axis=1)
+
+		# Select the column of the wall each sensor is reading
+		f = (np.asarray(front_wall_idx) - 1)[:, None]
+		rr = (np.asarray(right_wall_idx) - 1)[:, None]
+		H = np.empty((len(states), 2, 3))
+		H[:, 0, 0] = np.take_along_axis(ddf_dx, f, axis=1)[:, 0]
+		H[:, 0, 1] = np.take_along_axis(ddf_dy, f, axis=1)[:, 0]
+		H[:, 0, 2] = np.take_along_axis(ddf_dtheta, f, axis=1)[:, 0]
+		H[:, 1, 0] = np.take_along_axis(ddr_dx, rr, axis=1)[:, 0]
+		H[:, 1, 1] = np.take_along_axis(ddr_dy, rr, axis=1)[:, 0]
+		H[:, 1, 2] = np.take_along_axis(ddr_dtheta, rr, axis=1)[:, 0]
+
+		return H
+
+
+	# Given (N,3) states, return the (N,2) [front, right] rangefinder results and the wall indices read
+	def measure(self, states):
+
+		if self.environment is None:
+			y_t, wall_idx = rangefinder.measure_batch(states)
+		else:
+			y_t, wall_idx = self.environment.measure(states)
+		return y_t, wall_idx[:, 0], wall_idx[:, 1]
@@ -0,0 +1,299 @@
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import state
+import Input
+import rangefinder
+import twowheeledrobot as twr
+import inplacetwowheeledrobot as ip
+import squareroottwowheeledrobot as sr
+import unscentedtwowheeledrobot as ut
+import third_party_functions as tpf
+import numpy as np
+
+# Microbenchmarks of the filter hot paths
+# Every benchmark runs on fixed seeds and states, so results are comparable between runs. Timings are
+# written as JSON, and --compare flags benchmarks that got slower than a saved baseline.
+#   python benchmark.py --output baseline.json
+#   python benchmark.py --compare baseline.json
+
+SEED = 1
+
+# Headings in the middle of each quadrant
+TYPICAL_HEADINGS = (0.3, 1.2, 2.0, 2.9, 3.6, 4.4, 5.1, 6.0)
+
+# Headings next to the multiples of pi/2, where the 1/cos terms of the rangefinder model blow up
+SINGULAR_HEADINGS = tuple(k * np.pi / 2.0 + offset for k in range(4) for offset in (-1e-6, 1e-6))
+
+# Positions inside the 500x750 room
+POSITIONS = ((120.0, 200.0), (250.0, 375.0), (400.0, 600.0), (60.0, 700.0))
+
+
+def _states(headings):
+	return [state.State(x, y, theta) for x, y in POSITIONS for theta in headings]
+
+
+# Callable cycling through a list of argument tuples, so every call of a benchmark sees the next case
+def _cycle(function, cases):
+
+	cases = list(cases)
+	n = len(cases)
+	counter = [0]
+
+	def call():
+		i = counter[0]
+		counter[0] = i + 1 if i + 1 < n else 0
+		return function(*cases[i])
+
+	return call
+
+
+def _robot():
+	return twr.TwoWheeledRobot(initial_state=state.State(250.0, 375.0, 1.2), seed=SEED)
+
+
+def _measure(headings):
+	robot = _robot()
+	return _cycle(robot.measure, [(s,) for s in _states(headings)])
+
+
+def _observation_jacobian(headings):
+	robot = _robot()
+	cases = []
+	for s in _states(headings):
+		_, front_wall_idx, right_wall_idx = robot.measure(s)
+		cases.append(s.get_state() + (front_wall_idx, right_wall_idx))
+	return _cycle(robot.get_observation_jacobian, cases)
+
+
+def _measure_and_jacobian(headings):
+	return _cycle(rangefinder.measure_and_jacobian, [(s,) for s in _states(headings)])
+
+
+def _process_noise_jacobian(u):
+	robot = _robot()
+	return _cycle(robot.get_process_noise_jacobian, [(Input.Input(*u),)])
+
+
+# Time update of the estimate, restarting from the same state and covariance every call
+def _estimated_state_update(u):
+	robot = _robot()
+	initial_state = robot.estimated_state_mean
+	covariance = np.diag([4.0, 4.0, 0.01])
+	u = Input.Input(*u)
+
+	def call():
+		robot.estimated_state_mean = initial_state
+		robot.covariance = covariance
+		robot.estimated_state_update(u)
+
+	return call
+
+
+# Measurement update from a fixed prior, with the real state next to the estimate
+def _measurement_update(headings):
+	robot = _robot()
+	covariance = np.diag([4.0, 4.0, 0.01])
+	states = _states(headings)
+	counter = [0]
+
+	def call():
+		s = states[counter[0] % len(states)]
+		counter[0] += 1
+		robot.real_state = s
+		robot.estimated_state_mean = s
+		robot.covariance = covariance
+		robot.measurement_update()
+
+	return call
+
+
+# Full time and measurement update, restarting every 15 steps so the robot stays in the room
+def _step(robot_class):
+	u = Input.Input(1.0, 2.0)
+	holder = {}
+	counter = [0]
+
+	def call():
+		if counter[0] % 15 == 0:
+			holder['robot'] = robot_class(initial_state=state.State(400.0, 375.0, np.pi / 2.0), seed=SEED)
+		counter[0] += 1
+		robot = holder['robot']
+		robot.time_update(u)
+		robot.measurement_update()
+
+	return call
+
+
+def _measure_batch(n):
+	rng = np.random.default_rng(SEED)
+	states = np.column_stack((rng.uniform(0, 500, n), rng.uniform(0, 750, n), rng.uniform(0, 2 * np.pi, n)))
+	return lambda: rangefinder.measure_batch(states)
+
+
+def _covariance_ellipse():
+	rng = np.random.default_rng(SEED)
+	A = rng.normal(size=(16, 2, 2))
+	return _cycle(tpf.covariance_ellipse, [(a.dot(a.T) + np.eye(2),) for a in A])
+
+
+def _mahalanobis():
+	rng = np.random.default_rng(SEED)
+	A = rng.normal(size=(16, 3, 3))
+	return _cycle(tpf.mahalanobis, [(rng.normal(size=3), rng.normal(size=3), a.dot(a.T) + np.eye(3)) for a in A])
+
+
+def _ness(n):
+	rng = np.random.default_rng(SEED)
+	A = rng.normal(size=(n, 3, 3))
+	ps = A @ A.transpose(0, 2, 1) + np.eye(3)
+	xs = rng.normal(size=(n, 3))
+	est_xs = rng.normal(size=(n, 3))
+	return lambda: tpf.NESS(xs, est_xs, ps)
+
+
+def _ness_batch(n):
+	rng = np.random.default_rng(SEED)
+	A = rng.normal(size=(n, 3, 3))
+	ps = A @ A.transpose(0, 2, 1) + np.eye(3)
+	xs = rng.normal(size=(n, 3))
+	est_xs = rng.normal(size=(n, 3))
+	return lambda: tpf.NESS_batch(xs, est_xs, ps)
+
+
+# Association sized batch: 4 hypotheses of 2 ranges
+def _mahalanobis_batch():
+	rng = np.random.default_rng(SEED)
+	A = rng.normal(size=(4, 2, 2))
+	covs = A @ A.transpose(0, 2, 1) + np.eye(2)
+	xs = rng.normal(size=(4, 2))
+	means = rng.normal(size=(4, 2))
+	return lambda: tpf.mahalanobis_batch(xs, means, covs)
+
+
+def _logpdf_batch(n):
+	rng = np.random.default_rng(SEED)
+	A = rng.normal(size=(n, 3, 3))
+	covs = A @ A.transpose(0, 2, 1) + np.eye(3)
+	xs = rng.normal(size=(n, 3))
+	return lambda: tpf.logpdf_batch(xs, None, covs)
+
+
+# Benchmark name to a function returning the callable to time
+BENCHMARKS = {
+	'measure/typical': lambda: _measure(TYPICAL_HEADINGS),
+	'measure/near_singular': lambda: _measure(SINGULAR_HEADINGS),
+	'get_observation_jacobian/typical': lambda: _observation_jacobian(TYPICAL_HEADINGS),
+	'get_observation_jacobian/near_singular': lambda: _observation_jacobian(SINGULAR_HEADINGS),
+	'measure_and_jacobian/typical': lambda: _measure_and_jacobian(TYPICAL_HEADINGS),
+	'measure_and_jacobian/near_singular': lambda: _measure_and_jacobian(SINGULAR_HEADINGS),
+	'get_process_noise_jacobian/arc': lambda: _process_noise_jacobian((1.0, 2.0)),
+	'get_process_noise_jacobian/straight': lambda: _process_noise_jacobian((2.0, 2.0)),
+	'estimated_state_update/arc': lambda: _estimated_state_update((1.0, 2.0)),
+	'estimated_state_update/straight': lambda: _estimated_state_update((2.0, 2.0)),
+	'measurement_update/typical': lambda: _measurement_update(TYPICAL_HEADINGS),
+	'measurement_update/near_singular': lambda: _measurement_update(SINGULAR_HEADINGS),
+	'step/TwoWheeledRobot': lambda: _step(twr.TwoWheeledRobot),
+	'step/InPlaceTwoWheeledRobot': lambda: _step(ip.InPlaceTwoWheeledRobot),
+	'step/SquareRootTwoWheeledRobot': lambda: _step(sr.SquareRootTwoWheeledRobot),
+	'step/UnscentedTwoWheeledRobot': lambda: _step(ut.UnscentedTwoWheeledRobot),
+	'measure_batch/1000': lambda: _measure_batch(1000),
+	'covariance_ellipse': _covariance_ellipse,
+	'mahalanobis': _mahalanobis,
+	'NESS/100': lambda: _ness(100),
+	'NESS_batch/100': lambda: _ness_batch(100),
+	'NESS_batch/100000': lambda: _ness_batch(100000),
+	'mahalanobis_batch/4': _mahalanobis_batch,
+	'logpdf_batch/100000': lambda: _logpdf_batch(100000),
+}
+
+
+# Time one callable: repeat times a batch of calls lasting at least min_time seconds
+# Returns per call statistics in microseconds
+def time_callable(function, repeat=7, min_time=0.05):
+
+	timer = timeit.Timer(function)
+	number, _ = timer.autorange()
+	number = max(1, int(number * min_time / 0.2))
+	times = np.array(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+	return {
+		'min_us': float(np.min(times)),
+		'median_us': float(np.median(times)),
+		'mean_us': float(np.mean(times)),
+		'std_us': float(np.std(times)),
+		'calls': number * repeat,
+	}
+
+
+# Run the benchmarks whose names contain any of the patterns, returning the JSON report
+def run_benchmarks(patterns=None, repeat=7, min_time=0.05):
+
+	results = {}
+	with np.errstate(all='ignore'):
+		for name, setup in BENCHMARKS.items():
+			if patterns and not any(pattern in name for pattern in patterns):
+				continue
+			results[name] = time_callable(setup(), repeat, min_time)
+	return {
+		'meta': {
+			'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(),
+			'numpy': np.__version__,
+			'platform': platform.platform(),
+			'seed': SEED,
+		},
+		'results': results,
+	}
+
+
+# Compare a report to a baseline on the minimum time per call
+# Returns (name, baseline us, current us, ratio, regressed) rows for the benchmarks in both
+def compare(report, baseline, threshold=0.2):
+
+	rows = []
+	for name, result in report['results'].items():
+		if name not in baseline['results']:
+			continue
+		before = baseline['results'][name]['min_us']
+		after = result['min_us']
+		ratio = after / before
+		rows.append((name, before, after, ratio, ratio > 1.0 + threshold))
+	return rows
+
+
+def main(argv=None):
+
+	parser = argparse.ArgumentParser(description='Microbenchmarks of the filter hot paths')
+	parser.add_argument('-o', '--output', help='write the results to this JSON file')
+	parser.add_argument('-c', '--compare', metavar='BASELINE', help='compare to a saved JSON baseline')
+	parser.add_argument('-t', '--threshold', type=float, default=0.2,
+		help='relative slowdown reported as a regression (default 0.2)')
+	parser.add_argument('-k', '--filter', action='append', metavar='PATTERN', help='only run matching benchmarks')
+	parser.add_argument('-r', '--repeat', type=int, default=7, help='timing repeats per benchmark')
+	args = parser.parse_args(argv)
+
+	report = run_benchmarks(args.filter, args.repeat)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2, sort_keys=True)
+
+	if not args.compare:
+		for name, result in report['results'].items():
+			print('%-42s %10.2f us  (median %10.2f us)' % (name, result['min_us'], result['median_us']))
+		return 0
+
+	with open(args.compare) as f:
+		baseline = json.load(f)
+	regressions = 0
+	for name, before, after, ratio, regressed in compare(report, baseline, args.threshold):
+		print('%-42s %10.2f us -> %10.2f us  %6.2fx%s' % (name, before, after, ratio, '  REGRESSION' if regressed else ''))
+		regressions += regressed
+	print('%d regression(s) above %.0f%%' % (regressions, args.threshold * 100))
+	return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
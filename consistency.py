@@ -0,0 +1,224 @@
+import math
+from statistics import NormalDist
+
+# Online consistency monitoring of a filter from its innovations
+# For a consistent Kalman filter the normalized innovation squared NIS = v^T S^-1 v of every measurement
+# update is chi-square distributed, with as many degrees of freedom as readings (2 for the rangefinders), and
+# independent from step to step. When the filter diverges, e.g. after a wheel slip, the innovations outgrow
+# the S it predicts and the NIS stays high; a filter assuming too much noise keeps it low.
+# ConsistencyMonitor folds every NIS into constant size accumulators: a Welford mean and variance over its
+# lifetime, an exponentially weighted moving average and the sum over a sliding window. It raises an alarm
+# when the EWMA or the window sum leave their chi-square acceptance regions. An update is a few dozen float
+# operations in plain Python, and its state is a handful of numbers, read with counters().
+# The defaults are the textbook tests for a consistent filter. The EKF of this robot is not consistent to the
+# letter: with wheel noise of pi/6 rad/s its heading is off by about 0.2 rad, and linearizing the rangefinders
+# there puts its NIS median at 1.7 (1.4 for chi-square with 2 dof) and its 95% quantile at 12 (6.0), with a
+# percent or two of far larger values when a reading comes from another wall than the estimate sees or a ray
+# grazes a wall. The UKF has the same tail, so both alarm under the textbook tests even when healthy. The tests
+# can be loosened with inflation and cap, at the price of a slower and less sensitive divergence detection,
+# see the demo below.
+# Any other chi-square statistic can be fed with add(), e.g. the NEES of a simulation with dof=3.
+#   monitor = ConsistencyMonitor(on_alarm=lambda monitor, kind: print('filter alarm', kind))
+#   robot.monitor = monitor  # fed by every measurement update of the robot
+#   ... run ...
+#   monitor.counters()
+
+
+# Quantile of the chi-square distribution with dof degrees of freedom, exact for 2 degrees of freedom and
+# from the Wilson-Hilferty cube root normal approximation otherwise (within a few percent for the upper
+# quantiles, better with more dof; the lower tail is only that close with a few dozen dof, as for a window sum)
+def chi2_quantile(p, dof):
+
+	if dof == 2:
+		return -2.0 * math.log(1.0 - p)
+	h = 2.0 / (9.0 * dof)
+	return dof * max(0.0, 1.0 - h + NormalDist().inv_cdf(p) * math.sqrt(h)) ** 3
+
+
+# Streaming NIS statistics and alarms of one filter
+# probability is the acceptance probability of each test: a consistent filter has a fraction
+# 1 - probability of its updates above step_threshold, and its window sum and EWMA leave their acceptance
+# regions about that often. As the tests run at every update, a consistent filter still sees a false alarm
+# every thousand updates or so by default; choose probability from the false alarm rate that is acceptable.
+# window is the number of updates of the window sum, ewma_weight the weight of the newest value in the EWMA,
+# which averages over about 2 / ewma_weight updates.
+# inflation scales the high acceptance limits of the EWMA and window sum, the factor by which the NIS may run
+# above its nominal distribution before the high alarm goes up. cap, when set, caps the values entering the
+# EWMA and window sum (not the Welford statistics or the exceedance count), so that a single outlier cannot
+# raise the high alarm by itself.
+# on_alarm(monitor, kind) is called when an alarm goes up, kind 'high' (innovations larger than the filter
+# expects, e.g. divergence) or 'low' (smaller, the filter assumes too much noise).
+class ConsistencyMonitor:
+
+	def __init__(self, dof=2, window=20, ewma_weight=0.05, probability=0.999, inflation=1.0, cap=None,
+			on_alarm=None):
+		self.dof = dof
+		self.window = window
+		self.ewma_weight = ewma_weight
+		self.probability = probability
+		self.inflation = inflation
+		self.cap = math.inf if cap is None else cap
+		self.on_alarm = on_alarm
+
+		# A single NIS is chi-square with dof degrees of freedom
+		self.step_threshold = chi2_quantile(probability, dof)
+		# The sum of window of them is chi-square with window * dof degrees of freedom, tested on both sides
+		tail = (1.0 - probability) / 2.0
+		self.window_low = chi2_quantile(tail, window * dof)
+		self.window_high = inflation * chi2_quantile(1.0 - tail, window * dof)
+		# In steady state the EWMA has mean dof and variance 2 dof w / (2 - w), approximated by the chi-square
+		# distribution with the same two moments, c chi2(dof / c) with c = w / (2 - w)
+		c = ewma_weight / (2.0 - ewma_weight)
+		self.ewma_high = inflation * c * chi2_quantile(probability, dof / c)
+
+		self.reset()
+
+	# Forget everything seen so far, e.g. after the filter is reinitialized
+	def reset(self):
+
+		self.n_updates = 0 # Values folded into the statistics
+		self.n_invalid = 0 # Values that were nan or inf, or came from a singular S
+		self.n_exceedances = 0 # Values above step_threshold
+		self.n_high_alarms = 0 # Times the high alarm went up
+		self.n_low_alarms = 0 # Times the low alarm went up
+		self.high = False # Current alarm states
+		self.low = False
+		self.nis = math.nan # Last value
+		self.mean = 0.0 # Welford accumulators
+		self._m2 = 0.0
+		self.ewma = float(self.dof) # Starts at the expected value, so it does not alarm while warming up
+		self.window_sum = 0.0
+		self._values = [0.0] * self.window # Ring buffer of the window
+		self._index = 0
+
+	# Sample variance of every value so far
+	@property
+	def variance(self):
+		return self._m2 / (self.n_updates - 1) if self.n_updates > 1 else math.nan
+
+	# Mean over the window, or over the values so far while it is not full
+	@property
+	def window_mean(self):
+		n = min(self.n_updates, self.window)
+		return self.window_sum / n if n else math.nan
+
+	# Fold the NIS of a measurement update, given its innovation ((2,) or (2,1)) and innovation covariance
+	# (2,2) as numpy arrays, with S inverted in closed form. Returns the NIS.
+	def update(self, innovation, S):
+
+		v0 = innovation.item(0)
+		v1 = innovation.item(1)
+		s00 = S.item(0, 0)
+		s01 = S.item(0, 1)
+		s10 = S.item(1, 0)
+		s11 = S.item(1, 1)
+		det = s00 * s11 - s01 * s10
+		nis = (s11 * v0 * v0 - (s01 + s10) * v0 * v1 + s00 * v1 * v1) / det if det > 0 else math.inf
+		self.add(nis)
+		return nis
+
+	# Fold one chi-square distributed value with dof degrees of freedom
+	# A nan or inf value raises the high alarm without entering the statistics, so a single broken update
+	# does not poison them. The Welford mean and variance see every finite value as is, the EWMA and window
+	# sum see it capped at cap.
+	def add(self, value):
+
+		self.nis = value
+		if not value < math.inf:
+			self.n_invalid += 1
+			self._set_alarms(True, self.low)
+			return
+
+		n = self.n_updates = self.n_updates + 1
+		if value > self.step_threshold:
+			self.n_exceedances += 1
+		capped = value if value < self.cap else self.cap
+
+		delta = value - self.mean
+		self.mean += delta / n
+		self._m2 += delta * (value - self.mean)
+
+		self.ewma += self.ewma_weight * (capped - self.ewma)
+
+		i = self._index
+		self.window_sum += capped - self._values[i]
+		self._values[i] = capped
+		i += 1
+		if i == self.window:
+			i = 0
+			# Resum once per window, so the rounding errors of the running sum do not build up
+			self.window_sum = math.fsum(self._values)
+		self._index = i
+
+		full = n >= self.window
+		self._set_alarms(self.ewma > self.ewma_high or (full and self.window_sum > self.window_high),
+			full and self.window_sum < self.window_low)
+
+	def _set_alarms(self, high, low):
+
+		raised_high = high and not self.high
+		raised_low = low and not self.low
+		self.high = high
+		self.low = low
+		if raised_high:
+			self.n_high_alarms += 1
+			if self.on_alarm is not None:
+				self.on_alarm(self, 'high')
+		if raised_low:
+			self.n_low_alarms += 1
+			if self.on_alarm is not None:
+				self.on_alarm(self, 'low')
+
+	# Current state as a flat dict of numbers, e.g. for a metrics scraper
+	# The counts only ever grow (until reset), the alarms are 0 or 1 and the rest are gauges.
+	def counters(self):
+		return {
+			'updates': self.n_updates,
+			'invalid': self.n_invalid,
+			'exceedances': self.n_exceedances,
+			'high_alarms': self.n_high_alarms,
+			'low_alarms': self.n_low_alarms,
+			'alarm_high': int(self.high),
+			'alarm_low': int(self.low),
+			'nis': self.nis,
+			'nis_mean': self.mean if self.n_updates else math.nan,
+			'nis_variance': self.variance,
+			'nis_ewma': self.ewma,
+			'nis_window_mean': self.window_mean,
+		}
+
+
+if __name__ == "__main__":
+	import state
+	import Input
+	import twowheeledrobot as twr
+	import numpy as np
+
+	# Same drive without and with wheel slip, the slipping robot turns 0.3 rad per step further than its
+	# odometry says, watched by a monitor with the textbook tests and one loosened for this EKF (values capped
+	# at the step threshold, a NIS inflated 2.5 times tolerated). The textbook monitor alarms on both runs.
+	# The loosened one stays quiet without slip (in ten seeded runs) and alarms with it, after about a hundred
+	# updates instead of a few.
+	# The robot associates its readings itself: association 'truth' predicts the ranges of the walls the
+	# estimate sees but linearizes at the walls the robot reads, and when those differ (about a fifth of the
+	# updates of this drive) the innovation is the distance between two walls, which the monitor rightly flags.
+	for slip in (0.0, 0.3):
+		robot = twr.TwoWheeledRobot(initial_state=state.State(250, 375, 0.0), seed=1, association='best')
+		robot.monitor = ConsistencyMonitor()
+		loosened = ConsistencyMonitor(inflation=2.5, cap=robot.monitor.step_threshold)
+		u = Input.Input(1, 2)
+		for step in range(1, 1001):
+			# Keep the robot in the room by putting it back in the middle every 15 steps, as a known state
+			if step % 15 == 0:
+				robot.real_state = robot.estimated_state_mean = state.State(250, 375, robot.real_state.theta)
+				robot.covariance = np.zeros((3, 3))
+			robot.real_state = state.State(robot.real_state.pos_x, robot.real_state.pos_y, robot.real_state.theta + slip)
+			robot.time_update(u)
+			robot.measurement_update()
+			if robot.last_innovation is not None:
+				loosened.update(robot.last_innovation, robot.last_innovation_covariance)
+		print('slip %.1f rad per step' % slip)
+		for label, monitor in (('textbook', robot.monitor), ('loosened', loosened)):
+			counters = monitor.counters()
+			print('  %-8s  ' % label + '  '.join('%s %g' % (name, counters[name])
+				for name in ('updates', 'exceedances', 'high_alarms', 'low_alarms', 'nis_ewma', 'nis_window_mean')))
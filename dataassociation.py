@@ -0,0 +1,119 @@
+import math
+import state
+import rangefinder
+from third_party_functions import logpdf_batch
+import numpy as np
+
+# Data association of the rangefinder readings
+# Which walls the rangefinders read is not known outside of simulation. At the estimated state every
+# wall in front of a rangefinder is a candidate, and every (front wall, right wall) pairing a hypothesis
+# with its own predicted ranges and observation jacobian. All hypotheses are scored in one vectorized
+# pass with the Gaussian log likelihood and Mahalanobis distance of their innovation, then the
+# update either uses the best hypothesis or the mixture of all of them, weighted by their likelihoods.
+# The rectangular room has at most two candidates per rangefinder, a map at most max_candidates, so a
+# step scores at most max_candidates^2 hypotheses.
+
+MODES = ('best', 'mixture')
+
+
+# Association of one robot's readings
+# gate_probability drops the hypotheses whose innovation falls outside that probability mass of the
+# chi-square distribution with 2 degrees of freedom; when none is left the reading is not used.
+# max_candidates and margin bound the walls considered per rangefinder on a map, see
+# Environment.wall_candidates.
+class DataAssociation:
+
+	def __init__(self, mode='best', gate_probability=None, max_candidates=4, margin=100.0):
+		if mode not in MODES:
+			raise ValueError('unknown data association mode {!r}, expected one of {}'.format(mode, MODES))
+		self.mode = mode
+		self.gate_probability = gate_probability
+		# Chi-square 2 dof quantile: P(d^2 <= g) = 1 - exp(-g / 2)
+		self.gate = None if gate_probability is None else -2.0 * math.log(1.0 - gate_probability)
+		self.max_candidates = max_candidates
+		self.margin = margin
+
+	# Wall pairing hypotheses at the (3,) state mean
+	# Returns the (K,2) predicted [front, right] ranges, the (K,2) wall indices and the (K,2,3) jacobians
+	def hypotheses(self, mean, environment=None):
+
+		x, y, theta = mean
+		if environment is None:
+			ranges, wall_idx, H = rangefinder.wall_candidates(x, y, theta)
+		else:
+			ranges, wall_idx, H = environment.wall_candidates(x, y, theta, self.max_candidates, self.margin)
+		# (K,2) candidate indices of every (front, right) pairing of the walls in front of the rangefinders,
+		# front major, gathered for both rangefinders at once
+		pairs = np.argwhere((ranges[0] != np.inf)[:, np.newaxis] & (ranges[1] != np.inf))
+		sensors = (0, 1)
+		predicted = ranges[sensors, pairs]
+		walls = wall_idx[sensors, pairs].astype(np.int64)
+		H_k = H[sensors, pairs]
+		return predicted, walls, H_k
+
+	# Score the hypotheses of a (2,) reading y given the prior covariance P and the measurement noise R
+	# Returns the (K,2) innovations, (K,2,2) innovation covariances, (K,) squared Mahalanobis distances
+	# and (K,) log likelihoods
+	def score(self, y, predicted, H, P, R):
+
+		innovations = y - predicted
+		HP = np.matmul(H, P)
+		S = np.matmul(HP, np.swapaxes(H, -1, -2)) + R
+		log_likelihood, d2 = logpdf_batch(y, predicted, S, return_mahalanobis=True)
+		return innovations, S, d2, log_likelihood
+
+	# Measurement update of the robot's estimate with the (2,) reading y
+	# Returns the (K,2) walls of the hypotheses used and their (K,) weights, both empty if the reading
+	# was not used
+	def update(self, robot, y):
+
+		mean = np.array(robot.estimated_state_mean.get_state(), dtype=float)
+		P = np.array(robot.covariance, dtype=float)
+		predicted, walls, H = self.hypotheses(mean, robot.environment)
+		if len(walls) == 0:
+			return walls, np.zeros(0)
+		innovations, S, d2, log_likelihood = self.score(y, predicted, H, P, robot.R)
+
+		keep = np.isfinite(log_likelihood)
+		if self.gate is not None:
+			keep &= d2 <= self.gate
+		if not np.any(keep):
+			return walls[:0], np.zeros(0)
+
+		if self.mode == 'best' or np.count_nonzero(keep) == 1:
+			k = np.flatnonzero(keep)[np.argmax(log_likelihood[keep])]
+			robot.correct(H[k], innovations[k][:, np.newaxis])
+			return walls[k:k + 1], np.ones(1)
+
+		# Mixture: the EKF update of every hypothesis, combined by moment matching
+		walls = walls[keep]
+		H = H[keep]
+		HP = np.matmul(H, P)
+		weights = np.exp(log_likelihood[keep] - np.max(log_likelihood[keep]))
+		weights /= np.sum(weights)
+		# K^T = S^-1 H P, as P is symmetric
+		gains_T = np.linalg.solve(S[keep], HP)
+		shifts = np.einsum('kij,ki->kj', gains_T, innovations[keep])
+		covariances = P - np.matmul(np.swapaxes(HP, -1, -2), gains_T)
+
+		shift = np.dot(weights, shifts)
+		spread = shifts - shift
+		covariance = np.einsum('k,kij->ij', weights, covariances) + np.einsum('k,ki,kj->ij', weights, spread, spread)
+		x_hat = mean + shift
+		robot.estimated_state_mean = state.State(x_hat[0], x_hat[1], x_hat[2])
+		robot.covariance = (covariance + covariance.T) / 2.0
+		# The mixture has no single innovation, the most likely hypothesis stands for it
+		k = np.argmax(weights)
+		robot.record_innovation(innovations[keep][k], S[keep][k])
+		return walls, weights
+
+
+# DataAssociation from a mode name or an instance; None or 'truth' give None, the walls seen from the
+# real state of the simulation
+def resolve(association):
+
+	if association is None or association == 'truth':
+		return None
+	if isinstance(association, str):
+		return DataAssociation(association)
+	return association
@@ -0,0 +1,335 @@
+import math
+import numpy as np
+
+# Maximum number of wall segments stored in a single leaf of the bounding volume hierarchy
+LEAF_SIZE = 4
+
+
+# A room map made of straight wall segments, with a bounding volume hierarchy (BVH) over them so
+# rangefinder rays only test the few walls whose bounding boxes they pass through.
+# Walls are numbered from 1 in the order they are given, 0 means a rangefinder does not see any wall.
+class Environment:
+
+	def __init__(self, segments, leaf_size=LEAF_SIZE):
+
+		segments = np.asarray(segments, dtype=float).reshape(-1, 2, 2)
+		self.segments = segments # (M,2,2) array of [[x0, y0], [x1, y1]] wall endpoints
+		self.starts = segments[:, 0]
+		self.edges = segments[:, 1] - segments[:, 0]
+		# Unit normal of each wall, used for the observation jacobian
+		self.lengths = np.hypot(self.edges[:, 0], self.edges[:, 1])
+		self.normals = np.stack((self.edges[:, 1], -self.edges[:, 0]), axis=1) / self.lengths[:, None]
+		self.build_bvh(leaf_size)
+
+
+	# Build a flattened BVH: a node is either internal (two children) or a leaf holding
+	# the walls order[start:start + count]
+	def build_bvh(self, leaf_size):
+
+		box_min = np.minimum(self.segments[:, 0], self.segments[:, 1])
+		box_max = np.maximum(self.segments[:, 0], self.segments[:, 1])
+		centers = (box_min + box_max) / 2.0
+
+		node_min = []
+		node_max = []
+		node_left = []
+		node_right = []
+		node_axis = []
+		node_start = []
+		node_count = []
+		order = []
+
+		# Median split along the longest axis of the node's bounding box
+		stack = [(np.arange(len(self.segments)), None, None)]
+		while stack:
+			walls, parent, side = stack.pop()
+			node = len(node_min)
+			node_min.append(box_min[walls].min(axis=0))
+			node_max.append(box_max[walls].max(axis=0))
+			node_left.append(-1)
+			node_right.append(-1)
+			node_axis.append(0)
+			node_start.append(0)
+			node_count.append(0)
+			if parent is not None:
+				if side == 0:
+					node_left[parent] = node
+				else:
+					node_right[parent] = node
+
+			if len(walls) <= leaf_size:
+				node_start[node] = len(order)
+				node_count[node] = len(walls)
+				order.extend(walls.tolist())
+			else:
+				axis = int(np.argmax(node_max[node] - node_min[node]))
+				node_axis[node] = axis
+				sorted_walls = walls[np.argsort(centers[walls, axis], kind='stable')]
+				half = len(sorted_walls) // 2
+				stack.append((sorted_walls[half:], node, 1))
+				stack.append((sorted_walls[:half], node, 0))
+
+		self.node_min = np.array(node_min)
+		self.node_max = np.array(node_max)
+		self.node_left = np.array(node_left)
+		self.node_right = np.array(node_right)
+		self.node_axis = np.array(node_axis)
+		self.node_start = np.array(node_start)
+		self.node_count = np.array(node_count)
+		self.order = np.array(order, dtype=np.int64)
+
+		# Plain Python copies for the scalar traversal, which is faster than indexing numpy arrays
+		self._nodes = list(zip(self.node_min[:, 0].tolist(), self.node_min[:, 1].tolist(),
+			self.node_max[:, 0].tolist(), self.node_max[:, 1].tolist(),
+			node_left, node_right, node_axis, node_start, node_count))
+		self._walls = list(zip(self.starts[:, 0].tolist(), self.starts[:, 1].tolist(),
+			self.edges[:, 0].tolist(), self.edges[:, 1].tolist()))
+		self._order = order
+
+
+	# Cast a single ray from (px, py) along (ux, uy), returns the distance and the 0-based wall hit (-1 for none)
+	def cast_single(self, px, py, ux, uy):
+
+		best_t = float("inf")
+		best_wall = -1
+		nodes = self._nodes
+		walls = self._walls
+		order = self._order
+
+		stack = [0]
+		while stack:
+			min_x, min_y, max_x, max_y, left, right, axis, start, count = nodes[stack.pop()]
+
+			# Slab test of the ray against the node's bounding box
+			if ux != 0:
+				t0 = (min_x - px) / ux
+				t1 = (max_x - px) / ux
+				t_near = min(t0, t1)
+				t_far = max(t0, t1)
+			elif min_x <= px <= max_x:
+				t_near = -float("inf")
+				t_far = float("inf")
+			else:
+				continue
+			if uy != 0:
+				t0 = (min_y - py) / uy
+				t1 = (max_y - py) / uy
+				t_near = max(t_near, min(t0, t1))
+				t_far = min(t_far, max(t0, t1))
+			elif not min_y <= py <= max_y:
+				continue
+			if t_far < t_near or t_far <= 0 or t_near >= best_t:
+				continue
+
+			if count:
+				for wall in order[start:start + count]:
+					ax, ay, ex, ey = walls[wall]
+					denom = ux * ey - uy * ex
+					if denom == 0:
+						continue
+					wx = ax - px
+					wy = ay - py
+					t = (wx * ey - wy * ex) / denom
+					s = (wx * uy - wy * ux) / denom
+					if t > 0 and t < best_t and 0 <= s <= 1:
+						best_t = t
+						best_wall = wall
+			# Visit the child nearer along the ray first, so its hits prune the farther one
+			elif (ux if axis == 0 else uy) >= 0:
+				stack.append(right)
+				stack.append(left)
+			else:
+				stack.append(left)
+				stack.append(right)
+
+		return best_t, best_wall
+
+
+	# Cast R rays at once, traversing the BVH breadth first for all (ray, node) pairs together
+	# Returns the (R,) distances and 0-based walls hit (-1 for none)
+	def cast(self, origins, directions):
+
+		origins = np.asarray(origins, dtype=float)
+		directions = np.asarray(directions, dtype=float)
+		n_rays = len(origins)
+		best_t = np.full(n_rays, np.inf)
+		best_wall = np.full(n_rays, -1, dtype=np.int64)
+
+		rays = np.arange(n_rays)
+		nodes = np.zeros(n_rays, dtype=np.int64)
+		with np.errstate(divide='ignore', invalid='ignore'):
+			inverse = 1.0 / directions
+			while len(rays):
+				# Slab test of each ray against its node's bounding box
+				p = origins[rays]
+				inv = inverse[rays]
+				t0 = (self.node_min[nodes] - p) * inv
+				t1 = (self.node_max[nodes] - p) * inv
+				# A ray parallel to a slab gives nan only when it lies exactly on the slab, which counts as inside
+				t_near = np.nanmax(np.minimum(t0, t1), axis=1)
+				t_far = np.nanmin(np.maximum(t0, t1), axis=1)
+				hit = (t_near <= t_far) & (t_far > 0) & (t_near < best_t[rays])
+				rays = rays[hit]
+				nodes = nodes[hit]
+
+				# Test the walls of every leaf reached
+				leaf = self.node_count[nodes] > 0
+				if np.any(leaf):
+					leaf_rays = rays[leaf]
+					leaf_nodes = nodes[leaf]
+					counts = self.node_count[leaf_nodes]
+					pair_rays = np.repeat(leaf_rays, counts)
+					first = np.repeat(np.cumsum(counts) - counts, counts)
+					pair_walls = self.order[np.repeat(self.node_start[leaf_nodes], counts) + np.arange(len(pair_rays)) - first]
+
+					u = directions[pair_rays]
+					e = self.edges[pair_walls]
+					w = self.starts[pair_walls] - origins[pair_rays]
+					denom = u[:, 0] * e[:, 1] - u[:, 1] * e[:, 0]
+					t = (w[:, 0] * e[:, 1] - w[:, 1] * e[:, 0]) / denom
+					s = (w[:, 0] * u[:, 1] - w[:, 1] * u[:, 0]) / denom
+					valid = (denom != 0) & (t > 0) & (s >= 0) & (s <= 1)
+
+					pair_rays = pair_rays[valid]
+					pair_walls = pair_walls[valid]
+					t = t[valid]
+					np.minimum.at(best_t, pair_rays, t)
+					closest = t == best_t[pair_rays]
+					best_wall[pair_rays[closest]] = pair_walls[closest]
+
+				# Descend into the children of every internal node reached
+				inner = ~leaf
+				rays = np.repeat(rays[inner], 2)
+				children = np.stack((self.node_left[nodes[inner]], self.node_right[nodes[inner]]), axis=1)
+				nodes = children.ravel()
+
+		return best_t, best_wall
+
+
+	# Given a single state (or State) or an (N,3) array of states, return the [front, right]
+	# rangefinder results and the 1-based indices of the walls read, as rangefinder.measure_batch does
+	def measure(self, states):
+
+		ranges, wall_idx, _ = self.measure_and_jacobian(states, jacobian=False)
+		return ranges, wall_idx
+
+
+	# Ray cast version of rangefinder.measure_and_jacobian for this map
+	# The jacobian of each range comes from the normal of the wall that was hit
+	def measure_and_jacobian(self, states, jacobian=True):
+
+		if hasattr(states, 'get_state'):
+			states = states.get_state()
+		states = np.asarray(states, dtype=float)
+		if states.ndim == 1:
+			return self._measure_and_jacobian_single(states[0], states[1], states[2])
+
+		n = len(states)
+		c = np.cos(states[:, 2])
+		s = np.sin(states[:, 2])
+		# The front rangefinder points along theta and the right rangefinder along theta - pi / 2
+		directions = np.empty((n, 2, 2))
+		directions[:, 0, 0] = c
+		directions[:, 0, 1] = s
+		directions[:, 1, 0] = s
+		directions[:, 1, 1] = -c
+		origins = np.repeat(states[:, 0:2], 2, axis=0)
+
+		t, walls = self.cast(origins, directions.reshape(-1, 2))
+		ranges = t.reshape(n, 2)
+		wall_idx = (walls + 1).reshape(n, 2)
+		if not jacobian:
+			return ranges, wall_idx, None
+
+		# d(range)/d(position) = -n / (n . u) and d(range)/d(theta) = -range * (n . u') / (n . u)
+		# where u is the ray direction and u' its derivative with respect to theta
+		normals = self.normals[walls].reshape(n, 2, 2)
+		u = directions
+		u_prime = np.stack((-u[:, :, 1], u[:, :, 0]), axis=2)
+		n_dot_u = np.einsum('nij,nij->ni', normals, u)
+		n_dot_u_prime = np.einsum('nij,nij->ni', normals, u_prime)
+		H = np.empty((n, 2, 3))
+		H[:, :, 0:2] = -normals / n_dot_u[:, :, None]
+		H[:, :, 2] = -ranges * n_dot_u_prime / n_dot_u
+		H[wall_idx == 0] = np.nan
+		return ranges, wall_idx, H
+
+
+	# Scalar version of measure_and_jacobian for a single state
+	def _measure_and_jacobian_single(self, x, y, theta):
+
+		c = math.cos(theta)
+		s = math.sin(theta)
+
+		ranges = np.empty(2)
+		wall_idx = np.zeros(2, dtype=np.int64)
+		H = np.empty((2, 3))
+		for sensor, (ux, uy) in enumerate(((c, s), (s, -c))):
+			t, wall = self.cast_single(x, y, ux, uy)
+			ranges[sensor] = t
+			wall_idx[sensor] = wall + 1
+			if wall < 0:
+				H[sensor] = np.nan
+				continue
+			nx, ny = self.normals[wall]
+			n_dot_u = nx * ux + ny * uy
+			H[sensor, 0] = -nx / n_dot_u
+			H[sensor, 1] = -ny / n_dot_u
+			H[sensor, 2] = -t * (ny * ux - nx * uy) / n_dot_u
+
+		return ranges, wall_idx, H
+
+
+	# Data association hypotheses at a single state, as rangefinder.wall_candidates: every wall crossed by
+	# each rangefinder ray, not only the first, up to the max_candidates nearest ones
+	# Walls are extended by margin at both ends, so a ray passing just beside a wall (e.g. next to a corner,
+	# when the estimate is off) still counts it; margin=np.inf treats walls as infinite lines, as
+	# rangefinder.wall_candidates does for the rectangular room.
+	# Returns the (2,C) [front, right] ranges (inf past the walls crossed), the (2,C) 1-based wall indices
+	# (0 past the walls crossed) and the (2,C,3) jacobian rows, with C = min(max_candidates, number of walls).
+	def wall_candidates(self, x, y, theta, max_candidates=4, margin=0.0):
+
+		c = math.cos(theta)
+		s = math.sin(theta)
+		u = np.array([[c, s], [s, -c]])
+		e = self.edges
+		w = self.starts - (x, y)
+
+		# Ray and wall segment crossing of every (rangefinder, wall) pair, as in cast
+		with np.errstate(divide='ignore', invalid='ignore'):
+			denom = np.outer(u[:, 0], e[:, 1]) - np.outer(u[:, 1], e[:, 0])
+			t = (w[:, 0] * e[:, 1] - w[:, 1] * e[:, 0]) / denom
+			along = (np.outer(u[:, 1], w[:, 0]) - np.outer(u[:, 0], w[:, 1])) / denom
+		extension = margin / self.lengths
+		t[~((denom != 0) & (t > 0) & (along >= -extension) & (along <= 1 + extension))] = np.inf
+
+		walls = np.argsort(t, axis=1, kind='stable')[:, :max_candidates]
+		ranges = np.take_along_axis(t, walls, axis=1)
+
+		# Same jacobian as measure_and_jacobian, from the normal of each wall
+		normals = self.normals[walls]
+		n_dot_u = np.einsum('scj,sj->sc', normals, u)
+		n_dot_u_prime = normals[:, :, 1] * u[:, None, 0] - normals[:, :, 0] * u[:, None, 1]
+		H = np.empty(walls.shape + (3,))
+		with np.errstate(divide='ignore', invalid='ignore'):
+			H[:, :, 0:2] = -normals / n_dot_u[:, :, None]
+			H[:, :, 2] = -ranges * n_dot_u_prime / n_dot_u
+		wall_idx = np.where(np.isfinite(ranges), walls + 1, 0)
+		return ranges, wall_idx, H
+
+
+# The rectangular room used by rangefinder, walls numbered the same way: right, top, left, bottom
+def rectangle(width=500, length=750):
+
+	return from_polygons([[(width, 0), (width, length), (0, length), (0, 0)]])
+
+
+# Build an environment from closed polygons, e.g. the room outline followed by pillars and furniture
+# Each polygon is a list of (x, y) vertices, the last vertex connects back to the first
+def from_polygons(polygons):
+
+	segments = []
+	for polygon in polygons:
+		points = np.asarray(polygon, dtype=float)
+		segments.append(np.stack((points, np.roll(points, -1, axis=0)), axis=1))
+	return Environment(np.concatenate(segments))
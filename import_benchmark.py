@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import subprocess
+
+# Import time benchmark
+# Each module is imported in a fresh interpreter, timing the import and recording which heavy
+# dependencies it pulled in. The run fails if a module that must stay light imports any of them.
+
+# Dependencies that must only be loaded on first use
+HEAVY_MODULES = ('scipy', 'matplotlib')
+
+# Modules used by batch workers, which must not import any heavy dependency
+LIGHT_MODULES = ('twowheeledrobot', 'third_party_functions', 'pipeline', 'montecarlo')
+
+# Code run in the fresh interpreter, printing the import time and the heavy modules that were loaded
+_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(m for m in {heavy!r} if m in sys.modules)]))
+'''
+
+
+# Import time in seconds (best of repeats) and the heavy modules loaded by importing module
+def measure_import(module, repeats=5):
+
+	here = os.path.dirname(os.path.abspath(__file__))
+	times = []
+	for _ in range(repeats):
+		output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+			cwd=here, capture_output=True, text=True, check=True).stdout
+		elapsed, loaded = json.loads(output.strip().splitlines()[-1])
+		times.append(elapsed)
+	return min(times), loaded
+
+
+# Benchmark every light module, returning False if any of them imports a heavy dependency
+def run_benchmark(modules=LIGHT_MODULES, repeats=5):
+
+	passed = True
+	for module in modules:
+		elapsed, loaded = measure_import(module, repeats)
+		status = 'ok' if not loaded else 'FAIL, imports ' + ', '.join(loaded)
+		print('{:<24s} {:8.1f} ms  {}'.format(module, elapsed * 1e3, status))
+		passed = passed and not loaded
+	return passed
+
+
+if __name__ == "__main__":
+	sys.exit(0 if run_benchmark() else 1)
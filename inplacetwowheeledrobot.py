@@ -0,0 +1,174 @@
+import math
+import state
+import rangefinder
+import twowheeledrobot as twr
+import numpy as np
+
+# Version of TwoWheeledRobot with an allocation free step path for tight control loops
+# The state estimate and covariance live in persistent buffers (x and P) and every intermediate
+# (F, W, H, K, innovation, ...) goes into a preallocated scratch array, using out= arithmetic and
+# transposed views created once up front. predict() and update() allocate no arrays in steady state.
+# The usual time_update / measurement_update interface still works on top of the same buffers.
+class InPlaceTwoWheeledRobot(twr.TwoWheeledRobot):
+
+	def __init__(self, b=85.0, r=20.0, initial_state=state.State(0,0,0), f_s=1, environment=None, Q=None, R=None,
+			seed=None, association='best'):
+
+		# State and covariance buffers
+		self.x = np.zeros(3)
+		self.P = np.zeros((3, 3))
+
+		# Scratch buffers for the time update
+		self._F = np.eye(3)
+		self._F_T = self._F.T
+		self._W = np.zeros((3, 2))
+		self._W_T = self._W.T
+		self._FP = np.zeros((3, 3))
+		self._WQ = np.zeros((3, 2))
+		self._WQW = np.zeros((3, 3))
+
+		# Scratch buffers for the measurement update
+		self._z = np.zeros(2)
+		self._y_pred = np.zeros(2)
+		self._wall_idx = np.zeros(2, dtype=np.int64)
+		self._H = np.zeros((2, 3))
+		self._H_T = self._H.T
+		self._innovation = np.zeros(2)
+		self._PH_T = np.zeros((3, 2))
+		self._S = np.zeros((2, 2))
+		self._S_inv = np.zeros((2, 2))
+		self._K = np.zeros((3, 2))
+		self._dx = np.zeros(3)
+		self._KH = np.zeros((3, 3))
+		self._KHP = np.zeros((3, 3))
+
+		twr.TwoWheeledRobot.__init__(self, b=b, r=r, initial_state=initial_state, f_s=f_s, environment=environment,
+			Q=Q, R=R, seed=seed, association=association)
+
+
+	# The estimate is read from and written into the x buffer
+	@property
+	def estimated_state_mean(self):
+		return state.State(*self.x.tolist())
+
+	@estimated_state_mean.setter
+	def estimated_state_mean(self, state_in):
+		self.x[:] = state_in.get_state()
+
+
+	# The covariance is the P buffer itself, assigning to it copies into the buffer
+	@property
+	def covariance(self):
+		return self.P
+
+	@covariance.setter
+	def covariance(self, P):
+		self.P[...] = P
+
+
+	# Dynamics jacobian of the last time update
+	@property
+	def F(self):
+		return self._F
+
+
+	# Time update of the estimate through the in place path
+	def estimated_state_update(self, u, dt=None):
+
+		w_l, w_r = u.get_input()
+		self.predict(w_l, w_r, dt)
+
+
+	# Allocation free time update given the wheel speeds, over dt seconds (one fixed time step by default)
+	def predict(self, w_l, w_r, dt=None):
+
+		x = self.x
+		F = self._F
+		W = self._W
+
+		# Same motion model and jacobians as TwoWheeledRobot.estimated_state_update, from the motion primitive cache
+		d_theta, dx_body, dy_body, p_l, p_r, q_l, q_r, k = twr.motion_primitive(self.b, self.r, w_l, w_r,
+			self.d_t if dt is None else dt)
+		theta = x.item(2)
+		cos_theta, sin_theta = twr.cos_sin(theta)
+		dx = cos_theta * dx_body - sin_theta * dy_body
+		dy = sin_theta * dx_body + cos_theta * dy_body
+		x[0] += dx
+		x[1] += dy
+		x[2] = (d_theta + theta) % (2 * math.pi)
+		F[0, 2] = -1.0 * dy
+		F[1, 2] = dx
+		W[0, 0] = cos_theta * p_l - sin_theta * q_l
+		W[0, 1] = cos_theta * p_r - sin_theta * q_r
+		W[1, 0] = sin_theta * p_l + cos_theta * q_l
+		W[1, 1] = sin_theta * p_r + cos_theta * q_r
+		W[2, 0] = -1.0 * k
+		W[2, 1] = k
+
+		# P = F P F^T + W Q W^T
+		np.matmul(F, self.P, out=self._FP)
+		np.matmul(self._FP, self._F_T, out=self.P)
+		np.matmul(W, self.Q, out=self._WQ)
+		np.matmul(self._WQ, self._W_T, out=self._WQW)
+		np.add(self.P, self._WQW, out=self.P)
+
+
+	# Allocation free measurement update given the (2,) [front, right] rangefinder readings z
+	# Ranges and the observation jacobian are predicted from the current estimate
+	# As in TwoWheeledRobot.measurement_update, sensor dropouts and estimates that see no wall are skipped
+	def update(self, z):
+
+		self.last_innovation = self.last_innovation_covariance = None
+		x = self.x
+		if self.environment is None:
+			rangefinder._measure_and_jacobian_single(x.item(0), x.item(1), x.item(2), self._y_pred, self._wall_idx, self._H)
+		else:
+			y_pred, wall_idx, H = self.environment.measure_and_jacobian(x)
+			self._y_pred[:] = y_pred
+			self._H[:] = H
+		np.subtract(z, self._y_pred, out=self._innovation)
+		if not (math.isfinite(self._innovation.item(0)) and math.isfinite(self._innovation.item(1))):
+			return
+		self._apply_correction()
+
+
+	# In place version of TwoWheeledRobot.correct, used by measurement_update
+	def correct(self, H, innovation):
+
+		self._H[:] = H
+		self._innovation[:] = innovation.reshape(2)
+		self._apply_correction()
+
+
+	# Kalman update of x and P from the H and innovation buffers
+	def _apply_correction(self):
+
+		H = self._H
+		PH_T = self._PH_T
+		S = self._S
+		S_inv = self._S_inv
+		K = self._K
+
+		# S = H P H^T + R, inverted in closed form
+		np.matmul(self.P, self._H_T, out=PH_T)
+		np.matmul(H, PH_T, out=S)
+		np.add(S, self.R, out=S)
+		s00 = S.item(0, 0)
+		s01 = S.item(0, 1)
+		s10 = S.item(1, 0)
+		s11 = S.item(1, 1)
+		det = s00 * s11 - s01 * s10
+		S_inv[0, 0] = s11 / det
+		S_inv[0, 1] = -s01 / det
+		S_inv[1, 0] = -s10 / det
+		S_inv[1, 1] = s00 / det
+
+		# x += K (z - h(x)), P -= K H P
+		np.matmul(PH_T, S_inv, out=K)
+		np.matmul(K, self._innovation, out=self._dx)
+		np.add(self.x, self._dx, out=self.x)
+		np.matmul(K, H, out=self._KH)
+		np.matmul(self._KH, self.P, out=self._KHP)
+		np.subtract(self.P, self._KHP, out=self.P)
+		# The innovation and S are kept as the buffers themselves, overwritten by the next update
+		self.record_innovation(self._innovation, S)
@@ -0,0 +1,198 @@
+import os
+import json
+import time
+from collections import deque
+
+# Per stage profiling counters for the robots' filter steps
+# The stages are robot methods. Profiling a robot replaces its stage methods, on that instance only,
+# with wrappers timing every call with perf_counter_ns, and removing them restores the plain methods,
+# so a robot that is not profiled runs exactly the code it would without this module.
+# Timings are inclusive: the time of a stage contains the stages it calls.
+#   profiler = Profiler(trace=True)
+#   robot.enable_profiling(profiler)
+#   ... run ...
+#   profiler.snapshot()
+#   profiler.write_chrome_trace('trace.json')  # open in chrome://tracing or ui.perfetto.dev
+
+# Robot methods timed by default, the ones a robot does not have are skipped
+STAGES = (
+	'time_update', # Real and estimated state time update
+	'real_state_update', # Simulated motion of the real state
+	'estimated_state_update', # Prediction
+	'motion_jacobians', # Dynamics and process noise jacobians
+	'propagate_covariance', # Covariance time update
+	'measurement_update', # Whole measurement update
+	'associate', # Data association and its measurement update
+	'measure_and_jacobian', # Ray casting and observation jacobian
+	'correct', # State and covariance measurement update
+	'invert_innovation_covariance', # Innovation covariance inversion
+	'predict', # Allocation free time update of InPlaceTwoWheeledRobot
+	'update', # Allocation free measurement update of InPlaceTwoWheeledRobot
+)
+
+# Histogram bins: bin k counts the calls taking [2^(k-1), 2^k) ns, bin 0 the calls under 1 ns
+N_BINS = 64
+
+
+# Counters of one stage
+class StageStats:
+
+	__slots__ = ('count', 'total_ns', 'min_ns', 'max_ns', 'histogram')
+
+	def __init__(self):
+		self.count = 0
+		self.total_ns = 0
+		self.min_ns = None
+		self.max_ns = 0
+		self.histogram = [0] * N_BINS
+
+	def add(self, elapsed):
+		self.count += 1
+		self.total_ns += elapsed
+		if self.min_ns is None or elapsed < self.min_ns:
+			self.min_ns = elapsed
+		if elapsed > self.max_ns:
+			self.max_ns = elapsed
+		self.histogram[min(elapsed.bit_length(), N_BINS - 1)] += 1
+
+	# Smallest bin upper bound in ns that at least fraction q of the calls take no longer than
+	def quantile_bound(self, q):
+		needed = q * self.count
+		seen = 0
+		for k, n in enumerate(self.histogram):
+			seen += n
+			if n and seen >= needed:
+				return 1 << k
+		return None
+
+	def as_dict(self):
+		return {
+			'count': self.count,
+			'total_ns': self.total_ns,
+			'mean_ns': self.total_ns / self.count if self.count else None,
+			'min_ns': self.min_ns,
+			'max_ns': self.max_ns,
+			'p50_bound_ns': self.quantile_bound(0.5),
+			'p99_bound_ns': self.quantile_bound(0.99),
+			'histogram': {1 << k: n for k, n in enumerate(self.histogram) if n},
+		}
+
+
+# Collects the counters of one or more profiled robots
+# With trace=True every call is also kept as a trace event, the max_events most recent ones, for
+# chrome_trace(). Each profiled robot appears as its own thread of the trace.
+class Profiler:
+
+	def __init__(self, trace=False, max_events=1000000):
+		self.stats = {} # Stage name to StageStats
+		self.trace = trace
+		self.events = deque(maxlen=max_events) # (stage, start ns, elapsed ns, robot index)
+		self.robots = [] # Name of each profiled robot, by index
+		self.origin = time.perf_counter_ns() # Time 0 of the trace
+
+	def reset(self):
+		self.stats = {}
+		self.events.clear()
+		self.origin = time.perf_counter_ns()
+
+	# Timed version of a bound method, reporting to the stage name
+	def wrap(self, name, method, robot_index):
+
+		profiler = self
+		clock = time.perf_counter_ns
+		events = self.events
+
+		def timed(*args, **kwargs):
+			start = clock()
+			try:
+				return method(*args, **kwargs)
+			finally:
+				elapsed = clock() - start
+				stats = profiler.stats.get(name)
+				if stats is None:
+					stats = profiler.stats[name] = StageStats()
+				stats.add(elapsed)
+				if profiler.trace:
+					events.append((name, start, elapsed, robot_index))
+
+		timed.__wrapped__ = method
+		return timed
+
+	# Counters of every stage called so far, as plain dicts keyed by stage name
+	def snapshot(self):
+		return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+	# Trace event format dict of the recorded calls, as complete ("X") events with times in us
+	def chrome_trace(self):
+
+		pid = os.getpid()
+		trace_events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+			for tid, name in enumerate(self.robots)]
+		for name, start, elapsed, tid in self.events:
+			trace_events.append({'name': name, 'cat': 'filter', 'ph': 'X', 'pid': pid, 'tid': tid,
+				'ts': (start - self.origin) / 1e3, 'dur': elapsed / 1e3})
+		return {'traceEvents': trace_events, 'displayTimeUnit': 'ns'}
+
+	def write_chrome_trace(self, path):
+
+		with open(path, 'w') as f:
+			json.dump(self.chrome_trace(), f)
+
+
+# Start timing the stages of a robot, returns the profiler
+def profile(robot, profiler=None, stages=STAGES):
+
+	if profiler is None:
+		profiler = Profiler()
+	unprofile(robot)
+	robot_index = len(profiler.robots)
+	profiler.robots.append('{} {}'.format(type(robot).__name__, robot_index))
+	wrapped = []
+	for name in stages:
+		method = getattr(robot, name, None)
+		if callable(method):
+			setattr(robot, name, profiler.wrap(name, method, robot_index))
+			wrapped.append(name)
+	robot._profiled_stages = wrapped
+	robot.profiler = profiler
+	return profiler
+
+
+# Stop timing a robot, putting its plain methods back
+def unprofile(robot):
+
+	for name in robot.__dict__.pop('_profiled_stages', ()):
+		robot.__dict__.pop(name, None)
+	robot.__dict__.pop('profiler', None)
+
+
+# Text table of a snapshot, stages with the most total time first
+def format_snapshot(snapshot):
+
+	lines = ['{:<30s} {:>9s} {:>12s} {:>10s} {:>10s} {:>10s}'.format('stage', 'calls', 'total ms', 'mean us',
+		'p99 <= us', 'max us')]
+	for name, stats in sorted(snapshot.items(), key=lambda item: -item[1]['total_ns']):
+		lines.append('{:<30s} {:>9d} {:>12.3f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(name, stats['count'],
+			stats['total_ns'] / 1e6, stats['mean_ns'] / 1e3, stats['p99_bound_ns'] / 1e3, stats['max_ns'] / 1e3))
+	return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+	import state
+	import Input
+	import twowheeledrobot as twr
+	import numpy as np
+
+	robot = twr.TwoWheeledRobot(initial_state=state.State(400, 375, np.pi / 2.0))
+	profiler = robot.enable_profiling(Profiler(trace=True))
+	u = Input.Input(1, 2)
+	for step in range(1500):
+		# Restart every 15 steps so the robot stays in the room
+		if step % 15 == 0:
+			robot.real_state = robot.estimated_state_mean = state.State(400, 375, np.pi / 2.0)
+			robot.covariance = np.zeros((3, 3))
+		robot.time_update(u)
+		robot.measurement_update()
+	print(format_snapshot(profiler.snapshot()))
+	profiler.write_chrome_trace('profile_trace.json')
+	print('Trace written to profile_trace.json')
@@ -0,0 +1,247 @@
+import asyncio
+import bisect
+import itertools
+import state
+import Input
+import measurement
+import sensorlog
+import twowheeledrobot as twr
+import trajectory as traj
+import numpy as np
+
+# Real time localization service
+# Robots send timestamped wheel speed commands and rangefinder readings as UDP datagrams, each holding
+# one or more MESSAGE_DTYPE records. Every robot gets its own filter behind a short reorder buffer, so
+# messages arriving late are re-applied in time order, and the latest pose of every robot that changed
+# is published back to its sender every publish_period seconds, batched into POSE_DTYPE datagrams.
+# A single event loop serves all robots.
+
+# Incoming records: sensorlog records tagged with the robot id, kind is sensorlog.INPUT or MEASUREMENT
+MESSAGE_DTYPE = np.dtype([('robot_id', '<i8'), ('t', '<f8'), ('kind', '<i8'), ('a', '<f8'), ('b', '<f8')])
+
+# Published records: estimate at time t and its packed upper triangular covariance
+POSE_DTYPE = np.dtype([('robot_id', '<i8'), ('t', '<f8'), ('pos_x', '<f8'), ('pos_y', '<f8'), ('theta', '<f8'),
+	('covariance', '<f8', (6,))])
+
+# Largest datagram sent, under the 64kB UDP limit
+MAX_DATAGRAM_SIZE = 60000
+
+
+# Encode (robot_id, t, kind, a, b) messages into a datagram
+def encode_messages(messages):
+
+	return np.array(list(messages), dtype=MESSAGE_DTYPE).tobytes()
+
+
+# Decode a datagram of published poses
+def decode_poses(data):
+
+	return np.frombuffer(data, dtype=POSE_DTYPE)
+
+
+# Filter of one robot behind a reorder buffer
+# Messages are applied as they arrive, in time order. The state after every message of the last window
+# seconds is kept, so a late message only rolls back to the state just before it and re-applies the
+# messages after it. Messages older than the window are committed and can no longer be reordered;
+# anything arriving before the committed time is dropped.
+# t0 is the time of the first message. The initial state is taken to hold from t0 - window, so messages
+# stamped up to a window before the first one to arrive are still used, as for any later message.
+# Between messages the estimate is propagated with the latest wheel speed command, over the actual time
+# elapsed instead of the robot's fixed d_t.
+# A consistency monitor on the robot is taken over by the tracker and fed the innovations of committed
+# measurements only, once each and in time order, so rolled back and re-applied updates are not counted twice.
+class TrackedRobot:
+
+	def __init__(self, robot, t0=0.0, window=0.5):
+		self.robot = robot
+		self.monitor = robot.monitor
+		robot.monitor = None
+		self.window = window # Reorder window in seconds
+		self.t = t0 - window # Time of the current estimate
+		self.u = None # Latest wheel speed command
+		self.committed = self._snapshot() # State after the last committed message
+		self.keys = [] # (t, kind, sequence number) of the buffered messages, in time order
+		self.messages = [] # (t, kind, a, b) of the buffered messages
+		self.snapshots = [] # State after each buffered message
+		self.sequence = itertools.count()
+		self.n_dropped = 0 # Messages that arrived after their time was committed
+		self.n_reordered = 0 # Messages that arrived out of order
+
+	# The innovation buffers of an in place robot are reused, so they are copied like the covariance
+	def _snapshot(self):
+		robot = self.robot
+		innovation = robot.last_innovation
+		if innovation is not None:
+			innovation = (np.array(innovation), np.array(robot.last_innovation_covariance))
+		return (self.t, self.u, robot.estimated_state_mean, np.array(robot.covariance), innovation)
+
+	def _restore(self, snapshot):
+		robot = self.robot
+		self.t, self.u, robot.estimated_state_mean, covariance, innovation = snapshot
+		robot.covariance = covariance.copy()
+		robot.last_innovation, robot.last_innovation_covariance = (None, None) if innovation is None else innovation
+
+	# Propagate the estimate to time t with the latest command
+	def _advance(self, t):
+
+		d_t = t - self.t
+		if d_t > 0 and self.u is not None:
+			self.robot.estimated_state_update(self.u, d_t)
+		self.t = max(self.t, t)
+
+	# Apply one message to the filter
+	def _apply(self, t, kind, a, b):
+
+		self._advance(t)
+		if kind == sensorlog.INPUT:
+			self.u = Input.Input(a, b)
+		else:
+			self.robot.measurement_update(measurement.Measurement(a, b))
+
+	# Add a message, returns False if it arrived too late to be used
+	def ingest(self, t, kind, a, b):
+
+		if t < self.committed[0]:
+			self.n_dropped += 1
+			return False
+
+		key = (t, kind, next(self.sequence))
+		position = bisect.bisect(self.keys, key)
+		self.keys.insert(position, key)
+		self.messages.insert(position, (t, kind, a, b))
+		self.snapshots.insert(position, None)
+
+		if position < len(self.keys) - 1:
+			# Late message: roll back to just before it and re-apply everything from there
+			self.n_reordered += 1
+			self._restore(self.snapshots[position - 1] if position > 0 else self.committed)
+		for i in range(position, len(self.keys)):
+			self._apply(*self.messages[i])
+			self.snapshots[i] = self._snapshot()
+
+		# Commit the messages that left the reorder window
+		horizon = self.keys[-1][0] - self.window
+		n_commit = bisect.bisect_left(self.keys, (horizon,))
+		if n_commit > 0:
+			if self.monitor is not None:
+				for i in range(n_commit):
+					innovation = self.snapshots[i][4]
+					if self.keys[i][1] != sensorlog.INPUT and innovation is not None:
+						self.monitor.update(*innovation)
+			self.committed = self.snapshots[n_commit - 1]
+			del self.keys[:n_commit]
+			del self.messages[:n_commit]
+			del self.snapshots[:n_commit]
+		return True
+
+	# (t, x, y, theta, packed covariance) of the current estimate
+	def pose(self):
+
+		x, y, theta = self.robot.estimated_state_mean.get_state()
+		return self.t, x, y, theta, traj.pack_covariance(self.robot.covariance)
+
+
+# asyncio protocol feeding datagrams to the service
+class LocalizationProtocol(asyncio.DatagramProtocol):
+
+	def __init__(self, service):
+		self.service = service
+
+	def connection_made(self, transport):
+		self.service.transport = transport
+
+	def datagram_received(self, data, addr):
+		if len(data) % MESSAGE_DTYPE.itemsize != 0:
+			self.service.n_malformed += 1
+			return
+		self.service.ingest_records(np.frombuffer(data, dtype=MESSAGE_DTYPE), addr)
+
+
+# UDP localization service for many robots
+# robot_factory(robot_id) creates the filter of a robot seen for the first time, at its known initial
+# state: there is no default, as a filter started at a guessed pose with a zero covariance does not recover
+class LocalizationService:
+
+	def __init__(self, robot_factory, window=0.5, publish_period=0.02):
+		self.robot_factory = robot_factory
+		self.window = window # Reorder window in seconds
+		self.publish_period = publish_period # Upper bound on the time between a message and its pose being sent
+		self.tracks = {} # Robot id to TrackedRobot
+		self.addresses = {} # Robot id to the address poses are published to
+		self.updated = set() # Robots with a pose not published yet
+		self.transport = None
+		self.n_malformed = 0
+		self._publisher = None
+
+	# Route decoded records to their robots' filters
+	def ingest_records(self, records, addr=None):
+
+		for robot_id, t, kind, a, b in records.tolist():
+			track = self.tracks.get(robot_id)
+			if track is None:
+				track = self.tracks[robot_id] = TrackedRobot(self.robot_factory(robot_id), t0=t, window=self.window)
+			if addr is not None:
+				self.addresses[robot_id] = addr
+			if track.ingest(t, kind, a, b):
+				self.updated.add(robot_id)
+
+	# Latest poses of the given robots as a POSE_DTYPE array
+	def poses(self, robot_ids):
+
+		poses = np.zeros(len(robot_ids), dtype=POSE_DTYPE)
+		for i, robot_id in enumerate(robot_ids):
+			t, x, y, theta, covariance = self.tracks[robot_id].pose()
+			poses[i] = (robot_id, t, x, y, theta, covariance)
+		return poses
+
+	# Send the poses of all robots updated since the last call, one batch of datagrams per address
+	def publish(self):
+
+		updated = self.updated
+		self.updated = set()
+		by_address = {}
+		for robot_id in updated:
+			address = self.addresses.get(robot_id)
+			if address is not None:
+				by_address.setdefault(address, []).append(robot_id)
+		for address, robot_ids in by_address.items():
+			poses = self.poses(robot_ids)
+			per_datagram = MAX_DATAGRAM_SIZE // POSE_DTYPE.itemsize
+			for start in range(0, len(poses), per_datagram):
+				self.transport.sendto(poses[start:start + per_datagram].tobytes(), address)
+
+	async def _publish_loop(self):
+
+		while True:
+			await asyncio.sleep(self.publish_period)
+			self.publish()
+
+	# Start listening on a local UDP port and publishing poses
+	async def start(self, host='127.0.0.1', port=9209):
+
+		loop = asyncio.get_running_loop()
+		await loop.create_datagram_endpoint(lambda: LocalizationProtocol(self), local_addr=(host, port))
+		self._publisher = loop.create_task(self._publish_loop())
+		return self.transport.get_extra_info('sockname')
+
+	def close(self):
+
+		if self._publisher is not None:
+			self._publisher.cancel()
+		if self.transport is not None:
+			self.transport.close()
+
+
+async def _serve(host, port):
+
+	service = LocalizationService(lambda robot_id: twr.TwoWheeledRobot(initial_state=state.State(400, 375, np.pi / 2.0)))
+	address = await service.start(host, port)
+	print('Localization service listening on {}:{}'.format(*address))
+	try:
+		await asyncio.Event().wait()
+	finally:
+		service.close()
+
+
+if __name__ == "__main__":
+	asyncio.run(_serve('127.0.0.1', 9209))
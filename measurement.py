@@ -1,5 +1,12 @@
+import numpy as np
+
+# Structured dtype for storing measurements in arrays
+MEASUREMENT_DTYPE = np.dtype([('d_f', np.float64), ('d_r', np.float64)])
+
 class Measurement:
 
+	__slots__ = ('d_f', 'd_r')
+
 	def __init__(self, d_f=0, d_r=0):
 		self.d_f = d_f
 		self.d_r = d_r
@@ -0,0 +1,240 @@
+from multiprocessing import shared_memory
+import multiprocessing
+import state
+import twowheeledrobot as twr
+import Input
+import noise
+import environment
+import numpy as np
+from consistency import chi2_quantile
+from third_party_functions import NESS_batch
+
+# A run has diverged from the first step where its NEES leaves the chi-square acceptance region of this
+# probability (3 degrees of freedom, about 21.1), which a consistent filter does at a given step once in
+# 1 / (1 - probability) runs, or where its estimated position leaves the bounding box of the room.
+# The statistics only cover the runs still tracking. At the default f_s=1 the wheel noise bends each
+# 1 s arc too much for the linearization and the EKF is far from consistent, about 9 in 10 runs exceed the
+# bound within 15 steps; at f_s=4 with association='mixture' (the demo below) its mean NEES is about 3 and
+# about 1 run in 14 diverges.
+DIVERGENCE_PROBABILITY = 0.9999
+
+# Shared memory blocks attached by each worker process
+_worker_arrays = {}
+_worker_config = {}
+
+
+# Mean over the runs (axis 0) of the values that are not nan, nan for a step without any, e.g. the initial
+# step of the NEES or a step where every run has diverged
+def mean_over_runs(values):
+
+	valid = ~np.isnan(values)
+	count = np.count_nonzero(valid, axis=0)
+	total = np.sum(np.where(valid, values, 0.0), axis=0)
+	return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+# Bounding box ((x_min, y_min), (x_max, y_max)) of a room map, None for the default 500x750 rectangle
+def room_bounds(room=None):
+
+	if room is None:
+		room = environment.rectangle()
+	return tuple(room.node_min[0]), tuple(room.node_max[0])
+
+
+# Results of a Monte Carlo run, indexed by [run, step] where step 0 is the initial state
+# nees_bound and bounds are the divergence limits, chi2_quantile(DIVERGENCE_PROBABILITY, 3) and the
+# bounding box of the default room if None
+class MonteCarloResults:
+
+	def __init__(self, true_states, estimated_states, covariances, innovations=None, innovation_covariances=None,
+			nees_bound=None, bounds=None):
+		if nees_bound is None:
+			nees_bound = chi2_quantile(DIVERGENCE_PROBABILITY, 3)
+		if bounds is None:
+			bounds = room_bounds()
+		self.true_states = true_states # (runs, steps + 1, 3)
+		self.estimated_states = estimated_states # (runs, steps + 1, 3)
+		self.covariances = covariances # (runs, steps + 1, 3, 3)
+		self.innovations = innovations # (runs, steps + 1, 2), nan where there was no measurement update
+		self.innovation_covariances = innovation_covariances # (runs, steps + 1, 2, 2)
+
+		# Estimation error with the heading error wrapped to [-pi, pi)
+		error = true_states - estimated_states
+		error[..., 2] = (error[..., 2] + np.pi) % (2 * np.pi) - np.pi
+		self.errors = error
+
+		self.nees_bound = nees_bound
+		self.bounds = bounds
+		finite = np.all(np.isfinite(estimated_states), axis=2) & np.all(np.isfinite(covariances), axis=(2, 3))
+
+		with np.errstate(invalid='ignore'):
+			# Normalized estimation error squared, only defined where the covariance is not singular
+			# (the initial covariance is zero and the first prediction only has rank 2)
+			valid = finite.copy()
+			eigenvalues = np.linalg.eigvalsh(covariances[finite])
+			valid[finite] = eigenvalues[:, 0] > 1e-12 * np.maximum(eigenvalues[:, -1], 1e-300)
+			self.nees = np.full(error.shape[:2], np.nan)
+			self.nees[valid] = NESS_batch(error[valid], np.zeros_like(error[valid]), covariances[valid])
+
+			# Runs that blew up to nan/inf, lost the NEES bound or left the room are excluded from the
+			# statistics from that step on
+			(x_min, y_min), (x_max, y_max) = bounds
+			lost = (~finite | (self.nees > nees_bound) | (estimated_states[..., 0] < x_min)
+				| (estimated_states[..., 0] > x_max) | (estimated_states[..., 1] < y_min)
+				| (estimated_states[..., 1] > y_max))
+			self.tracking = np.cumsum(lost, axis=1) == 0 # (runs, steps + 1), False from the step a run diverged
+			self.diverged = ~self.tracking[:, -1]
+			self.nees[~self.tracking] = np.nan
+			self.mean_nees = mean_over_runs(self.nees)
+
+			# Root mean square error over the runs still tracking for each step
+			tracking = self.tracking
+			self.rmse_position = np.sqrt(mean_over_runs(np.where(tracking, error[..., 0] ** 2 + error[..., 1] ** 2, np.nan)))
+			self.rmse_heading = np.sqrt(mean_over_runs(np.where(tracking, error[..., 2] ** 2, np.nan)))
+
+			# Normalized innovation squared, the measurable counterpart of the NEES
+			if innovations is None:
+				self.nis = self.mean_nis = None
+			else:
+				updated = (tracking & np.all(np.isfinite(innovations), axis=2)
+					& np.all(np.isfinite(innovation_covariances), axis=(2, 3)))
+				self.nis = np.full(innovations.shape[:2], np.nan)
+				self.nis[updated] = NESS_batch(innovations[updated], np.zeros_like(innovations[updated]),
+					innovation_covariances[updated])
+				self.mean_nis = mean_over_runs(self.nis)
+
+
+# Create a shared memory block and an array view onto it
+def _create_shared_array(shape):
+
+	shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * 8)
+	return shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+# Attach a worker process to the shared result arrays
+def _init_worker(names, shapes, config):
+
+	for key in names:
+		shm = shared_memory.SharedMemory(name=names[key])
+		_worker_arrays[key] = (shm, np.ndarray(shapes[key], dtype=np.float64, buffer=shm.buf))
+	_worker_config.update(config)
+
+
+# Run a single seeded trajectory into the (steps + 1, ...) result rows of one run
+def _simulate(config, seed, true_states, estimated_states, covariances, innovations, innovation_covariances):
+
+	robot = twr.TwoWheeledRobot(initial_state=state.State(*config['initial_state']), seed=seed, **config['robot_kwargs'])
+	u = Input.Input(*config['u'])
+
+	true_states[0] = robot.real_state.get_state()
+	estimated_states[0] = robot.estimated_state_mean.get_state()
+	covariances[0] = robot.covariance
+	innovations[0] = np.nan
+	innovation_covariances[0] = np.nan
+	for i in range(1, config['n_steps'] + 1):
+		robot.time_update(u)
+		robot.measurement_update()
+		true_states[i] = robot.real_state.get_state()
+		estimated_states[i] = robot.estimated_state_mean.get_state()
+		covariances[i] = robot.covariance
+		if robot.last_innovation is None:
+			innovations[i] = np.nan
+			innovation_covariances[i] = np.nan
+		else:
+			innovations[i] = robot.last_innovation
+			innovation_covariances[i] = robot.last_innovation_covariance
+
+
+# Run a single seeded trajectory and write it straight into the shared arrays
+def _run_one(run, seed):
+
+	_simulate(_worker_config, seed, _worker_arrays['true_states'][1][run], _worker_arrays['estimated_states'][1][run],
+		_worker_arrays['covariances'][1][run], _worker_arrays['innovations'][1][run],
+		_worker_arrays['innovation_covariances'][1][run])
+
+
+# Run a chunk of trajectories, only the run indices and seeds are sent to the worker
+def _run_chunk(runs_and_seeds):
+
+	for run, seed in runs_and_seeds:
+		_run_one(run, seed)
+
+
+# Run n_runs independently seeded simulations of the robot across a process pool
+# processes=0 runs them one after the other in this process, e.g. inside a worker of another pool
+def run_monte_carlo(n_runs=1000, n_steps=15, initial_state=state.State(400, 375, np.pi / 2.0), u=(1, 2),
+		seed=1, processes=None, chunk_size=None, robot_kwargs=None):
+
+	shapes = {
+		'true_states': (n_runs, n_steps + 1, 3),
+		'estimated_states': (n_runs, n_steps + 1, 3),
+		'covariances': (n_runs, n_steps + 1, 3, 3),
+		'innovations': (n_runs, n_steps + 1, 2),
+		'innovation_covariances': (n_runs, n_steps + 1, 2, 2),
+	}
+	bounds = room_bounds((robot_kwargs or {}).get('environment'))
+	config = {
+		'n_steps': n_steps,
+		'initial_state': initial_state.get_state(),
+		'u': tuple(u),
+		'robot_kwargs': dict(robot_kwargs or {}),
+	}
+
+	# One child of the seed per run, so results do not depend on how runs are split between workers
+	runs_and_seeds = list(enumerate(noise.spawn_seeds(seed, n_runs)))
+
+	if processes == 0:
+		arrays = {key: np.zeros(shape) for key, shape in shapes.items()}
+		for run, run_seed in runs_and_seeds:
+			_simulate(config, run_seed, arrays['true_states'][run], arrays['estimated_states'][run],
+				arrays['covariances'][run], arrays['innovations'][run], arrays['innovation_covariances'][run])
+		return MonteCarloResults(arrays['true_states'], arrays['estimated_states'], arrays['covariances'],
+			arrays['innovations'], arrays['innovation_covariances'], bounds=bounds)
+
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	if chunk_size is None:
+		chunk_size = max(1, n_runs // (processes * 4))
+	chunks = [runs_and_seeds[i:i + chunk_size] for i in range(0, n_runs, chunk_size)]
+
+	blocks = {}
+	arrays = {}
+	try:
+		for key in shapes:
+			blocks[key], arrays[key] = _create_shared_array(shapes[key])
+		names = {key: blocks[key].name for key in blocks}
+
+		with multiprocessing.Pool(processes, initializer=_init_worker, initargs=(names, shapes, config)) as pool:
+			pool.map(_run_chunk, chunks)
+
+		# Copy the results out of shared memory before releasing it
+		results = MonteCarloResults(arrays['true_states'].copy(), arrays['estimated_states'].copy(),
+			arrays['covariances'].copy(), arrays['innovations'].copy(), arrays['innovation_covariances'].copy(),
+			bounds=bounds)
+	finally:
+		# Views onto a block keep it from closing, so drop them first. Cleanup errors are ignored, so they never
+		# hide an exception raised by the runs, and every block is unlinked even if closing it fails.
+		arrays.clear()
+		for shm in blocks.values():
+			try:
+				shm.close()
+			except BufferError:
+				pass
+			try:
+				shm.unlink()
+			except FileNotFoundError:
+				pass
+
+	return results
+
+
+if __name__ == "__main__":
+	f_s = 4
+	results = run_monte_carlo(n_steps=15 * f_s, robot_kwargs={'f_s': f_s, 'association': 'mixture'})
+	print("%d of %d runs diverged (NEES above %.1f or outside the room)" % (np.sum(results.diverged),
+		len(results.diverged), results.nees_bound))
+	if np.all(results.diverged):
+		print("Every run diverged, the statistics below only cover the steps before")
+	for i in range(0, len(results.mean_nees), f_s):
+		print("t %2d  rmse position %8.3f  rmse heading %6.3f  mean nees %6.3f  mean nis %6.3f" % (i // f_s,
+			results.rmse_position[i], results.rmse_heading[i], results.mean_nees[i], results.mean_nis[i]))
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Random noise streams of the simulated robots
+# Every robot owns its generators, spawned from a SeedSequence, instead of sharing the global
+# np.random state, so its noise does not depend on what else draws random numbers, in which order, or in
+# which process it runs. The generators use Philox, a counter based bit generator.
+# Noise is drawn in blocks and handed out one step at a time. Blocks start small and double in size up to
+# MAX_BLOCK_VALUES numbers, so short runs draw little and long runs rarely pay the numpy call overhead;
+# the block sizes never change the values drawn, since standard normals are taken from the stream in order.
+
+FIRST_BLOCK_ROWS = 64
+MAX_BLOCK_VALUES = 8192
+
+
+# SeedSequence from an int, a SeedSequence, or None for fresh OS entropy
+def seed_sequence(seed=None):
+
+	if isinstance(seed, np.random.SeedSequence):
+		return seed
+	return np.random.SeedSequence(seed)
+
+
+# Independent seed sequences for n runs, e.g. of a Monte Carlo simulation
+# Run i always gets child i of the seed, however the runs are split between processes
+def spawn_seeds(seed, n):
+
+	return seed_sequence(seed).spawn(n)
+
+
+def generator(seed=None):
+
+	return np.random.Generator(np.random.Philox(seed_sequence(seed)))
+
+
+# Standard normal draws of a fixed shape, one per call of next()
+class NoiseStream:
+
+	def __init__(self, seed=None, shape=(2,), max_block_values=MAX_BLOCK_VALUES):
+		self.generator = generator(seed)
+		self.shape = tuple(shape)
+		self.max_block_rows = max(1, max_block_values // int(np.prod(self.shape)))
+		self.block_rows = min(FIRST_BLOCK_ROWS, self.max_block_rows) # Rows of the next block
+		self.rows = [] # Current block, as lists of floats for one dimensional draws
+		self.index = 0 # Next unused row of the current block
+
+	def _refill(self):
+
+		block = self.generator.standard_normal((self.block_rows,) + self.shape)
+		self.rows = block.tolist() if len(self.shape) == 1 else list(block)
+		self.index = 0
+		self.block_rows = min(2 * self.block_rows, self.max_block_rows)
+
+	def next(self):
+
+		i = self.index
+		if i == len(self.rows):
+			self._refill()
+			i = 0
+		self.index = i + 1
+		return self.rows[i]
+
+
+# Noise of one simulated robot: the wheel speed noise of the real motion, the rangefinder noise and a
+# generator for estimators that sample (e.g. particles), each its own child of the robot's seed so
+# skipping draws of one never shifts the others
+class RobotNoise:
+
+	def __init__(self, seed=None, shape=(2,)):
+		self.seed = seed_sequence(seed)
+		input_seed, measurement_seed, filter_seed = self.seed.spawn(3)
+		self.input = NoiseStream(input_seed, shape) # Standard normal [left, right] wheel noise
+		self.measurement = NoiseStream(measurement_seed, shape) # Standard normal [front, right] range noise
+		self.filter = generator(filter_seed)
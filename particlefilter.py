@@ -0,0 +1,109 @@
+import state
+import measurement
+import rangefinder
+import twowheeledrobot as twr
+from batchtwowheeledrobot import motion_model
+import numpy as np
+
+# Particle filter localizer with the same interface as the EKF in TwoWheeledRobot
+# The real state is simulated exactly as in TwoWheeledRobot, only the estimator differs.
+# Unlike the EKF, no wall indices are taken from the real state: every particle predicts its own ranges.
+# The readings are simulated on the robot's environment, as for the EKF.
+class ParticleFilterRobot(twr.TwoWheeledRobot):
+
+	def __init__(self, b=85.0, r=20.0, initial_state=state.State(0,0,0), f_s=1, environment=None,
+			n_particles=100000, resample_threshold=0.5, seed=None):
+		twr.TwoWheeledRobot.__init__(self, b=b, r=r, initial_state=initial_state, f_s=f_s, environment=environment,
+			seed=seed)
+		self.n_particles = n_particles
+		self.resample_threshold = resample_threshold # Resample when the effective sample size drops below this fraction of N
+		# All particles start at the known initial state
+		self.particles = np.tile(np.array(initial_state.get_state(), dtype=float), (n_particles, 1))
+		self.weights = np.full(n_particles, 1.0 / n_particles)
+		self.R_inv = np.linalg.inv(self.R)
+		self.update_estimate()
+
+
+	# Propagate every particle through the motion model with its own input noise
+	def estimated_state_update(self, u, dt=None):
+
+		w_l, w_r = u.get_input()
+		noisy_u = np.array([w_l, w_r], dtype=float) + self.noise.filter.standard_normal((self.n_particles, 2)) * np.sqrt(np.diag(self.Q))
+		self.particles, _ = motion_model(self.particles, noisy_u, self.b, self.r, self.d_t if dt is None else dt)
+		self.update_estimate()
+
+
+	# Predicted [front, right] ranges for every particle
+	def measure_particles(self):
+
+		if self.environment is None:
+			ranges, _ = rangefinder.measure_batch(self.particles)
+		else:
+			ranges, _ = self.environment.measure(self.particles)
+		return ranges
+
+
+	# Weight the particles by the likelihood of the rangefinder readings, then resample if needed
+	# The readings are simulated from the real state unless a measurement y is given
+	def measurement_update(self, y=None):
+
+		if y is None:
+			# Simulate the rangefinder readings from the real state, with the same noise as TwoWheeledRobot
+			y_t, _, _ = self.measure_and_jacobian(self.real_state)
+			y_t = y_t + np.array(self.noise.measurement.next()) * (9.375)
+		else:
+			y_t = np.array(twr.measurement_values(y), dtype=float)
+		self.last_measurement = measurement.Measurement(y_t[0], y_t[1])
+		# Skip sensor dropouts, as the EKF does
+		if not np.all(np.isfinite(y_t)):
+			return
+
+		# Gaussian log likelihood of the innovation of each particle
+		innovation = y_t - self.measure_particles()
+		log_likelihood = -0.5 * np.einsum('ni,ij,nj->n', innovation, self.R_inv, innovation)
+		# Particles that see no wall get an infinite range and so a zero weight
+		log_likelihood[~np.isfinite(log_likelihood)] = -np.inf
+
+		log_weights = np.log(self.weights) + log_likelihood
+		max_log_weight = np.max(log_weights)
+		if not np.isfinite(max_log_weight):
+			# No particle explains the measurement, skip it and keep the prior weights
+			return
+		weights = np.exp(log_weights - max_log_weight)
+		self.weights = weights / np.sum(weights)
+
+		if self.effective_sample_size() < self.resample_threshold * self.n_particles:
+			self.resample()
+		self.update_estimate()
+
+
+	# Effective sample size of the current weights
+	def effective_sample_size(self):
+
+		return 1.0 / np.dot(self.weights, self.weights)
+
+
+	# Systematic resampling: one uniform draw, N evenly spaced pointers into the cumulative weights
+	def resample(self):
+
+		n = self.n_particles
+		positions = (self.noise.filter.random() + np.arange(n)) / n
+		cumulative = np.cumsum(self.weights)
+		cumulative[-1] = 1.0
+		idx = np.searchsorted(cumulative, positions)
+		self.particles = self.particles[idx]
+		self.weights = np.full(n, 1.0 / n)
+
+
+	# Weighted mean and covariance of the particles, using a circular mean for the heading
+	def update_estimate(self):
+
+		w = self.weights
+		x = np.dot(w, self.particles[:, 0])
+		y = np.dot(w, self.particles[:, 1])
+		theta = np.arctan2(np.dot(w, np.sin(self.particles[:, 2])), np.dot(w, np.cos(self.particles[:, 2]))) % (2 * np.pi)
+		self.estimated_state_mean = state.State(x, y, theta)
+
+		error = self.particles - np.array([x, y, theta])
+		error[:, 2] = (error[:, 2] + np.pi) % (2 * np.pi) - np.pi
+		self.covariance = np.dot(error.T * w, error)
@@ -0,0 +1,126 @@
+import itertools
+import Input
+import numpy as np
+
+# Headless, streaming simulation
+# simulate() steps a robot through an iterable of Inputs and yields one StepRecord per step, so runs of
+# any length use constant memory. Plotting and logging are optional consumers attached to the stream;
+# nothing here imports matplotlib unless a CovariancePlotter is created.
+
+
+# Everything known about one step of the filter
+class StepRecord:
+
+	__slots__ = ('step', 't', 'u', 'true_state', 'prior_mean', 'prior_covariance',
+		'posterior_mean', 'covariance', 'measurement', 'F')
+
+	def __init__(self, step, t, u, true_state, prior_mean, prior_covariance, posterior_mean, covariance, measurement,
+			F=None):
+		self.step = step # Step number, starting at 1
+		self.t = t # Time at the end of the step
+		self.u = u # Input applied during the step
+		self.true_state = true_state # Real state after the step
+		self.prior_mean = prior_mean # Estimate after the time update
+		self.prior_covariance = prior_covariance # Covariance after the time update
+		self.posterior_mean = posterior_mean # Estimate after the measurement update
+		self.covariance = covariance # Covariance after the measurement update
+		self.measurement = measurement # Noisy rangefinder reading used in the measurement update
+		self.F = F # Dynamics jacobian of the time update, None for robots without one
+
+
+# Inputs repeating u = (w_l, w_r) forever, or n_steps times
+def constant_input(u, n_steps=None):
+
+	u = Input.Input(u[0], u[1])
+	return itertools.repeat(u) if n_steps is None else itertools.repeat(u, n_steps)
+
+
+# Step the robot through the inputs, yielding a StepRecord after each time and measurement update
+# Every consumer is called with each record before it is yielded.
+# For multi rate filtering, each time update covers dt seconds (one fixed time step by default) and only
+# every correct_every-th step has a measurement update; the other records have measurement None and
+# the prior as posterior.
+def simulate(robot, inputs, consumers=(), dt=None, correct_every=1):
+
+	t = 0.0
+	for step, u in enumerate(inputs, 1):
+		if not isinstance(u, Input.Input):
+			u = Input.Input(u[0], u[1])
+
+		robot.time_update(u, dt)
+		t += robot.d_t if dt is None else dt
+		prior_mean = robot.estimated_state_mean
+		# Covariances are copied, since some robots update them in place
+		prior_covariance = np.array(robot.covariance)
+		F = getattr(robot, 'F', None)
+		if F is not None:
+			F = np.array(F)
+
+		if step % correct_every == 0:
+			robot.measurement_update()
+			record = StepRecord(step, t, u, robot.real_state, prior_mean, prior_covariance,
+				robot.estimated_state_mean, np.array(robot.covariance), robot.last_measurement, F)
+		else:
+			record = StepRecord(step, t, u, robot.real_state, prior_mean, prior_covariance,
+				prior_mean, prior_covariance, None, F)
+
+		for consumer in consumers:
+			consumer(record)
+		yield record
+
+
+# Drain a stream, returning the last record
+def run(stream):
+
+	record = None
+	for record in stream:
+		pass
+	return record
+
+
+# Consumer that logs every record into a trajectory.Trajectory
+class TrajectoryLogger:
+
+	def __init__(self, trajectory):
+		self.trajectory = trajectory
+
+	def __call__(self, record):
+		self.trajectory.append(record.t, record.true_state, record.posterior_mean, record.covariance,
+			record.u, record.measurement)
+
+
+# Consumer that collects the prior and posterior covariance ellipses of every record, and the real path
+# draw() renders all ellipses of each kind as a single EllipseCollection
+class CovariancePlotter:
+
+	def __init__(self, ax=None, every=1):
+		import matplotlib.pyplot as plt
+		self.ax = plt.gca() if ax is None else ax
+		self.every = every # Only plot every n-th step
+		self.path = []
+		self.means = ([], []) # Prior and posterior means
+		self.covariances = ([], []) # Prior and posterior position covariances
+
+	def __call__(self, record):
+		x, y, _ = record.true_state.get_state()
+		self.path.append((x, y))
+		if record.step % self.every == 0:
+			self.add(record.prior_mean, record.prior_covariance)
+			self.add(record.posterior_mean, record.covariance, posterior=True)
+
+	# Add the ellipse of a state estimate and its covariance
+	def add(self, mean, covariance, posterior=False):
+		self.means[posterior].append(mean.get_state()[0:2])
+		self.covariances[posterior].append(covariance[0:2, 0:2])
+
+	# Draw the collected ellipses, and the real path starting at an optional initial state
+	def draw(self, initial_state=None):
+		from third_party_functions import plot_covariance_batch
+		for means, covariances, style in ((self.means[0], self.covariances[0], dict(facecolor='k', alpha=0.3)),
+				(self.means[1], self.covariances[1], dict(facecolor='g', alpha=0.8))):
+			if means:
+				plot_covariance_batch(means, covariances, ax=self.ax, edgecolor='#004080', lw=2, **style)
+		path = self.path if initial_state is None else [initial_state.get_state()[0:2]] + self.path
+		if path:
+			path = np.array(path)
+			self.ax.plot(path[:, 0], path[:, 1], color='k', lw=2)
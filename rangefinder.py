@@ -0,0 +1,213 @@
+import math
+import numpy as np
+
+# Define walls:
+#             2 (top)
+#         ----------------
+#         |              |
+#         |              |
+# 3(left) |              | 1 (right)
+#         |              |
+#         |              |
+#         |              |
+#         ----------------
+#            4 (bottom)
+
+# Batches up to this size go through the compact version of measure_batch, which uses fewer but larger array operations
+SMALL_BATCH = 64
+
+# Wall index of the k-th cosine used by the [front, right] rangefinders
+_SHIFT = np.array([[0, 1, 2, 3], [1, 2, 3, 0]])
+
+
+# Vectorized version of TwoWheeledRobot.measure
+# Given an (N,3) array of [x, y, theta] states, returns the (N,2) [front, right] rangefinder results
+# and the (N,2) indices of the walls read. Index 0 (with an infinite range) means no wall is seen.
+def measure_batch(states):
+
+	states = np.asarray(states, dtype=float)
+	if len(states) <= SMALL_BATCH:
+		return _measure_batch_small(states)
+	x = states[:, 0]
+	y = states[:, 1]
+	theta = states[:, 2]
+
+	# The front and right rangefinders share the same four cosines, shifted by one wall
+	cosines = (np.cos(theta), np.cos(theta - np.pi / 2.0), np.cos(theta - np.pi), np.cos(theta - np.pi * 3.0 / 2.0))
+
+	# Distance along the wall normal for each wall
+	offsets = (500 - x, 750 - y, x, y)
+
+	ranges = np.empty((len(states), 2))
+	wall_idx = np.empty((len(states), 2), dtype=np.int64)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		for sensor in range(2):
+			# Distances from this rangefinder to each of the 4 walls, masked to the positive ones
+			d = [offsets[i] / cosines[(i + sensor) % 4] for i in range(4)]
+			for d_i in d:
+				np.copyto(d_i, np.inf, where=~(d_i > 0))
+
+			# Each rangefinder reads the smallest positive distance, ties go to the lowest wall index
+			min_d = np.minimum(np.minimum(d[0], d[1]), np.minimum(d[2], d[3]))
+			idx = np.where(d[2] == min_d, 3, 4)
+			idx = np.where(d[1] == min_d, 2, idx)
+			idx = np.where(d[0] == min_d, 1, idx)
+			np.copyto(idx, 0, where=min_d == np.inf)
+
+			ranges[:, sensor] = min_d
+			wall_idx[:, sensor] = idx
+
+	return ranges, wall_idx
+
+
+# Version of measure_batch for small batches (e.g. sigma points), where per call overhead dominates
+# Same arithmetic, so the results are identical
+def _measure_batch_small(states):
+
+	x = states[:, 0]
+	y = states[:, 1]
+	theta = states[:, 2]
+
+	cosines = np.empty((len(states), 4))
+	np.cos(theta, out=cosines[:, 0])
+	np.cos(theta - np.pi / 2.0, out=cosines[:, 1])
+	np.cos(theta - np.pi, out=cosines[:, 2])
+	np.cos(theta - np.pi * 3.0 / 2.0, out=cosines[:, 3])
+
+	offsets = np.empty((len(states), 1, 4))
+	offsets[:, 0, 0] = 500 - x
+	offsets[:, 0, 1] = 750 - y
+	offsets[:, 0, 2] = x
+	offsets[:, 0, 3] = y
+
+	# (N,2,4) distances from the [front, right] rangefinders to each wall
+	with np.errstate(divide='ignore', invalid='ignore'):
+		d = offsets / cosines[:, _SHIFT]
+	d[~(d > 0)] = np.inf
+
+	ranges = d.min(axis=2)
+	wall_idx = np.argmax(d == ranges[:, :, None], axis=2) + 1
+	wall_idx[ranges == np.inf] = 0
+	return ranges, wall_idx
+
+
+# Fused rangefinder model and observation jacobian sharing one sine and cosine of theta
+# Accepts a single [x, y, theta] state (or State) or an (N,3) array of states and returns the
+# [front, right] rangefinder results, the indices of the walls read and the observation jacobian H,
+# shaped (2,), (2,) and (2,3) for a single state or (N,2), (N,2) and (N,2,3) for a batch.
+# Only the jacobian entries of the two walls actually read are evaluated.
+def measure_and_jacobian(states):
+
+	if hasattr(states, 'get_state'):
+		states = states.get_state()
+	states = np.asarray(states, dtype=float)
+	# Array overhead dominates for a single state, so it goes through the scalar version
+	if states.ndim == 1:
+		return _measure_and_jacobian_single(states[0], states[1], states[2])
+	n = len(states)
+	x = states[:, 0]
+	y = states[:, 1]
+	theta = states[:, 2]
+
+	c = np.cos(theta)
+	s = np.sin(theta)
+
+	# Cosine and sine of theta - k * pi / 2 for k = 0..3, the right rangefinder is shifted by one wall
+	cosines = np.stack((c, s, -c, -s), axis=1)
+	sines = np.stack((s, -c, -s, c), axis=1)
+	offsets = np.stack((500 - x, 750 - y, x, y), axis=1)
+
+	ranges = np.empty((n, 2))
+	wall_idx = np.empty((n, 2), dtype=np.int64)
+	H = np.zeros((n, 2, 3))
+	rows = np.arange(n)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		for sensor in range(2):
+			sensor_cosines = np.roll(cosines, -sensor, axis=1)
+			d = offsets / sensor_cosines
+			np.copyto(d, np.inf, where=~(d > 0))
+
+			# Each rangefinder reads the smallest positive distance
+			idx = np.argmin(d, axis=1)
+			min_d = d[rows, idx]
+			ranges[:, sensor] = min_d
+
+			# Jacobian of the selected wall: walls 1 and 3 depend on x, walls 2 and 4 on y
+			cos_sel = sensor_cosines[rows, idx]
+			sin_sel = sines[rows, (idx + sensor) % 4]
+			sign = np.where(idx < 2, -1.0, 1.0) / cos_sel
+			H[rows, sensor, idx % 2] = sign
+			H[:, sensor, 2] = offsets[rows, idx] * sin_sel / (cos_sel * cos_sel)
+
+			wall_idx[:, sensor] = np.where(min_d == np.inf, 0, idx + 1)
+			H[min_d == np.inf, sensor] = np.nan
+
+	return ranges, wall_idx, H
+
+
+# Scalar version of measure_and_jacobian for a single state
+# The results are written into the ranges, wall_idx and H arrays when given, so the caller can reuse them
+def _measure_and_jacobian_single(x, y, theta, ranges=None, wall_idx=None, H=None):
+
+	c = math.cos(theta)
+	s = math.sin(theta)
+
+	cosines = (c, s, -c, -s)
+	sines = (s, -c, -s, c)
+	offsets = (500 - x, 750 - y, x, y)
+
+	if ranges is None:
+		ranges = np.empty(2)
+		wall_idx = np.empty(2, dtype=np.int64)
+		H = np.empty((2, 3))
+	H.fill(0.0)
+	for sensor in range(2):
+		min_d = float("inf")
+		idx = -1
+		for i in range(4):
+			cos_i = cosines[(i + sensor) % 4]
+			if cos_i != 0:
+				d = offsets[i] / cos_i
+				if d > 0 and d < min_d:
+					min_d = d
+					idx = i
+		ranges[sensor] = min_d
+		wall_idx[sensor] = idx + 1
+
+		# Jacobian of the selected wall: walls 1 and 3 depend on x, walls 2 and 4 on y
+		if idx < 0:
+			H[sensor] = np.nan
+		else:
+			cos_sel = cosines[(idx + sensor) % 4]
+			H[sensor, idx % 2] = (-1.0 if idx < 2 else 1.0) / cos_sel
+			H[sensor, 2] = offsets[idx] * sines[(idx + sensor) % 4] / (cos_sel * cos_sel)
+
+	return ranges, wall_idx, H
+
+
+# Ranges and observation jacobians of every wall for both rangefinders at a single state, as data
+# association hypotheses: which wall a rangefinder reads is not known, any wall in front of it may be.
+# Returns the (2,4) [front, right] x wall ranges, inf for the walls a rangefinder points away from, the
+# (2,4) 1-based wall indices and the (2,4,3) jacobian rows.
+def wall_candidates(x, y, theta):
+
+	c = math.cos(theta)
+	s = math.sin(theta)
+
+	cosines = (c, s, -c, -s)
+	sines = (s, -c, -s, c)
+	offsets = (500 - x, 750 - y, x, y)
+
+	ranges = np.full((2, 4), np.inf)
+	H = np.zeros((2, 4, 3))
+	for sensor in range(2):
+		for i in range(4):
+			cos_i = cosines[(i + sensor) % 4]
+			if cos_i != 0:
+				d = offsets[i] / cos_i
+				if d > 0:
+					ranges[sensor, i] = d
+					H[sensor, i, i % 2] = (-1.0 if i < 2 else 1.0) / cos_i
+					H[sensor, i, 2] = offsets[i] * sines[(i + sensor) % 4] / (cos_i * cos_i)
+
+	return ranges, np.array([[1, 2, 3, 4], [1, 2, 3, 4]]), H
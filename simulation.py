@@ -1,64 +1,52 @@
-from third_party_functions import plot_covariance_ellipse
 import state
 import twowheeledrobot as twr
-import Input
+import environment
+import pipeline
+import trajectory as traj
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-
-np.random.seed(1)
 
 # Define the environment bounds
 env_W = 500
 env_L = 750
+room = environment.rectangle(env_W, env_L)
                 
-def run_simulation(init_state):
-
-    # Create our robot class
-    robot = twr.TwoWheeledRobot(initial_state=init_state)
-    # The constant input given
-    u = [1, 2]
-
-    fig, ax = plt.subplots(1)
-    
-    trajectory = []
-    # Append the initial state estimate and plot
-    estimated_state_mean = robot.estimated_state_mean.get_state_degrees()
-    covariance = robot.covariance
-    plot_covariance_ellipse((estimated_state_mean[0], estimated_state_mean[1]), 
-            covariance[0:2, 0:2], facecolor='k', alpha=0.3)
-    for i in range(15):
-
-        # Find the real state after each step
-        real_state = robot.real_state.get_state_degrees()
-        trajectory.append(real_state)
-
-        # Plot the estimate and covariance matrix after each time update
-        robot.time_update(Input.Input(u[0], u[1]))
-        estimated_state_mean = robot.estimated_state_mean.get_state_degrees()
-        covariance = robot.covariance
-        plot_covariance_ellipse((estimated_state_mean[0], estimated_state_mean[1]), 
-            covariance[0:2, 0:2], facecolor='k', alpha=0.3)
-
-        # Plot the estimate and covariance matrix after each measurement update
-        robot.measurement_update()
-        estimated_state_mean = robot.estimated_state_mean.get_state_degrees()
-        covariance = robot.covariance
-        plot_covariance_ellipse((estimated_state_mean[0], estimated_state_mean[1]), 
-            covariance[0:2, 0:2], facecolor='g', alpha=0.8)
-
-
-    # Plot the real trajectory
-    trajectory.append(robot.real_state.get_state_degrees())
-    trajectory = np.array(trajectory)
-    plt.plot(trajectory[:, 0], trajectory[:,1], color='k', lw=2)
-
-    # Plot the room bounds
-    rect = patches.Rectangle((0,0),env_W,env_L,linewidth=1,edgecolor='r',facecolor='none')
-    plt.ylim(-10, env_L+10)
-    plt.xlim(-10, env_W+10)
-    ax.add_patch(rect)
-    plt.show()
+# Runs the robot through the inputs, returns a Trajectory of its last max_steps steps (every step with None)
+# Plotting keeps the covariance ellipses of every step, so only the headless runs are fully streaming.
+def run_simulation(init_state, inputs=None, plot=True, seed=1, max_steps=10000):
+
+    # Create our robot class, seeded so runs are reproducible
+    robot = twr.TwoWheeledRobot(initial_state=init_state, environment=room, seed=seed)
+    # The constant input given, 15 steps by default
+    if inputs is None:
+        inputs = pipeline.constant_input([1, 2], 15)
+
+    trajectory = traj.Trajectory(capacity=16, max_length=max_steps)
+    trajectory.append_robot(0.0, robot)
+    consumers = [pipeline.TrajectoryLogger(trajectory)]
+
+    if plot:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(1)
+        plotter = pipeline.CovariancePlotter(ax)
+        consumers.append(plotter)
+        # Plot the initial state estimate
+        plotter.add(robot.estimated_state_mean, robot.covariance)
+
+    # Step the filter, the consumers plot and log every step
+    pipeline.run(pipeline.simulate(robot, inputs, consumers))
+
+    if plot:
+        # Plot every covariance ellipse at once, and the real trajectory
+        plotter.draw(init_state)
+
+        # Plot the room walls
+        for segment in room.segments:
+            plt.plot(segment[:, 0], segment[:, 1], color='r', lw=1)
+        plt.ylim(-10, env_L+10)
+        plt.xlim(-10, env_W+10)
+        plt.show()
+
+    return trajectory
 
 
 if __name__ == "__main__":
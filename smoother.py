@@ -0,0 +1,244 @@
+import numpy as np
+
+# Fixed interval Rauch-Tung-Striebel smoother over a recorded TwoWheeledRobot run
+# With the gains G_k = P_k F_k+1^T (P_k+1^-)^-1, the backward pass
+#   x_k^s = x_k + G_k (x_k+1^s - x_k+1^-)
+#   P_k^s = P_k + G_k (P_k+1^s - P_k+1^-) G_k^T
+# is an affine recursion x_k^s = G_k x_k+1^s + c_k, P_k^s = G_k P_k+1^s G_k^T + D_k. All gains come from
+# one batched solve, and the recursion is evaluated as a parallel (log doubling) scan over compositions
+# of these maps, so no Python loop runs over the time steps.
+
+# Time steps scanned per block, see affine_suffix_scan
+BLOCK_SIZE = 64
+
+
+# Compose every map with all maps after it along axis -3 (time) by log doubling
+# A map (A, b, D) sends (x, P) to (A x + b, A P A^T + D); on return, entry k is the composition of the
+# maps k, k+1, ..., L-1 (map k applied last)
+def _suffix_compose(A, b, D):
+
+	L = A.shape[-3]
+	d = 1
+	while d < L:
+		A_k = A[..., :L - d, :, :]
+		A_next = A[..., d:, :, :]
+		A_k_T = np.swapaxes(A_k, -1, -2)
+		b_new = np.matmul(A_k, b[..., d:, :, np.newaxis])[..., 0] + b[..., :L - d, :]
+		D_new = np.matmul(np.matmul(A_k, D[..., d:, :, :]), A_k_T) + D[..., :L - d, :, :]
+		A_new = np.matmul(A_k, A_next)
+		A[..., :L - d, :, :] = A_new
+		b[..., :L - d, :] = b_new
+		D[..., :L - d, :, :] = D_new
+		d *= 2
+	return A, b, D
+
+
+# Evaluate the backward affine recursion x_k = A_k x_k+1 + b_k, P_k = A_k P_k+1 A_k^T + D_k for k = T-1..0
+# from the terminal (x_T, P_T), returning the (T+1,3) means and (T+1,3,3) covariances
+# The maps are composed within blocks of block_size steps and then across blocks, so every step takes
+# part in log2(block_size) doubling rounds instead of log2(T).
+def affine_suffix_scan(A, b, D, x_T, P_T, block_size=BLOCK_SIZE):
+
+	T, n = b.shape
+	n_blocks = -(-T // block_size)
+	padded = n_blocks * block_size
+
+	# Pad with identity maps up to a whole number of blocks
+	A_blocks = np.zeros((padded, n, n))
+	A_blocks[:] = np.eye(n)
+	A_blocks[:T] = A
+	b_blocks = np.zeros((padded, n))
+	b_blocks[:T] = b
+	D_blocks = np.zeros((padded, n, n))
+	D_blocks[:T] = D
+	A_blocks, b_blocks, D_blocks = _suffix_compose(A_blocks.reshape(n_blocks, block_size, n, n),
+		b_blocks.reshape(n_blocks, block_size, n), D_blocks.reshape(n_blocks, block_size, n, n))
+
+	# The first map of each block now spans the whole block, composing those gives every block start
+	start_A, start_b, start_D = _suffix_compose(A_blocks[:, 0].copy(), b_blocks[:, 0].copy(), D_blocks[:, 0].copy())
+	block_x = np.empty((n_blocks + 1, n))
+	block_P = np.empty((n_blocks + 1, n, n))
+	block_x[n_blocks] = x_T
+	block_P[n_blocks] = P_T
+	block_x[:n_blocks] = np.matmul(start_A, x_T) + start_b
+	block_P[:n_blocks] = np.matmul(np.matmul(start_A, P_T), np.swapaxes(start_A, -1, -2)) + start_D
+
+	# Every step is its in block composition applied to the start of the next block
+	next_x = block_x[1:, np.newaxis, :, np.newaxis]
+	next_P = block_P[1:, np.newaxis]
+	x = np.empty((T + 1, n))
+	P = np.empty((T + 1, n, n))
+	x[:T] = (np.matmul(A_blocks, next_x)[..., 0] + b_blocks).reshape(padded, n)[:T]
+	P[:T] = (np.matmul(np.matmul(A_blocks, next_P), np.swapaxes(A_blocks, -1, -2)) + D_blocks).reshape(padded, n, n)[:T]
+	x[T] = x_T
+	P[T] = P_T
+	return x, P
+
+
+# Smoother gains G_k = P_k F_k+1^T (P_k+1^-)^-1 from batched solves
+# Singular priors (e.g. after a zero initial covariance) go through the pseudo inverse
+def smoother_gains(covariances, prior_covariances, F):
+
+	P = covariances[:-1]
+	P_prior = prior_covariances[1:]
+	# G^T = (P^-)^-1 F P, as both covariances are symmetric
+	FP = np.matmul(F[1:], P)
+
+	# Determinant relative to the product of the diagonal flags near singular priors
+	scale = P_prior[:, 0, 0] * P_prior[:, 1, 1] * P_prior[:, 2, 2]
+	regular = np.abs(np.linalg.det(P_prior)) > 1e-12 * np.abs(scale)
+
+	G_T = np.empty_like(FP)
+	G_T[regular] = np.linalg.solve(P_prior[regular], FP[regular])
+	if not np.all(regular):
+		G_T[~regular] = np.matmul(np.linalg.pinv(P_prior[~regular], hermitian=True), FP[~regular])
+	return np.swapaxes(G_T, -1, -2)
+
+
+# Single step version of smoother_gains
+def smoother_gain(covariance, prior_covariance, F):
+
+	FP = np.dot(F, covariance)
+	scale = prior_covariance[0, 0] * prior_covariance[1, 1] * prior_covariance[2, 2]
+	if abs(np.linalg.det(prior_covariance)) > 1e-12 * abs(scale):
+		return np.linalg.solve(prior_covariance, FP).T
+	return np.dot(np.linalg.pinv(prior_covariance, hermitian=True), FP).T
+
+
+# RTS smoother
+# Takes the (T+1,3) prior and posterior means, the (T+1,3,3) prior and posterior covariances and the
+# (T+1,3,3) dynamics jacobians of a run; entry 0 is the initial state (its prior and F are not used) and
+# entry k the time update into step k followed by its measurement update, as stored by RunRecorder.
+# Returns the smoothed (T+1,3) means and (T+1,3,3) covariances.
+def rts_smooth(prior_means, prior_covariances, means, covariances, F, block_size=BLOCK_SIZE):
+
+	prior_means = np.array(prior_means, dtype=float)
+	means = np.array(means, dtype=float)
+	prior_covariances = np.asarray(prior_covariances, dtype=float)
+	covariances = np.asarray(covariances, dtype=float)
+	F = np.asarray(F, dtype=float)
+	if len(means) < 2:
+		return means, covariances.copy()
+
+	# Unwrap the heading, so the recursion runs on continuous angles, with each prior next to its posterior
+	means[:, 2] = np.unwrap(means[:, 2])
+	prior_means[:, 2] = means[:, 2] + (prior_means[:, 2] - means[:, 2] + np.pi) % (2 * np.pi) - np.pi
+
+	G = smoother_gains(covariances, prior_covariances, F)
+	G_T = np.swapaxes(G, -1, -2)
+	c = means[:-1] - np.matmul(G, prior_means[1:, :, np.newaxis])[..., 0]
+	D = covariances[:-1] - np.matmul(np.matmul(G, prior_covariances[1:]), G_T)
+
+	smoothed_means, smoothed_covariances = affine_suffix_scan(G, c, D, means[-1], covariances[-1], block_size)
+	smoothed_means[:, 2] %= 2 * np.pi
+	smoothed_covariances = (smoothed_covariances + np.swapaxes(smoothed_covariances, -1, -2)) / 2.0
+	return smoothed_means, smoothed_covariances
+
+
+# Pipeline consumer storing what the smoother needs from a run, in preallocated arrays grown geometrically
+# Entry 0 is the robot's state when the recorder is created
+class RunRecorder:
+
+	def __init__(self, robot, capacity=1024):
+		self.length = 0
+		self.arrays = {
+			'prior_means': np.zeros((capacity, 3)),
+			'prior_covariances': np.zeros((capacity, 3, 3)),
+			'means': np.zeros((capacity, 3)),
+			'covariances': np.zeros((capacity, 3, 3)),
+			'F': np.zeros((capacity, 3, 3)),
+		}
+		mean = robot.estimated_state_mean.get_state()
+		self.append(mean, robot.covariance, mean, robot.covariance, np.eye(3))
+
+	def __len__(self):
+		return self.length
+
+	def __call__(self, record):
+		if record.F is None:
+			raise ValueError('the robot does not store its dynamics jacobian F, RTS smoothing needs an EKF run')
+		self.append(record.prior_mean.get_state(), record.prior_covariance, record.posterior_mean.get_state(),
+			record.covariance, record.F)
+
+	def append(self, prior_mean, prior_covariance, mean, covariance, F):
+
+		if self.length == len(self.arrays['means']):
+			for name, array in self.arrays.items():
+				grown = np.zeros((2 * len(array),) + array.shape[1:])
+				grown[:self.length] = array
+				self.arrays[name] = grown
+		i = self.length
+		self.arrays['prior_means'][i] = prior_mean
+		self.arrays['prior_covariances'][i] = prior_covariance
+		self.arrays['means'][i] = mean
+		self.arrays['covariances'][i] = covariance
+		self.arrays['F'][i] = F
+		self.length += 1
+
+	# The recorded arrays, trimmed to the recorded length
+	def __getitem__(self, name):
+		return self.arrays[name][:self.length]
+
+	# Smoothed (T+1,3) means and (T+1,3,3) covariances of the recorded run
+	def smooth(self, block_size=BLOCK_SIZE):
+		return rts_smooth(self['prior_means'], self['prior_covariances'], self['means'], self['covariances'],
+			self['F'], block_size)
+
+
+# Fixed lag smoother for online use
+# Keeps the last lag steps in ring buffers and, after every step t, smooths the estimate of step t - lag
+# with the RTS backward pass over the buffered steps. Each gain is computed once, when the step after it
+# arrives, so a step costs O(lag) and memory does not grow over time.
+# Works as a pipeline consumer; the smoothed (step, mean, covariance) of each step is stored in
+# self.smoothed, and also returned by push().
+class FixedLagSmoother:
+
+	def __init__(self, robot, lag):
+		self.lag = lag
+		size = lag + 1
+		self.means = np.zeros((size, 3)) # Posterior means
+		self.covariances = np.zeros((size, 3, 3)) # Posterior covariances
+		self.prior_means = np.zeros((size, 3)) # Priors of the step after each entry
+		self.prior_covariances = np.zeros((size, 3, 3))
+		self.gains = np.zeros((size, 3, 3)) # Smoother gain of each entry
+		self.step = -1 # Step of the newest entry
+		self.smoothed = None
+		self.push(None, None, robot.estimated_state_mean.get_state(), robot.covariance, None)
+
+	def __call__(self, record):
+		if record.F is None:
+			raise ValueError('the robot does not store its dynamics jacobian F, RTS smoothing needs an EKF run')
+		self.push(record.prior_mean.get_state(), record.prior_covariance, record.posterior_mean.get_state(),
+			record.covariance, record.F)
+
+	# Add the next step, returns the smoothed (step, mean, covariance) of step t - lag once available
+	def push(self, prior_mean, prior_covariance, mean, covariance, F):
+
+		size = self.lag + 1
+		if self.step >= 0:
+			previous = self.step % size
+			self.prior_means[previous] = prior_mean
+			self.prior_covariances[previous] = prior_covariance
+			self.gains[previous] = smoother_gain(self.covariances[previous], prior_covariance, F)
+
+		self.step += 1
+		newest = self.step % size
+		self.means[newest] = mean
+		self.covariances[newest] = covariance
+		if self.step < self.lag:
+			return None
+
+		# Backward pass from the newest filtered estimate to step t - lag
+		x = self.means[newest].copy()
+		P = self.covariances[newest].copy()
+		for k in range(self.step - 1, self.step - self.lag - 1, -1):
+			i = k % size
+			G = self.gains[i]
+			difference = x - self.prior_means[i]
+			difference[2] = (difference[2] + np.pi) % (2 * np.pi) - np.pi
+			x = self.means[i] + G.dot(difference)
+			P = self.covariances[i] + G.dot(P - self.prior_covariances[i]).dot(G.T)
+		x[2] %= 2 * np.pi
+
+		self.smoothed = (self.step - self.lag, x, (P + P.T) / 2.0)
+		return self.smoothed
@@ -1,7 +1,12 @@
 import numpy as np
 
+# Structured dtype for storing states in arrays
+STATE_DTYPE = np.dtype([('pos_x', np.float64), ('pos_y', np.float64), ('theta', np.float64)])
+
 class State:
 
+	__slots__ = ('pos_x', 'pos_y', 'theta')
+
 	def __init__(self, pos_x=0, pos_y=0, theta=0):
 		self.pos_x = pos_x
 		self.pos_y = pos_y
@@ -0,0 +1,174 @@
+import os
+import json
+import hashlib
+import itertools
+import multiprocessing
+import tempfile
+import state
+import montecarlo
+import numpy as np
+
+# Parameter sweeps of the robot over seeded Monte Carlo evaluations
+# A configuration is a dict of TwoWheeledRobot keyword arguments (b, r, f_s, Q, R, ...). Every point is
+# evaluated with run_monte_carlo in a worker of a process pool, and its summary statistics are stored in
+# an on disk cache keyed by a hash of the configuration, the seed and the Monte Carlo settings, so
+# rerunning an overlapping sweep only computes the new points.
+#   results = run_sweep(grid(b=[80, 85, 90], R=[50.0, 88.0, 150.0]))
+
+# Part of every cache key, bump when the robot model or the stored statistics change
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sweep_cache')
+
+
+# Cartesian product of the given values of each parameter, as a list of configurations
+#   grid(b=[80, 90], f_s=[1, 2]) -> [{'b': 80, 'f_s': 1}, {'b': 80, 'f_s': 2}, {'b': 90, 'f_s': 1}, ...]
+def grid(**axes):
+
+	names = list(axes)
+	return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+
+# JSON friendly form of a configuration value, numbers as floats so 85 and 85.0 give the same key
+def _canonical(value):
+
+	if isinstance(value, state.State):
+		value = value.get_state()
+	if isinstance(value, dict):
+		return {str(key): _canonical(item) for key, item in value.items()}
+	if isinstance(value, (list, tuple, np.ndarray)):
+		return [_canonical(item) for item in value]
+	if isinstance(value, (bool, np.bool_)) or value is None or isinstance(value, str):
+		return bool(value) if isinstance(value, np.bool_) else value
+	return float(value)
+
+
+# Content address of one evaluation: hash of everything its result depends on
+def cache_key(config, seed, settings):
+
+	content = {'version': CACHE_VERSION, 'config': _canonical(config), 'seed': int(seed),
+		'settings': _canonical(settings)}
+	text = json.dumps(content, sort_keys=True, separators=(',', ':'))
+	return hashlib.sha256(text.encode()).hexdigest()
+
+
+def _cache_path(cache_dir, key):
+	return os.path.join(cache_dir, key[:2], key + '.npz')
+
+
+# Summary statistics of one evaluated configuration
+class SweepResult:
+
+	def __init__(self, config, key, rmse_position, rmse_heading, mean_nees, mean_nis, n_diverged, cached=False):
+		self.config = config
+		self.key = key
+		self.rmse_position = rmse_position # (steps + 1,) over the runs that did not diverge
+		self.rmse_heading = rmse_heading # (steps + 1,)
+		self.mean_nees = mean_nees # (steps + 1,)
+		self.mean_nis = mean_nis # (steps + 1,)
+		self.n_diverged = n_diverged # Runs where the filter blew up
+		self.cached = cached # Loaded from the cache instead of computed
+
+
+# Load a cached result, None if the point has not been evaluated yet
+def load_result(cache_dir, key, config):
+
+	try:
+		with np.load(_cache_path(cache_dir, key)) as data:
+			return SweepResult(config, key, data['rmse_position'], data['rmse_heading'], data['mean_nees'],
+				data['mean_nis'], int(data['n_diverged']), cached=True)
+	except (OSError, KeyError, ValueError):
+		return None
+
+
+# Write a result to the cache; written to a temporary file first, so a crash never leaves a partial entry
+def store_result(cache_dir, result):
+
+	path = _cache_path(cache_dir, result.key)
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+	fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			np.savez(f, rmse_position=result.rmse_position, rmse_heading=result.rmse_heading,
+				mean_nees=result.mean_nees, mean_nis=result.mean_nis, n_diverged=result.n_diverged,
+				config=json.dumps(_canonical(result.config), sort_keys=True))
+		os.replace(temporary, path)
+	except BaseException:
+		os.unlink(temporary)
+		raise
+
+
+# Evaluate one configuration in this process and cache its result
+def _evaluate(task):
+
+	config, key, seed, settings, cache_dir = task
+	# Badly tuned configurations diverge, which is reported in n_diverged. The operations that meet
+	# non-finite values on the way (the straight line limit of the motion model, rays parallel to a wall,
+	# the statistics of diverged runs) ignore them where they happen, so any other numpy warning is a bug
+	results = montecarlo.run_monte_carlo(n_runs=settings['n_runs'], n_steps=settings['n_steps'],
+		initial_state=state.State(*settings['initial_state']), u=settings['u'], seed=seed, processes=0,
+		robot_kwargs=config)
+	result = SweepResult(config, key, results.rmse_position, results.rmse_heading, results.mean_nees,
+		results.mean_nis, int(np.sum(results.diverged)))
+	store_result(cache_dir, result)
+	return result
+
+
+# Evaluate every configuration with n_runs seeded Monte Carlo runs, returns a SweepResult per configuration
+# All configurations share the seed, so they are compared on the same noise. Points found in cache_dir
+# are loaded, the others are spread over a pool of processes workers (all cores by default), one
+# configuration per task, and cached as soon as they finish.
+def run_sweep(configs, n_runs=100, n_steps=15, initial_state=state.State(400, 375, np.pi / 2.0), u=(1, 2),
+		seed=1, cache_dir=DEFAULT_CACHE_DIR, processes=None, progress=None):
+
+	settings = {'n_runs': n_runs, 'n_steps': n_steps, 'initial_state': tuple(initial_state.get_state()),
+		'u': tuple(u)}
+	configs = [dict(config) for config in configs]
+	keys = [cache_key(config, seed, settings) for config in configs]
+
+	results = [load_result(cache_dir, key, config) for key, config in zip(keys, configs)]
+	# Identical configurations are only evaluated once
+	missing = {}
+	for i, result in enumerate(results):
+		if result is None:
+			missing.setdefault(keys[i], []).append(i)
+	tasks = [(configs[indices[0]], key, seed, settings, cache_dir) for key, indices in missing.items()]
+
+	if tasks:
+		if processes is None:
+			processes = multiprocessing.cpu_count()
+		if processes == 0:
+			evaluated = map(_evaluate, tasks)
+			pool = None
+		else:
+			pool = multiprocessing.Pool(min(processes, len(tasks)))
+			evaluated = pool.imap_unordered(_evaluate, tasks)
+		try:
+			for n_done, result in enumerate(evaluated, 1):
+				for i in missing[result.key]:
+					results[i] = SweepResult(configs[i], result.key, result.rmse_position, result.rmse_heading,
+						result.mean_nees, result.mean_nis, result.n_diverged)
+				if progress is not None:
+					progress(n_done, len(tasks))
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+
+	return results
+
+
+if __name__ == "__main__":
+	import time
+
+	# Filter tuning: assumed process and measurement noise variances around the true ones
+	configs = grid(Q=[(np.pi / 6.0) ** 2 * scale for scale in (0.25, 0.5, 1.0, 2.0, 4.0)],
+		R=[9.375 ** 2 * scale for scale in (0.25, 0.5, 1.0, 2.0, 4.0)])
+	start = time.perf_counter()
+	results = run_sweep(configs)
+	print("%d configurations (%d from the cache) in %.1f s" % (len(results), sum(result.cached for result in results),
+		time.perf_counter() - start))
+	for result in sorted(results, key=lambda result: result.rmse_position[-1]):
+		print("Q %8.4f  R %8.2f  final rmse position %8.3f  heading %6.3f  mean nees %7.3f  nis %7.3f  diverged %d" % (
+			result.config['Q'], result.config['R'], result.rmse_position[-1], result.rmse_heading[-1],
+			result.mean_nees[-1], result.mean_nis[-1], result.n_diverged))
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import Input
+import batchtwowheeledrobot as btwr
+import state
+import twowheeledrobot as twr
+
+
+# Fixed measurement noise in place of the robot's noise stream
+class FixedNoise:
+
+	def __init__(self, values):
+		self.values = values
+
+	def next(self):
+		return self.values
+
+
+def random_filters(n, seed=0):
+	rng = np.random.default_rng(seed)
+	means = np.column_stack((rng.uniform(100, 400, n), rng.uniform(100, 650, n), rng.uniform(0, 2 * np.pi, n)))
+	A = rng.normal(size=(n, 3, 3)) * [5.0, 5.0, 0.05]
+	return means, A @ A.transpose(0, 2, 1)
+
+
+def scalar_robot(mean, covariance, f_s=1):
+	robot = twr.TwoWheeledRobot(initial_state=state.State(*mean), f_s=f_s, association=None)
+	robot.covariance = covariance.copy()
+	return robot
+
+
+@pytest.mark.parametrize('u', [(1.0, 2.0), (1.5, 1.5), (-1.0, 0.5)])
+def test_time_update_matches_scalar_ekf(u):
+	means, covariances = random_filters(20)
+	batch = btwr.BatchTwoWheeledRobot(20, f_s=2)
+	batch.estimated_state_means = means.copy()
+	batch.covariances = covariances.copy()
+	batch.estimated_state_update(u)
+
+	for i in range(20):
+		robot = scalar_robot(means[i], covariances[i], f_s=2)
+		robot.estimated_state_update(Input.Input(*u))
+		assert batch.estimated_state_means[i] == pytest.approx(robot.estimated_state_mean.get_state(), rel=1e-9)
+		assert batch.covariances[i] == pytest.approx(robot.covariance, rel=1e-9, abs=1e-9)
+
+
+def test_measurement_update_matches_scalar_ekf():
+	means, covariances = random_filters(20, seed=1)
+	noise = np.random.default_rng(2).normal(size=(20, 2))
+	batch = btwr.BatchTwoWheeledRobot(20)
+	# With the real states at the estimates, the walls seen from the real states are those the scalar
+	# filter predicts from its estimate
+	batch.real_states = means.copy()
+	batch.estimated_state_means = means.copy()
+	batch.covariances = covariances.copy()
+	batch.noise.measurement = FixedNoise(noise)
+	batch.measurement_update()
+
+	y = batch.measure(means)[0] + 9.375 * noise
+	for i in range(20):
+		robot = scalar_robot(means[i], covariances[i])
+		robot.measurement_update(y[i])
+		assert batch.estimated_state_means[i] == pytest.approx(robot.estimated_state_mean.get_state(), rel=1e-9)
+		# The two forms of P - K H P cancel differently in the small entries
+		assert batch.covariances[i] == pytest.approx(robot.covariance, rel=1e-7, abs=1e-6)
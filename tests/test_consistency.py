@@ -0,0 +1,94 @@
+import math
+
+import numpy as np
+import pytest
+
+from consistency import ConsistencyMonitor, chi2_quantile
+
+
+def feed(monitor, values):
+	for value in values:
+		monitor.add(float(value))
+	return monitor
+
+
+def test_chi2_quantile_matches_scipy():
+	chi2 = pytest.importorskip('scipy.stats').chi2
+	for p in (0.0005, 0.05, 0.5, 0.95, 0.999, 0.9995):
+		assert chi2_quantile(p, 2) == pytest.approx(chi2.ppf(p, 2), rel=1e-12)
+		for dof in (3, 10, 40, 200):
+			if p >= 0.5:
+				assert chi2_quantile(p, dof) == pytest.approx(chi2.ppf(p, dof), rel=0.03)
+		# The lower tail only holds up with many degrees of freedom, as for the window sum
+		for dof in (40, 200):
+			assert chi2_quantile(p, dof) == pytest.approx(chi2.ppf(p, dof), rel=0.01)
+
+
+def test_update_is_the_nis():
+	rng = np.random.default_rng(0)
+	for _ in range(20):
+		A = rng.normal(size=(2, 2))
+		S = A @ A.T + np.eye(2)
+		v = rng.normal(size=2)
+		assert ConsistencyMonitor().update(v, S) == pytest.approx(v @ np.linalg.solve(S, v))
+		assert ConsistencyMonitor().update(v.reshape(2, 1), S) == pytest.approx(v @ np.linalg.solve(S, v))
+
+
+# The tests run at every update, so a consistent filter is in alarm on about 1 - probability of its updates
+def test_consistent_stream_false_alarm_rate():
+	monitor = ConsistencyMonitor()
+	high = low = 0
+	for value in np.random.default_rng(1).chisquare(2, 200000):
+		monitor.add(float(value))
+		high += monitor.high
+		low += monitor.low
+	assert high / monitor.n_updates < 3 * (1.0 - monitor.probability)
+	assert low / monitor.n_updates < 3 * (1.0 - monitor.probability)
+	assert monitor.mean == pytest.approx(2.0, rel=0.02)
+	assert monitor.variance == pytest.approx(4.0, rel=0.05)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_consistent_stream_stays_quiet(seed):
+	monitor = feed(ConsistencyMonitor(probability=0.99999), np.random.default_rng(seed).chisquare(2, 1000))
+	assert monitor.n_high_alarms == 0
+	assert monitor.n_low_alarms == 0
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_inflated_stream_raises_high_alarm(seed):
+	monitor = feed(ConsistencyMonitor(), 1.5 * np.random.default_rng(seed).chisquare(2, 1000))
+	assert monitor.n_high_alarms > 0
+	assert monitor.n_low_alarms == 0
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_deflated_stream_raises_low_alarm(seed):
+	monitor = feed(ConsistencyMonitor(), 0.5 * np.random.default_rng(seed).chisquare(2, 1000))
+	assert monitor.n_low_alarms > 0
+	assert monitor.n_high_alarms == 0
+
+
+def test_single_divergent_update_alarms_unless_capped():
+	values = [2.0] * 50 + [1e4] + [2.0] * 10
+	alarms = []
+	monitor = feed(ConsistencyMonitor(on_alarm=lambda monitor, kind: alarms.append((monitor.n_updates, kind))), values)
+	assert alarms == [(51, 'high')]
+	assert monitor.n_exceedances == 1
+
+	capped = ConsistencyMonitor(inflation=2.5, cap=chi2_quantile(0.999, 2))
+	feed(capped, values)
+	assert capped.n_high_alarms == 0
+	assert capped.n_exceedances == 1
+	assert capped.mean == monitor.mean
+
+
+def test_invalid_values_alarm_without_entering_the_statistics():
+	monitor = feed(ConsistencyMonitor(), [1.0, math.nan, 3.0])
+	assert monitor.update(np.array([1.0, 1.0]), np.zeros((2, 2))) == math.inf
+	counters = monitor.counters()
+	assert counters['updates'] == 2
+	assert counters['invalid'] == 2
+	assert counters['nis_mean'] == 2.0
+	assert counters['high_alarms'] == 2
+	assert counters['alarm_high'] == 1
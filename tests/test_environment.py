@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import environment
+import rangefinder
+
+
+# Room with a few pillars, so the BVH has several levels
+def furnished_room():
+	pillars = [[(x, y), (x + 30, y), (x + 30, y + 20), (x, y + 20)] for x in (60, 200, 380) for y in (100, 350, 600)]
+	return environment.from_polygons([[(500, 0), (500, 750), (0, 750), (0, 0)]] + pillars)
+
+
+# Nearest hit of every ray against every wall, the reference for the BVH traversal
+def brute_force_cast(room, origins, directions):
+	u = directions[:, np.newaxis, :]
+	e = room.edges[np.newaxis]
+	w = room.starts[np.newaxis] - origins[:, np.newaxis, :]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		denom = u[..., 0] * e[..., 1] - u[..., 1] * e[..., 0]
+		t = (w[..., 0] * e[..., 1] - w[..., 1] * e[..., 0]) / denom
+		s = (w[..., 0] * u[..., 1] - w[..., 1] * u[..., 0]) / denom
+	t[~((denom != 0) & (t > 0) & (s >= 0) & (s <= 1))] = np.inf
+	return t.min(axis=1), np.where(np.isfinite(t.min(axis=1)), t.argmin(axis=1), -1)
+
+
+def random_rays(n, seed=0):
+	rng = np.random.default_rng(seed)
+	origins = np.column_stack((rng.uniform(1, 499, n), rng.uniform(1, 749, n)))
+	angles = rng.uniform(0, 2 * np.pi, n)
+	# Some rays along the axes, parallel to the walls
+	angles[::10] = rng.integers(0, 4, len(angles[::10])) * np.pi / 2.0
+	return origins, np.column_stack((np.cos(angles), np.sin(angles)))
+
+
+@pytest.mark.parametrize('leaf_size', [1, environment.LEAF_SIZE, 100])
+def test_bvh_cast_matches_brute_force(leaf_size):
+	room = environment.Environment(furnished_room().segments, leaf_size=leaf_size)
+	origins, directions = random_rays(1000)
+	expected_t, expected_wall = brute_force_cast(room, origins, directions)
+
+	t, wall = room.cast(origins, directions)
+	assert t == pytest.approx(expected_t, rel=1e-12)
+	assert wall.tolist() == expected_wall.tolist()
+	for i in range(0, 1000, 7):
+		single_t, single_wall = room.cast_single(*origins[i], *directions[i])
+		assert single_t == pytest.approx(expected_t[i], rel=1e-12)
+		assert single_wall == expected_wall[i]
+
+
+def test_rectangle_matches_rangefinder():
+	rng = np.random.default_rng(1)
+	states = np.column_stack((rng.uniform(1, 499, 300), rng.uniform(1, 749, 300), rng.uniform(0, 2 * np.pi, 300)))
+	room = environment.rectangle()
+	ranges, wall_idx, H = room.measure_and_jacobian(states)
+	expected_ranges, expected_wall_idx, expected_H = rangefinder.measure_and_jacobian(states)
+	assert ranges == pytest.approx(expected_ranges, rel=1e-9)
+	assert wall_idx.tolist() == expected_wall_idx.tolist()
+	assert H == pytest.approx(expected_H, rel=1e-6, abs=1e-9)
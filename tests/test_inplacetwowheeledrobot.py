@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+import Input
+import inplacetwowheeledrobot as iptwr
+import pipeline
+import state
+import twowheeledrobot as twr
+
+
+def pair(association, seed=0):
+	initial_state = state.State(400, 375, np.pi / 2.0)
+	return (twr.TwoWheeledRobot(initial_state=initial_state, seed=seed, association=association),
+		iptwr.InPlaceTwoWheeledRobot(initial_state=initial_state, seed=seed, association=association))
+
+
+def assert_same_estimate(robot, in_place):
+	assert in_place.estimated_state_mean.get_state() == pytest.approx(robot.estimated_state_mean.get_state(),
+		rel=1e-9, abs=1e-9)
+	assert in_place.covariance == pytest.approx(robot.covariance, rel=1e-7, abs=1e-7)
+
+
+# 'truth' is left out: on this run it diverges, and rounding differences then grow without bound
+@pytest.mark.parametrize('association', ['best', 'mixture'])
+def test_simulation_matches_ekf(association):
+	robot, in_place = pair(association)
+	for expected, record in zip(pipeline.simulate(robot, pipeline.constant_input((1, 2), 15)),
+			pipeline.simulate(in_place, pipeline.constant_input((1, 2), 15))):
+		assert record.true_state.get_state() == expected.true_state.get_state()
+		assert record.F == pytest.approx(expected.F, rel=1e-7)
+		assert_same_estimate(robot, in_place)
+
+
+def test_predict_and_update_match_ekf():
+	robot, in_place = pair(None, seed=1)
+	reference = twr.TwoWheeledRobot(initial_state=state.State(400, 375, np.pi / 2.0), seed=1)
+	for i in range(15):
+		w_l, w_r = 1.0, 2.0 + 0.1 * i
+		reference.real_state_update(Input.Input(w_l, w_r))
+		z = reference.measure_and_jacobian(reference.real_state)[0] + 9.375 * np.asarray(reference.noise.measurement.next())
+		robot.estimated_state_update(Input.Input(w_l, w_r), 0.5)
+		in_place.predict(w_l, w_r, 0.5)
+		assert_same_estimate(robot, in_place)
+		robot.measurement_update(z)
+		in_place.update(z)
+		assert_same_estimate(robot, in_place)
+		assert in_place.last_innovation == pytest.approx(robot.last_innovation, rel=1e-9)
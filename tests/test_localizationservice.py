@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import Input
+import localizationservice
+import sensorlog
+import state
+import twowheeledrobot as twr
+
+
+def new_robot():
+	return twr.TwoWheeledRobot(initial_state=state.State(400, 375, np.pi / 2.0), f_s=10)
+
+
+# (t, kind, a, b) messages of a simulated robot: a command every 0.1 s followed by a reading 0.05 s later
+def simulated_messages(n_steps=20, seed=0):
+	robot = twr.TwoWheeledRobot(initial_state=state.State(400, 375, np.pi / 2.0), f_s=10, seed=seed)
+	u = Input.Input(1, 2)
+	messages = []
+	for i in range(n_steps):
+		messages.append((0.1 * i, sensorlog.INPUT, 1.0, 2.0))
+		robot.real_state_update(u)
+		y = robot.measure_and_jacobian(robot.real_state)[0] + 9.375 * np.asarray(robot.noise.measurement.next())
+		messages.append((0.1 * i + 0.05, sensorlog.MEASUREMENT, float(y[0]), float(y[1])))
+	return messages
+
+
+def run(messages, window=0.5):
+	track = localizationservice.TrackedRobot(new_robot(), t0=messages[0][0], window=window)
+	used = [track.ingest(*message) for message in messages]
+	return track, used
+
+
+def test_message_stamped_before_the_first_one_is_used():
+	messages = simulated_messages()
+	expected, _ = run(messages)
+
+	# The second message was sent first but arrived second
+	late_first = [messages[1], messages[0]] + messages[2:]
+	track, used = run(late_first)
+	assert all(used)
+	assert track.n_dropped == 0
+	assert track.robot.estimated_state_mean.get_state() == pytest.approx(expected.robot.estimated_state_mean.get_state())
+	assert track.robot.covariance == pytest.approx(expected.robot.covariance)
+
+
+def test_message_older_than_the_window_is_dropped():
+	messages = simulated_messages()
+	track, _ = run(messages[2:])
+	assert not track.ingest(*messages[0])
+	assert track.n_dropped == 1
+
+
+def test_service_requires_a_robot_factory():
+	with pytest.raises(TypeError):
+		localizationservice.LocalizationService()
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_reordering_within_the_window_matches_time_order(seed):
+	messages = simulated_messages(n_steps=40, seed=seed)
+	expected, _ = run(messages)
+
+	# Every message is delayed by up to 0.4 s, less than the window, and arrives in the delayed order
+	delays = np.random.default_rng(seed).uniform(0.0, 0.4, len(messages))
+	arrival = [messages[i] for i in np.argsort([message[0] + delay for message, delay in zip(messages, delays)],
+		kind='stable')]
+	track = localizationservice.TrackedRobot(new_robot(), t0=arrival[0][0])
+	assert all(track.ingest(*message) for message in arrival)
+	assert track.n_reordered > 0
+	assert track.n_dropped == 0
+	assert track.t == expected.t
+	assert track.robot.estimated_state_mean.get_state() == pytest.approx(expected.robot.estimated_state_mean.get_state(),
+		rel=1e-9)
+	assert track.robot.covariance == pytest.approx(expected.robot.covariance, rel=1e-9, abs=1e-12)
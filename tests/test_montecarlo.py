@@ -0,0 +1,58 @@
+import numpy as np
+
+import montecarlo
+
+
+# Results arrays for the given [run][step] errors, with a unit covariance after the initial state
+def results_with_errors(errors, estimated_xy=(250.0, 375.0)):
+	n_runs, n_steps = len(errors), len(errors[0])
+	true_states = np.zeros((n_runs, n_steps, 3))
+	true_states[..., 0:2] = estimated_xy
+	estimated_states = true_states.copy()
+	estimated_states -= np.asarray(errors, dtype=float)
+	covariances = np.tile(np.eye(3), (n_runs, n_steps, 1, 1))
+	covariances[:, 0] = 0.0
+	return true_states, estimated_states, covariances
+
+
+def test_large_nees_diverges_from_that_step():
+	errors = [[[0, 0, 0], [1, 0, 0], [0, 1, 0.5], [1, 1, 0]],
+		[[0, 0, 0], [1, 0, 0], [10, 0, 0], [1, 0, 0]],
+		[[0, 0, 0], [0, 1, 0], [0, 0, 0], [30, 0, 0]]]
+	results = montecarlo.MonteCarloResults(*results_with_errors(errors))
+
+	assert results.nees_bound > 20
+	assert results.diverged.tolist() == [False, True, True]
+	assert results.tracking.tolist() == [[True] * 4, [True, True, False, False], [True, True, True, False]]
+	# A run that recovers stays excluded, and the statistics only cover the runs still tracking
+	assert np.isnan(results.nees[1, 3])
+	assert results.mean_nees[2] == (results.nees[0, 2] + results.nees[2, 2]) / 2
+	assert results.mean_nees[3] == results.nees[0, 3]
+	assert results.rmse_position[3] == np.sqrt(2.0)
+
+
+def test_position_outside_the_room_diverges():
+	errors = np.zeros((2, 3, 3))
+	true_states, estimated_states, covariances = results_with_errors(errors)
+	estimated_states[1, 2, 1] = 760.0
+	covariances[1, 2] *= 1e6
+	results = montecarlo.MonteCarloResults(true_states, estimated_states, covariances)
+
+	assert results.diverged.tolist() == [False, True]
+	results = montecarlo.MonteCarloResults(true_states, estimated_states, covariances,
+		bounds=((0.0, 0.0), (500.0, 800.0)))
+	assert not results.diverged.any()
+
+
+def test_non_finite_diverges():
+	errors = np.zeros((2, 3, 3))
+	true_states, estimated_states, covariances = results_with_errors(errors)
+	covariances[0, 1, 0, 0] = np.nan
+	results = montecarlo.MonteCarloResults(true_states, estimated_states, covariances)
+
+	assert results.diverged.tolist() == [True, False]
+	assert results.tracking[0].tolist() == [True, False, False]
+
+
+def test_default_room_bounds():
+	assert montecarlo.room_bounds() == ((0.0, 0.0), (500.0, 750.0))
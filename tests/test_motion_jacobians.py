@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import state
+import Input
+import twowheeledrobot as twr
+import inplacetwowheeledrobot as ip
+import batchtwowheeledrobot as bt
+
+# (x, y, theta) and (w_l, w_r): turning left, driving straight, turning on the spot backwards
+CASES = [
+	((100.0, 200.0, 0.7), (1.0, 2.0)),
+	((100.0, 200.0, 2.0), (1.5, 1.5)),
+	((300.0, 100.0, 4.0), (2.0, -1.0)),
+	((250.0, 375.0, 5.9), (-1.0, -0.5)),
+]
+STEP = 1e-4 # Central difference step, in mm, rad and rad/s
+
+
+def motion(x, w, dt=1.0):
+	robot = twr.TwoWheeledRobot(initial_state=state.State(*x), f_s=1.0 / dt)
+	robot.estimated_state_update(Input.Input(*w))
+	return np.array(robot.estimated_state_mean.get_state())
+
+
+# Finite difference dynamics and process noise jacobians of the motion model
+def numeric_jacobians(x, w, dt=1.0):
+	x = np.array(x)
+	w = np.array(w)
+	F = np.zeros((3, 3))
+	W = np.zeros((3, 2))
+	for i in range(3):
+		d = np.zeros(3)
+		d[i] = STEP
+		F[:, i] = (motion(x + d, w, dt) - motion(x - d, w, dt)) / (2 * STEP)
+	for j in range(2):
+		d = np.zeros(2)
+		d[j] = STEP
+		W[:, j] = (motion(x, w + d, dt) - motion(x, w - d, dt)) / (2 * STEP)
+	return F, W
+
+
+def analytic_jacobians(x, w, dt=1.0):
+	robot = twr.TwoWheeledRobot(initial_state=state.State(*x), f_s=1.0 / dt)
+	W = robot.get_process_noise_jacobian(Input.Input(*w))
+	robot.estimated_state_update(Input.Input(*w))
+	return robot.F, W
+
+
+@pytest.mark.parametrize('x, w', CASES)
+@pytest.mark.parametrize('dt', [1.0, 0.25])
+def test_scalar_jacobians_match_finite_differences(x, w, dt):
+	F, W = analytic_jacobians(x, w, dt)
+	F_num, W_num = numeric_jacobians(x, w, dt)
+	np.testing.assert_allclose(F, F_num, atol=1e-5)
+	np.testing.assert_allclose(W, W_num, atol=1e-5)
+
+
+@pytest.mark.parametrize('x, w', CASES)
+def test_in_place_jacobians_match_scalar(x, w):
+	F, W = analytic_jacobians(x, w)
+	robot = ip.InPlaceTwoWheeledRobot(initial_state=state.State(*x))
+	robot.predict(*w)
+	np.testing.assert_allclose(robot.F, F, atol=1e-12)
+	np.testing.assert_allclose(robot._W, W, atol=1e-12)
+
+
+def test_batch_jacobians_match_finite_differences():
+	states = np.array([x for x, _ in CASES])
+	u = np.array([w for _, w in CASES])
+	robot = bt.BatchTwoWheeledRobot(len(CASES))
+	robot.estimated_state_means = states.copy()
+	W = robot.get_process_noise_jacobian(u)
+	_, df_dtheta = robot.motion_model(states, u)
+	for i, (x, w) in enumerate(CASES):
+		F_num, W_num = numeric_jacobians(x, w)
+		np.testing.assert_allclose(df_dtheta[i], F_num[0:2, 2], atol=1e-5)
+		np.testing.assert_allclose(W[i], W_num, atol=1e-5)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import rangefinder
+import state
+import twowheeledrobot as twr
+
+
+def random_states(n, seed=0):
+	rng = np.random.default_rng(seed)
+	return np.column_stack((rng.uniform(1, 499, n), rng.uniform(1, 749, n), rng.uniform(0, 2 * np.pi, n)))
+
+
+# Both the compact path for small batches and the one for large batches
+@pytest.mark.parametrize('n', [5, rangefinder.SMALL_BATCH, 500])
+def test_measure_batch_matches_measure(n):
+	states = random_states(n)
+	robot = twr.TwoWheeledRobot()
+	ranges, wall_idx = rangefinder.measure_batch(states)
+	for i, (x, y, theta) in enumerate(states):
+		y_t, front_wall_idx, right_wall_idx = robot.measure(state.State(x, y, theta))
+		assert ranges[i] == pytest.approx(y_t.get_measurement(), rel=1e-12)
+		assert wall_idx[i].tolist() == [front_wall_idx, right_wall_idx]
+
+
+def test_measure_and_jacobian_batch_matches_single_states():
+	states = random_states(200, seed=1)
+	robot = twr.TwoWheeledRobot()
+	ranges, wall_idx, H = rangefinder.measure_and_jacobian(states)
+	assert ranges == pytest.approx(rangefinder.measure_batch(states)[0], rel=1e-12)
+	for i, (x, y, theta) in enumerate(states):
+		single_ranges, single_wall_idx, single_H = rangefinder.measure_and_jacobian(states[i])
+		assert ranges[i] == pytest.approx(single_ranges, rel=1e-12)
+		assert wall_idx[i].tolist() == list(single_wall_idx)
+		assert H[i] == pytest.approx(single_H, rel=1e-9)
+		assert H[i] == pytest.approx(robot.get_observation_jacobian(x, y, theta, *wall_idx[i]), rel=1e-9)
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from numpy.lib.recfunctions import structured_to_unstructured
+
+import inplacetwowheeledrobot as iptwr
+import pipeline
+import sensorlog
+import state
+import twowheeledrobot as twr
+
+
+def initial_state():
+	return state.State(400, 375, np.pi / 2.0)
+
+
+# Log a simulated run through the recorder, returning its records
+def record_run(path, n_steps=40, buffer_size=7):
+	robot = twr.TwoWheeledRobot(initial_state=initial_state(), f_s=4, seed=0)
+	with sensorlog.SensorLogRecorder(path, buffer_size=buffer_size) as recorder:
+		return list(pipeline.simulate(robot, pipeline.constant_input((1, 2), n_steps), consumers=[recorder]))
+
+
+def test_log_round_trip(tmp_path):
+	path = tmp_path / 'run.twrlog'
+	records = record_run(path)
+
+	log = sensorlog.open_log(path)
+	assert len(log) == 2 * len(records)
+	assert log['kind'].tolist() == [sensorlog.INPUT, sensorlog.MEASUREMENT] * len(records)
+	inputs = log[log['kind'] == sensorlog.INPUT]
+	measurements = log[log['kind'] == sensorlog.MEASUREMENT]
+	assert inputs['t'].tolist() == [0.0] + [record.t for record in records[:-1]]
+	assert np.column_stack((inputs['a'], inputs['b'])).tolist() == [list(record.u.get_input()) for record in records]
+	assert measurements['t'].tolist() == [record.t for record in records]
+	assert np.column_stack((measurements['a'], measurements['b'])).tolist() == [
+		list(record.measurement.get_measurement()) for record in records]
+
+
+def test_replay_reproduces_the_estimates(tmp_path):
+	path = tmp_path / 'run.twrlog'
+	records = record_run(path)
+
+	replayed = list(sensorlog.replay(twr.TwoWheeledRobot(initial_state=initial_state(), f_s=4), path))
+	assert len(replayed) == len(records)
+	for record, expected in zip(replayed, records):
+		assert record.t == expected.t
+		assert record.posterior_mean.get_state() == pytest.approx(expected.posterior_mean.get_state(), rel=1e-9)
+		assert record.covariance == pytest.approx(expected.covariance, rel=1e-7, abs=1e-9)
+
+
+def test_replay_estimates_fast_path_matches_replay(tmp_path):
+	path = tmp_path / 'run.twrlog'
+	record_run(path)
+
+	expected = sensorlog.replay_estimates(twr.TwoWheeledRobot(initial_state=initial_state(), f_s=4, association=None), path)
+	fast = sensorlog.replay_estimates(iptwr.InPlaceTwoWheeledRobot(initial_state=initial_state(), f_s=4,
+		association=None), path)
+	assert len(fast) == len(expected)
+	assert fast.data['t'].tolist() == expected.data['t'].tolist()
+	for name in ('estimate', 'input', 'measurement'):
+		assert structured_to_unstructured(fast.data[name]) == pytest.approx(
+			structured_to_unstructured(expected.data[name]), rel=1e-9)
+	assert fast.data['covariance'] == pytest.approx(expected.data['covariance'], rel=1e-7, abs=1e-9)
+
+
+def test_open_log_rejects_other_files(tmp_path):
+	path = tmp_path / 'other.bin'
+	path.write_bytes(b'not a sensor log at all')
+	with pytest.raises(ValueError, match='not a sensor log'):
+		sensorlog.open_log(path)
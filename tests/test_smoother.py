@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import pipeline
+import smoother
+import state
+import twowheeledrobot as twr
+
+
+def recorded_run(n_steps, seed=0):
+	robot = twr.TwoWheeledRobot(initial_state=state.State(400, 375, np.pi / 2.0), f_s=4, seed=seed,
+		association='mixture')
+	recorder = smoother.RunRecorder(robot, capacity=4)
+	pipeline.run(pipeline.simulate(robot, pipeline.constant_input((1, 2), n_steps), consumers=[recorder]))
+	return recorder
+
+
+# The textbook RTS backward pass, one step at a time with explicit inverses
+def naive_rts(prior_means, prior_covariances, means, covariances, F):
+	means = np.array(means)
+	means[:, 2] = np.unwrap(means[:, 2])
+	prior_means = np.array(prior_means)
+	prior_means[:, 2] = means[:, 2] + (prior_means[:, 2] - means[:, 2] + np.pi) % (2 * np.pi) - np.pi
+	x = means.copy()
+	P = np.array(covariances)
+	for k in range(len(means) - 2, -1, -1):
+		G = covariances[k] @ F[k + 1].T @ np.linalg.pinv(prior_covariances[k + 1])
+		x[k] = means[k] + G @ (x[k + 1] - prior_means[k + 1])
+		P[k] = covariances[k] + G @ (P[k + 1] - prior_covariances[k + 1]) @ G.T
+	x[:, 2] %= 2 * np.pi
+	return x, P
+
+
+@pytest.mark.parametrize('n_steps, block_size', [(1, 64), (40, 64), (150, 8), (150, 64)])
+def test_rts_smooth_matches_naive_backward_pass(n_steps, block_size):
+	recorder = recorded_run(n_steps)
+	arrays = [recorder[name] for name in ('prior_means', 'prior_covariances', 'means', 'covariances', 'F')]
+	expected_means, expected_covariances = naive_rts(*arrays)
+
+	means, covariances = recorder.smooth(block_size)
+	assert means == pytest.approx(expected_means, rel=1e-6, abs=1e-6)
+	assert covariances == pytest.approx(expected_covariances, rel=1e-5, abs=1e-6)
+
+
+def test_fixed_lag_smoother_matches_rts_over_its_lag():
+	robot = twr.TwoWheeledRobot(initial_state=state.State(400, 375, np.pi / 2.0), f_s=4, seed=1,
+		association='mixture')
+	recorder = smoother.RunRecorder(robot)
+	fixed_lag = smoother.FixedLagSmoother(robot, lag=5)
+	outputs = []
+	for record in pipeline.simulate(robot, pipeline.constant_input((1, 2), 30), consumers=[recorder]):
+		outputs.append(fixed_lag.push(record.prior_mean.get_state(), record.prior_covariance,
+			record.posterior_mean.get_state(), record.covariance, record.F))
+
+	# Step t - 5, smoothed over the steps up to t, is the full RTS result of the run cut at step t
+	t = 30
+	step, mean, covariance = outputs[-1]
+	assert step == t - 5
+	arrays = [recorder[name][:t + 1] for name in ('prior_means', 'prior_covariances', 'means', 'covariances', 'F')]
+	expected_means, expected_covariances = naive_rts(*arrays)
+	assert mean == pytest.approx(expected_means[step], rel=1e-6, abs=1e-6)
+	assert covariance == pytest.approx(expected_covariances[step], rel=1e-5, abs=1e-6)
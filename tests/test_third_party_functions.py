@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import third_party_functions as tpf
+
+
+def random_covariances(rng, shape, n):
+	A = rng.normal(size=shape + (n, n))
+	return A @ np.swapaxes(A, -1, -2) + 0.1 * np.eye(n)
+
+
+def test_mahalanobis_batch_matches_mahalanobis():
+	rng = np.random.default_rng(0)
+	x = rng.normal(size=(50, 3))
+	mean = rng.normal(size=(50, 3))
+	cov = random_covariances(rng, (50,), 3)
+	expected = [tpf.mahalanobis(x[i], mean[i], cov[i]) for i in range(50)]
+	assert tpf.mahalanobis_batch(x, mean, cov) == pytest.approx(expected, rel=1e-10)
+
+
+def test_logpdf_batch_matches_logpdf():
+	pytest.importorskip('scipy')
+	rng = np.random.default_rng(1)
+	x = rng.normal(size=(50, 2))
+	mean = rng.normal(size=(50, 2))
+	cov = random_covariances(rng, (50,), 2)
+	expected = [tpf.logpdf(x[i], mean[i], cov[i]) for i in range(50)]
+	logpdf, d2 = tpf.logpdf_batch(x, mean, cov, return_mahalanobis=True)
+	assert logpdf == pytest.approx(expected, rel=1e-10)
+	assert d2 == pytest.approx(tpf.mahalanobis_batch(x, mean, cov) ** 2, rel=1e-10)
+	assert tpf.logpdf_batch(x, mean, 2.0) == pytest.approx([tpf.logpdf(x[i], mean[i], 2.0 * np.eye(2))
+		for i in range(50)], rel=1e-10)
+
+
+def test_log_likelihood_batch_matches_log_likelihood():
+	pytest.importorskip('scipy')
+	rng = np.random.default_rng(2)
+	z = rng.normal(size=(20, 2))
+	x = rng.normal(size=(20, 3))
+	P = random_covariances(rng, (20,), 3)
+	H = rng.normal(size=(20, 2, 3))
+	R = np.eye(2) * 0.5
+	expected = [tpf.log_likelihood(z[i], x[i], P[i], H[i], R) for i in range(20)]
+	assert tpf.log_likelihood_batch(z, x, P, H, R) == pytest.approx(expected, rel=1e-10)
+	assert tpf.likelihood_batch(z, x, P, H, R) == pytest.approx(np.exp(expected), rel=1e-10)
+
+
+def test_ness_batch_matches_ness():
+	pytest.importorskip('scipy')
+	rng = np.random.default_rng(3)
+	xs = rng.normal(size=(4, 30, 3))
+	est_xs = rng.normal(size=(4, 30, 3))
+	ps = random_covariances(rng, (4, 30), 3)
+	batch = tpf.NESS_batch(xs, est_xs, ps)
+	assert batch.shape == (4, 30)
+	for run in range(4):
+		assert batch[run] == pytest.approx(tpf.NESS(xs[run], est_xs[run], ps[run]), rel=1e-10)
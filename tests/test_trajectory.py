@@ -0,0 +1,24 @@
+import pytest
+
+import trajectory as traj
+
+
+def append_steps(trajectory, n):
+	for i in range(n):
+		trajectory.append(float(i), (i, 0, 0), (i, 1, 0), [[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+	return trajectory
+
+
+@pytest.mark.parametrize('max_length', [0, -1])
+def test_max_length_below_one_is_rejected(max_length):
+	with pytest.raises(ValueError, match='max_length'):
+		traj.Trajectory(max_length=max_length)
+
+
+def test_bounded_trajectory_keeps_the_latest_steps():
+	trajectory = append_steps(traj.Trajectory(capacity=2, max_length=3), 5)
+	assert len(trajectory) == 3
+	assert trajectory.data['t'].tolist() == [2.0, 3.0, 4.0]
+
+	single = append_steps(traj.Trajectory(max_length=1), 4)
+	assert single.data['t'].tolist() == [3.0]
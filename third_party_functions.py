@@ -22,26 +22,60 @@ import random
 import warnings
 import numpy as np
 from numpy.linalg import inv
-import scipy.linalg as linalg
-import scipy.sparse as sp
-import scipy.sparse.linalg as spln
-from scipy.stats import norm, multivariate_normal
 
 
+# SciPy is only imported on first use, so importing this module stays cheap.
+# Functions import what they need locally; the module level names below are
+# still available as attributes through __getattr__.
+_LAZY_IMPORTS = {
+    'linalg': ('scipy.linalg', None),
+    'sp': ('scipy.sparse', None),
+    'spln': ('scipy.sparse.linalg', None),
+    'norm': ('scipy.stats', 'norm'),
+    'multivariate_normal': ('scipy.stats', 'multivariate_normal'),
+}
 
-# Older versions of scipy do not support the allow_singular keyword. I could
-# check the version number explicily, but perhaps this is clearer
-_support_singular = True
-try:
-    multivariate_normal.logpdf(1, 1, 1, allow_singular=True)
-except TypeError:
-    warnings.warn(
-        'You are using a version of SciPy that does not support the '\
-        'allow_singular parameter in scipy.stats.multivariate_normal.logpdf(). '\
-        'Future versions of FilterPy will require a version of SciPy that '\
-        'implements this keyword',
-        DeprecationWarning)
-    _support_singular = False
+
+def __getattr__(name):
+    if name == '_support_singular':
+        return _supports_singular()
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name))
+
+    import importlib
+    module_name, attribute = _LAZY_IMPORTS[name]
+    value = importlib.import_module(module_name)
+    if attribute is not None:
+        value = getattr(value, attribute)
+    globals()[name] = value
+    return value
+
+
+def _supports_singular():
+    """
+    Older versions of scipy do not support the allow_singular keyword. I could
+    check the version number explicily, but perhaps this is clearer. The check
+    runs once, on first use.
+    """
+
+    global _supports_singular_result
+    if _supports_singular_result is None:
+        from scipy.stats import multivariate_normal
+        _supports_singular_result = True
+        try:
+            multivariate_normal.logpdf(1, 1, 1, allow_singular=True)
+        except TypeError:
+            warnings.warn(
+                'You are using a version of SciPy that does not support the '\
+                'allow_singular parameter in scipy.stats.multivariate_normal.logpdf(). '\
+                'Future versions of FilterPy will require a version of SciPy that '\
+                'implements this keyword',
+                DeprecationWarning)
+            _supports_singular_result = False
+    return _supports_singular_result
+
+_supports_singular_result = None
 
 
 def _validate_vector(u, dtype=None):
@@ -56,6 +90,41 @@ def _validate_vector(u, dtype=None):
     return u
 
 
+def _cholesky_whiten(y, cov):
+    """
+    Whitens stacked vectors with the Cholesky factor L of their stacked
+    covariances (cov = L L^T). Returns L^-1 y, by forward substitution over
+    the (small) dimension with every stacked vector at once, and the log
+    determinant of each covariance. Raises numpy.linalg.LinAlgError if a
+    covariance is not positive definite.
+    """
+
+    L = np.linalg.cholesky(cov)
+    n = y.shape[-1]
+    shape = y.shape[:-1]
+    if L.shape[:-2] != shape:
+        shape = np.broadcast_shapes(shape, L.shape[:-2])
+        y = np.broadcast_to(y, shape + (n,))
+        L = np.broadcast_to(L, shape + (n, n))
+    z = np.empty(shape + (n,))
+    z[..., 0] = y[..., 0] / L[..., 0, 0]
+    for i in range(1, n):
+        z[..., i] = (y[..., i] - (L[..., i, :i] * z[..., :i]).sum(axis=-1)) / L[..., i, i]
+    log_det = 2.0 * np.log(np.diagonal(L, axis1=-2, axis2=-1)).sum(axis=-1)
+    return z, log_det
+
+
+def _stacked_cov(cov, n):
+    """
+    Stacked version of `_to_cov`: a scalar is the identity matrix times
+    it, anything else is returned as a float array.
+    """
+
+    if np.isscalar(cov):
+        return np.eye(n) * cov
+    return np.asarray(cov, dtype=float)
+
+
 def mahalanobis(x, mean, cov):
     """
     Computes the Mahalanobis distance between the state vector x from the
@@ -97,6 +166,37 @@ def mahalanobis(x, mean, cov):
     return math.sqrt(dist)
 
 
+def mahalanobis_batch(x, mean, cov):
+    """
+    Vectorized version of `mahalanobis`. Computes the Mahalanobis distance
+    of any number of stacked vectors at once, with a Cholesky factor of
+    each covariance instead of its inverse.
+    Examples
+    --------
+    .. code-block: Python
+        # innovations of K measurement hypotheses, ys is (K, 2), Ss is (K, 2, 2)
+        d = mahalanobis_batch(ys, predicted_ys, Ss)
+    Parameters
+    ----------
+    x : (..., N) array_like
+        Input state vectors
+    mean : (..., N) array_like
+        means of the multivariate Gaussians
+    cov : (..., N, N) array_like
+        positive definite covariances of the multivariate Gaussians
+    Returns
+    -------
+    mahalanobis : ndarray
+        The Mahalanobis distance between each x and mean, of the broadcast
+        shape of x and mean without the last axis
+    """
+
+    y = np.asarray(x, dtype=float) - np.asarray(mean, dtype=float)
+    # With cov = L L^T, y^T cov^-1 y = |L^-1 y|^2
+    z, _ = _cholesky_whiten(y, _stacked_cov(cov, y.shape[-1]))
+    return np.sqrt(np.einsum('...i,...i->...', z, z))
+
+
 def log_likelihood(z, x, P, H, R):
     """
     Returns log-likelihood of the measurement z given the Gaussian
@@ -107,6 +207,35 @@ def log_likelihood(z, x, P, H, R):
     return logpdf(z, np.dot(H, x), S)
 
 
+def log_likelihood_batch(z, x, P, H, R):
+    """
+    Vectorized version of `log_likelihood`. Returns the log-likelihood of
+    any number of stacked measurements z given the Gaussian posteriors
+    (x, P), measurement functions H and measurement covariances R.
+    Parameters
+    ----------
+    z : (..., M) array_like
+        measurements
+    x : (..., N) array_like
+        posterior means
+    P : (..., N, N) array_like
+        posterior covariances
+    H : (..., M, N) array_like
+        measurement functions, e.g. one (M, N) matrix shared by all
+    R : (..., M, M) array_like
+        measurement covariances
+    Returns
+    -------
+    log_likelihood : ndarray
+        log-likelihood of each measurement, of the broadcast stacked shape
+    """
+
+    x = np.asarray(x, dtype=float)
+    H = np.asarray(H, dtype=float)
+    S = np.matmul(np.matmul(H, np.asarray(P, dtype=float)), np.swapaxes(H, -1, -2)) + np.asarray(R, dtype=float)
+    return logpdf_batch(z, np.matmul(H, x[..., np.newaxis])[..., 0], S)
+
+
 def likelihood(z, x, P, H, R):
     """
     Returns likelihood of the measurement z given the Gaussian
@@ -116,6 +245,13 @@ def likelihood(z, x, P, H, R):
     return np.exp(log_likelihood(z, x, P, H, R))
 
 
+def likelihood_batch(z, x, P, H, R):
+    """
+    Vectorized version of `likelihood`, see `log_likelihood_batch`.
+    """
+    return np.exp(log_likelihood_batch(z, x, P, H, R))
+
+
 def logpdf(x, mean=None, cov=1, allow_singular=True):
     """
     Computes the log of the probability density function of the normal
@@ -132,13 +268,53 @@ def logpdf(x, mean=None, cov=1, allow_singular=True):
     else:
         flat_mean = None
 
+    from scipy.stats import multivariate_normal
+
     flat_x = np.asarray(x).flatten()
 
-    if _support_singular:
+    if _supports_singular():
         return multivariate_normal.logpdf(flat_x, flat_mean, cov, allow_singular)
     return multivariate_normal.logpdf(flat_x, flat_mean, cov)
 
 
+def logpdf_batch(x, mean=None, cov=1, return_mahalanobis=False):
+    """
+    Vectorized version of `logpdf`. Computes the log of the probability
+    density function of the normals N(mean, cov) for any number of stacked
+    vectors at once, from a Cholesky factor of each covariance. Unlike
+    `logpdf` the covariances must be positive definite.
+    Parameters
+    ----------
+    x : (..., N) array_like
+        data
+    mean : (..., N) array_like, optional
+        means, zero by default
+    cov : (..., N, N) array_like or float
+        positive definite covariances; a scalar is eye(N) * cov
+    return_mahalanobis : bool, optional
+        also return the squared Mahalanobis distances, which the density is
+        computed from anyway
+    Returns
+    -------
+    logpdf : ndarray
+        log density of each vector, of the broadcast stacked shape
+    d2 : ndarray
+        squared Mahalanobis distance of each vector, only if
+        return_mahalanobis is True
+    """
+
+    y = np.asarray(x, dtype=float)
+    if mean is not None:
+        y = y - np.asarray(mean, dtype=float)
+    n = y.shape[-1]
+    z, log_det = _cholesky_whiten(y, _stacked_cov(cov, n))
+    d2 = np.einsum('...i,...i->...', z, z)
+    logpdf = -0.5 * (d2 + log_det + n * math.log(2 * math.pi))
+    if return_mahalanobis:
+        return logpdf, d2
+    return logpdf
+
+
 def gaussian(x, mean, var, normed=True):
     """
     returns normal distribution (pdf) for x given a Gaussian with the
@@ -324,6 +500,9 @@ def multivariate_gaussian(x, mu, cov):
 
     norm_coeff = nx*math.log(2*math.pi) + np.linalg.slogdet(cov)[1]
 
+    import scipy.sparse as sp
+    import scipy.sparse.linalg as spln
+
     err = x - mu
     if sp.issparse(cov):
         numerator = spln.spsolve(cov, err).T.dot(err)
@@ -333,6 +512,16 @@ def multivariate_gaussian(x, mu, cov):
     return math.exp(-0.5*(norm_coeff + numerator))
 
 
+def multivariate_gaussian_batch(x, mu, cov):
+    """
+    Vectorized version of `multivariate_gaussian` for stacked (..., N)
+    vectors x and means mu and (..., N, N) covariances, or a scalar cov
+    interpreted as eye(N) * cov. Returns the probability density of each
+    vector, see `logpdf_batch`.
+    """
+    return np.exp(logpdf_batch(x, mu, cov))
+
+
 def multivariate_multiply(m1, c1, m2, c2):
     """
     Multiplies the two multivariate Gaussians together and returns the
@@ -451,6 +640,7 @@ def plot_gaussian_cdf(mean=0., variance=1.,
         axis of plot
     """
     import matplotlib.pyplot as plt
+    from scipy.stats import norm
 
     if ax is None:
         ax = plt.gca()
@@ -509,6 +699,7 @@ def plot_gaussian_pdf(mean=0.,
     """
 
     import matplotlib.pyplot as plt
+    from scipy.stats import norm
 
     if ax is None:
         ax = plt.gca()
@@ -578,6 +769,8 @@ def covariance_ellipse(P, deviations=1):
     Returns (angle_radians, width_radius, height_radius)
     """
 
+    import scipy.linalg as linalg
+
     U, s, _ = linalg.svd(P)
     orientation = math.atan2(U[1, 0], U[0, 0])
     width = deviations * math.sqrt(s[0])
@@ -778,6 +971,7 @@ def _std_tuple_of(var=None, std=None, interval=None):
 
 
     if interval is not None:
+        from scipy.stats import norm
         if np.isscalar(interval):
             interval = (interval,)
 
@@ -913,6 +1107,96 @@ def plot_covariance(
         plt.plot([x, x+ w*cos(a)], [y, y + w*sin(a)])
 
 
+def covariance_ellipse_batch(Ps, deviations=1):
+    """
+    Vectorized version of `covariance_ellipse`. Computes the ellipses of
+    any number of stacked 2x2 covariance matrices at once, using the closed
+    form eigendecomposition of a symmetric 2x2 matrix instead of an SVD per
+    matrix.
+    Parameters
+    ----------
+    Ps : (..., 2, 2) array_like
+       covariance matrices
+    deviations : int (optional, default = 1)
+       # of standard deviations. Default is 1.
+    Returns
+    -------
+    (angle_radians, width_radius, height_radius) : tuple of ndarrays
+       each of shape Ps.shape[:-2], with width_radius >= height_radius
+    """
+
+    Ps = np.asarray(Ps, dtype=float)
+    a = Ps[..., 0, 0]
+    c = Ps[..., 1, 1]
+    b = 0.5 * (Ps[..., 0, 1] + Ps[..., 1, 0])
+
+    # eigenvalues (a + c)/2 +- sqrt(((a - c)/2)^2 + b^2), major axis at
+    # angle atan2(2b, a - c)/2
+    mid = 0.5 * (a + c)
+    radius = np.hypot(0.5 * (a - c), b)
+    orientation = 0.5 * np.arctan2(2. * b, a - c)
+    width = deviations * np.sqrt(mid + radius)
+    height = deviations * np.sqrt(np.clip(mid - radius, 0., None))
+
+    return (orientation, width, height)
+
+
+def plot_covariance_batch(
+        means, covs, std=1., ax=None, facecolor='none', edgecolor='#004080',
+        alpha=1.0, lw=1, axis_equal=True, **kwargs):
+    """
+    Plots the covariance ellipses of many 2D normals as a single
+    matplotlib EllipseCollection, which is much faster than calling
+    `plot_covariance` once per ellipse.
+    Parameters
+    ----------
+    means : (N, 2) array_like
+        means of the normals
+    covs : (N, 2, 2) array_like
+        covariance matrices of the normals
+    std : float, default=1.
+        number of standard deviations of the plotted ellipses
+    ax : matplotlib Axes, optional
+        axes to draw on, defaults to the current axes
+    facecolor, edgecolor: color or sequence of colors
+        fill and edge color of the ellipses
+    alpha: float range [0,1], default=1.
+        alpha value for the ellipses
+    lw: float, default=1
+        width of the edge of the ellipses
+    axis_equal: bool, default=True
+        Use the same scale for the x-axis and y-axis to ensure the aspect
+        ratio is correct.
+    **kwargs
+        passed on to EllipseCollection
+    Returns
+    -------
+    collection : matplotlib.collections.EllipseCollection
+    """
+
+    from matplotlib.collections import EllipseCollection
+    import matplotlib.pyplot as plt
+
+    if ax is None:
+        ax = plt.gca()
+
+    means = np.asarray(means, dtype=float).reshape(-1, 2)
+    orientation, width, height = covariance_ellipse_batch(covs, std)
+
+    collection = EllipseCollection(
+        2. * width.ravel(), 2. * height.ravel(), np.degrees(orientation.ravel()),
+        units='xy', offsets=means, offset_transform=ax.transData,
+        facecolors=facecolor, edgecolors=edgecolor, alpha=alpha, lw=lw,
+        **kwargs)
+    ax.add_collection(collection)
+    ax.update_datalim(means)
+    ax.autoscale_view()
+
+    if axis_equal:
+        ax.set_aspect('equal')
+
+    return collection
+
 def norm_cdf(x_range, mu, var=1, std=None):
     """
     Computes the probability that a Gaussian distribution lies
@@ -933,6 +1217,8 @@ def norm_cdf(x_range, mu, var=1, std=None):
         probability that Gaussian is within x_range. E.g. .1 means 10%.
     """
 
+    from scipy.stats import norm
+
     if std is None:
         std = math.sqrt(var)
     return abs(norm.cdf(x_range[0], loc=mu, scale=std) -
@@ -1000,8 +1286,39 @@ def NESS(xs, est_xs, ps):
        list of NESS computed for each estimate
     """
 
+    import scipy.linalg as linalg
+
     est_err = xs - est_xs
     ness = []
     for x, p in zip(est_err, ps):
         ness.append(np.dot(x.T, linalg.inv(p)).dot(x))
-    return ness
\ No newline at end of file
+    return ness
+
+def NESS_batch(xs, est_xs, ps):
+    """
+    Vectorized version of `NESS`. Computes the normalized estimated error
+    squared for any number of stacked estimates at once, e.g. every step of
+    every run of a Monte Carlo simulation, without inverting each covariance.
+    Examples
+    --------
+    .. code-block: Python
+        # xs, est_xs are (runs, steps, 3), ps is (runs, steps, 3, 3)
+        ness = NESS_batch(xs, est_xs, ps)
+        mean_ness = ness.mean(axis=0)
+    Parameters
+    ----------
+    xs : (..., N) array_like
+        true values for the state x
+    est_xs : (..., N) array_like
+        estimates from an estimator (such as Kalman filter)
+    ps : (..., N, N) array_like
+        positive definite covariance matrices from the estimator
+    Returns
+    -------
+    ness : ndarray of shape xs.shape[:-1]
+       NESS computed for each estimate
+    """
+
+    est_err = np.asarray(xs, dtype=float) - np.asarray(est_xs, dtype=float)
+    z, _ = _cholesky_whiten(est_err, np.asarray(ps, dtype=float))
+    return np.einsum('...i,...i->...', z, z)
@@ -0,0 +1,124 @@
+import state
+import Input
+import measurement
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+
+# Indices of the 6 upper triangular entries of a 3x3 covariance, in packed order
+TRIU_ROWS, TRIU_COLS = np.triu_indices(3)
+
+# One trajectory row: time, true state, estimate, packed upper triangular covariance, input and measurement
+TRAJECTORY_DTYPE = np.dtype([
+	('t', np.float64),
+	('true_state', state.STATE_DTYPE),
+	('estimate', state.STATE_DTYPE),
+	('covariance', np.float64, (6,)),
+	('input', Input.INPUT_DTYPE),
+	('measurement', measurement.MEASUREMENT_DTYPE),
+])
+
+
+# Convert a State, Input, Measurement or sequence to a plain tuple, None becomes nan
+def _as_tuple(value, n):
+
+	if value is None:
+		return (np.nan,) * n
+	if isinstance(value, state.State):
+		return value.get_state()
+	if isinstance(value, Input.Input):
+		return value.get_input()
+	if isinstance(value, measurement.Measurement):
+		return value.get_measurement()
+	return tuple(np.ravel(value))
+
+
+# Pack a 3x3 covariance into its 6 upper triangular entries
+def pack_covariance(P):
+
+	return np.asarray(P)[..., TRIU_ROWS, TRIU_COLS]
+
+
+# Unpack (..., 6) upper triangular entries into symmetric (..., 3, 3) covariances
+def unpack_covariance(packed):
+
+	packed = np.asarray(packed)
+	P = np.empty(packed.shape[:-1] + (3, 3))
+	P[..., TRIU_ROWS, TRIU_COLS] = packed
+	P[..., TRIU_COLS, TRIU_ROWS] = packed
+	return P
+
+
+# Compact trajectory log backed by a preallocated structured array that grows geometrically
+# With max_length it grows up to max_length rows and then becomes a ring buffer of the most recent ones,
+# the new rows overwriting the oldest, so a log of an unbounded stream uses bounded memory.
+class Trajectory:
+
+	def __init__(self, capacity=1024, growth=2.0, max_length=None):
+		self.growth = growth # Factor the capacity is multiplied by when full
+		self.max_length = max_length
+		if max_length is not None:
+			if max_length < 1:
+				raise ValueError('max_length must be at least 1 (None for an unbounded trajectory), got {!r}'.format(max_length))
+			capacity = min(capacity, max_length)
+		self.rows = np.zeros(capacity, dtype=TRAJECTORY_DTYPE)
+		self.length = 0
+		self.start = 0 # Row of the oldest step, only moves once a bounded trajectory is full
+
+	def __len__(self):
+		return self.length
+
+	# Filled rows of the structured array in time order, a view unless a bounded trajectory has wrapped around
+	@property
+	def data(self):
+		if self.start == 0:
+			return self.rows[:self.length]
+		return np.concatenate((self.rows[self.start:], self.rows[:self.start]))
+
+	# Index of the row for one more step
+	def _reserve(self):
+
+		if self.length == len(self.rows):
+			if self.length == self.max_length:
+				# Full: drop the oldest step
+				index = self.start
+				self.start = (self.start + 1) % self.length
+				self.length -= 1
+				return index
+			capacity = max(int(len(self.rows) * self.growth), self.length + 1)
+			if self.max_length is not None:
+				capacity = min(capacity, self.max_length)
+			rows = np.zeros(capacity, dtype=TRAJECTORY_DTYPE)
+			rows[:self.length] = self.rows[:self.length]
+			self.rows = rows
+		return self.length
+
+	# Append one step; states, input and measurement may be objects or sequences, input and measurement are optional
+	def append(self, t, true_state, estimate, covariance, u=None, y=None):
+
+		index = self._reserve()
+		row = self.rows[index]
+		row['t'] = t
+		row['true_state'] = _as_tuple(true_state, 3)
+		row['estimate'] = _as_tuple(estimate, 3)
+		row['covariance'] = pack_covariance(covariance)
+		row['input'] = _as_tuple(u, 2)
+		row['measurement'] = _as_tuple(y, 2)
+		self.length += 1
+
+	# Append the current state of a robot
+	def append_robot(self, t, robot, u=None, y=None):
+
+		self.append(t, robot.real_state, robot.estimated_state_mean, robot.covariance, u, y)
+
+	# (N,3) array of the true states
+	def true_states(self):
+		return structured_to_unstructured(self.data['true_state'])
+
+	# (N,3) array of the estimates
+	def estimates(self):
+		return structured_to_unstructured(self.data['estimate'])
+
+	# (N,3,3) array of the covariances
+	def covariances(self):
+		return unpack_covariance(self.data['covariance'])
+
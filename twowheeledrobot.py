@@ -1,42 +1,69 @@
+from functools import lru_cache
+import math
 import state
 import measurement
+import rangefinder
+import instrumentation
+import noise
+import dataassociation
 import numpy as np 
 
 class TwoWheeledRobot:
 
-	def __init__(self, b=85.0, r=20.0, initial_state=state.State(0,0,0), f_s=1):
+	def __init__(self, b=85.0, r=20.0, initial_state=state.State(0,0,0), f_s=1, environment=None, Q=None, R=None,
+			seed=None, association='best'):
 		self.b = b # Distance between wheels
 		self.r = r # Radius of wheels
 		self.real_state = initial_state # Recording of real state
 		self.estimated_state_mean = initial_state # Recording of estimated state mean
 		self.covariance = np.zeros((3,3))  #Initial covariance matrix, set to zero for known initial state
 		self.d_t = 1.0/f_s # Time step
-		self.Q = np.eye(2) * (np.pi / 6.0) ** 2 # Process noise variance
-		self.R = np.eye(2) * (9.375) ** 2 # Measurement noise variance
+		self.Q = noise_variance(Q, (np.pi / 6.0) ** 2) # Process noise variance assumed by the filter
+		self.R = noise_variance(R, (9.375) ** 2) # Measurement noise variance assumed by the filter
+		self.environment = environment # Room map, None for the default 500x750 rectangle
+		self.last_measurement = None # Most recent noisy rangefinder reading
+		self.noise = noise.RobotNoise(seed) # Noise of the simulated motion and rangefinders
+		self.association = dataassociation.resolve(association) # Finds the walls read, None to use the real state
+		self.last_association = None # Walls and weights of the hypotheses used by the last update
+		self.last_innovation = None # (2,) innovation of the last measurement update, None if it was skipped
+		self.last_innovation_covariance = None # Its (2,2) covariance S
+		self.monitor = None # Fed every innovation when set, e.g. a consistency.ConsistencyMonitor
 
 
-	# Movement 
-	def time_update(self, u):
+	# Time the filter stages of this robot (see instrumentation), returns the profiler
+	def enable_profiling(self, profiler=None, stages=instrumentation.STAGES):
+
+		return instrumentation.profile(self, profiler, stages)
+
+
+	def disable_profiling(self):
+
+		instrumentation.unprofile(self)
+
+
+	# Movement over dt seconds, one fixed time step by default
+	def time_update(self, u, dt=None):
 
 		# Update the real state - includes noise
-		self.real_state_update(u)
+		self.real_state_update(u, dt)
 		# Update the state estimate - does not include noise
-		self.estimated_state_update(u)
+		self.estimated_state_update(u, dt)
 
 
 	# Updating the real state
-	def real_state_update(self, u):
+	def real_state_update(self, u, dt=None):
 
 		w_l, w_r = u.get_input()
 
 		b = self.b
 		r = self.r
-		d_t = self.d_t
+		d_t = self.d_t if dt is None else dt
 
 		# Add noise to the input
 		w_l, w_r = u.get_input()
-		w_l = w_l + np.pi / 6.0 * np.random.randn() 
-		w_r = w_r + np.pi / 6.0 * np.random.randn()
+		e_l, e_r = self.noise.input.next()
+		w_l = w_l + np.pi / 6.0 * e_l
+		w_r = w_r + np.pi / 6.0 * e_r
 
 		x, y, theta = self.real_state.get_state()
 
@@ -56,103 +83,150 @@ class TwoWheeledRobot:
 
 
 	# Updating the state estimate
-	def estimated_state_update(self, u):
+	# The heading independent part of the motion (the arc in the robot frame and the body terms of the
+	# jacobians) comes from the motion primitive cache, so a repeated command only costs a rotation
+	def estimated_state_update(self, u, dt=None):
 
 		w_l, w_r = u.get_input()
-
-		b = self.b
-		r = self.r
-		d_t = self.d_t
+		d_t = self.d_t if dt is None else dt
 
 		x, y, theta = self.estimated_state_mean.get_state()
+		d_theta, dx_body, dy_body, p_l, p_r, q_l, q_r, k = motion_primitive(self.b, self.r, w_l, w_r, d_t)
+		cos_theta, sin_theta = cos_sin(theta)
+
+		# Rotate the arc into the world frame
+		dx = cos_theta * dx_body - sin_theta * dy_body
+		dy = sin_theta * dx_body + cos_theta * dy_body
 		# Update theta using non-noisy input
-		theta_new = (d_t * r / b * (w_r - w_l) + theta) % (2 * np.pi) 
+		theta_new = (d_theta + theta) % (2 * np.pi) 
+
+		F, W = self.motion_jacobians(cos_theta, sin_theta, dx, dy, p_l, p_r, q_l, q_r, k)
+		self.estimated_state_mean = state.State(x + dx, y + dy, theta_new)
+		self.F = F # Kept for smoothing
+		self.propagate_covariance(F, W)
 
-		#Update x and y given theta and theta new
-		if w_r == w_l:
-			x = x + r * w_r * d_t * np.cos(theta)
-			y = y + r * w_r * d_t * np.sin(theta)
-			df0_dtheta = 0
-			df1_dtheta = 0
-		else:
-			R = b / 2.0 * (w_r + w_l)/(w_r - w_l)
-			x = x + R * (np.sin(theta_new) - np.sin(theta))
-			y = y - R * (np.cos(theta_new) - np.cos(theta))
-			# Derivative of state updates with respect to theta
-			df0_dtheta = R * (np.cos(theta_new) - np.cos(theta))
-			df1_dtheta = R * ( -1.0 * np.sin(theta_new) + np.sin(theta))
 
-		# Create dynamics jacobian
+	# Dynamics and process noise jacobians at the heading (cos_theta, sin_theta), given the world frame
+	# displacement (dx, dy) and the body terms of the motion primitive
+	def motion_jacobians(self, cos_theta, sin_theta, dx, dy, p_l, p_r, q_l, q_r, k):
+
+		# Create dynamics jacobian: turning the heading turns the displacement with it
 		F = np.eye(3)
-		F[0][2] = df0_dtheta
-		F[1][2] = df1_dtheta
-		W = self.get_process_noise_jacobian(u)
-		self.estimated_state_mean = state.State(x, y, theta_new)
-		# Update covariance with dynamics and process noise jacobians
+		F[0][2] = -1.0 * dy
+		F[1][2] = dx
+		W = rotate_process_noise_jacobian(cos_theta, sin_theta, p_l, p_r, q_l, q_r, k)
+		return F, W
+
+
+	# Update covariance with dynamics and process noise jacobians
+	def propagate_covariance(self, F, W):
+
 		self.covariance = F.dot(self.covariance).dot(F.T) + W.dot(self.Q).dot(W.T)
 
 
 	# Calculates the process noise jacobian given the input
 	def get_process_noise_jacobian(self, u):
 
-		b = self.b
-		r = self.r
 		w_l, w_r = u.get_input()
 		x, y, theta = self.estimated_state_mean.get_state()
+		_, _, _, p_l, p_r, q_l, q_r, k = motion_primitive(self.b, self.r, w_l, w_r, self.d_t)
+		cos_theta, sin_theta = cos_sin(theta)
+		return rotate_process_noise_jacobian(cos_theta, sin_theta, p_l, p_r, q_l, q_r, k)
+		
 
-		# See report for derivations
-		if w_r == w_l:
-			dx_dwl = r * w_l / (2.0 * b) * np.sin(theta)
-			dx_dwr = -1.0 * r * w_r / (2.0 * b) * np.sin(theta)
-			dy_dwl = r * w_l / (2.0 * b) * np.cos(theta)
-			dy_dwr = -1.0 * r * w_r / (2.0 * b) * np.cos(theta)
-
+	# Update state and covariance given measurements
+	# Without a measurement the rangefinder readings are simulated from the real state; an external
+	# [front, right] measurement (e.g. replayed field data) is used as is.
+	# With the default association 'best' (or 'mixture') a DataAssociation finds the walls read from the
+	# readings and the estimate. Association 'truth' (None) is for simulation only: it takes the walls seen from
+	# the real state for simulated readings, and the walls first seen from the estimated state for external
+	# measurements, at about a third of the cost but diverging far more often when the estimate is off.
+	def measurement_update(self, y=None):
+
+		self.last_innovation = self.last_innovation_covariance = None
+		measure_and_jacobian = self.measure_and_jacobian
+		if y is None:
+			# Calculate rangefinder results and the observation jacobian given the state in a single pass
+			y_t, wall_idx, H = measure_and_jacobian(self.real_state)
+			# Right here we are currently returning which walls the sensors are measuring
+			# This helps us use the correct measurement model to compute the Jacobian
+			# This is technically cheating, only association 'truth' uses these walls
+
+			# Add independent noise to each rangefinder
+			e_f, e_r = self.noise.measurement.next()
+			y_t = np.array([[y_t[0] + e_f * (9.375)], [y_t[1] + e_r * (9.375)]])
+			self.last_measurement = measurement.Measurement(y_t[0, 0], y_t[1, 0])
+			if self.association is not None:
+				self.associate(y_t[:, 0])
+				return
+
+			# Create prediction given the estimated state
+			predicted_y_t, _, _ = measure_and_jacobian(self.estimated_state_mean)
+			# Skip estimates from which no wall is seen, their innovation would turn the estimate into nan
+			if not np.all(np.isfinite(predicted_y_t)):
+				return
 		else:
-			cos = np.cos(r / b * (w_r - w_l) + theta)
-			sin = np.sin(r / b * (w_r - w_l) + theta)
-			
-			dx_dwl = b / r * w_r / (w_r - w_l)**2 * sin - (w_r + w_l) / (2 * (w_r - w_l)) * cos - b / r * w_r / (w_r - w_l)**2 * np.sin(theta) 
-			dx_dwr = -1.0 * b / r * w_l / (w_r - w_l)**2 * sin + (w_r + w_l) / (2 * (w_r - w_l)) * cos + b / r * w_l / (w_r - w_l)**2 * np.sin(theta) 
+			y_t = np.array([measurement_values(y)], dtype=float).T
+			self.last_measurement = measurement.Measurement(y_t[0, 0], y_t[1, 0])
+			if self.association is not None:
+				self.associate(y_t[:, 0])
+				return
+			predicted_y_t, wall_idx, H = measure_and_jacobian(self.estimated_state_mean)
+			# Skip sensor dropouts, and estimates from which no wall is seen
+			if not (np.all(np.isfinite(y_t)) and np.all(np.isfinite(predicted_y_t))):
+				return
 
-			dy_dwl = b / r * w_r / (w_r - w_l)**2 * cos + (w_r + w_l) / (2 * (w_r - w_l)) * sin - b / r * w_r / (w_r - w_l)**2 * np.cos(theta) 
-			dy_dwr = -1.0 * b / r * w_l / (w_r - w_l)**2 * cos - (w_r + w_l) / (2 * (w_r - w_l)) * sin + b / r * w_l / (w_r - w_l)**2 * np.cos(theta)
+		predicted_y_t = np.array([predicted_y_t]).T
 
-		dtheta_dwl = -1.0 * r / b
-		dtheta_dwr = -1.0 * r / b
+		self.correct(H, y_t - predicted_y_t)
 
-		W = np.array([[dx_dwl, dx_dwr], [dy_dwl, dy_dwr], [dtheta_dwl, dtheta_dwr]])
-		return W
-		
 
-	# Update state and covariance given measurements
-	def measurement_update(self):
+	# Measurement update with the (2,) [front, right] readings y and the walls found by data association
+	# Sensor dropouts are skipped
+	def associate(self, y):
 
-		x, y, theta = self.real_state.get_state()
+		if not (math.isfinite(y[0]) and math.isfinite(y[1])):
+			self.last_association = None
+			return
+		self.last_association = self.association.update(self, y)
+
+
+	# Ray cast the rangefinder readings from a state, returning them with the walls read and the observation jacobian
+	def measure_and_jacobian(self, state_in):
 
-		# Calculate rangefinder results given the state
-		y_t, front_wall_idx, right_wall_idx = self.measure(self.real_state)
-		# Right here we are currently returning which walls the sensors are measuring
-		# This helps us use the correct measurement model to compute the Jacobian
-		# I think this is technically cheating -> should maybe compute all jacobians and choose one with lowest estimation error?
-		H = self.get_observation_jacobian(x, y, theta, front_wall_idx, right_wall_idx)
+		if self.environment is None:
+			return rangefinder.measure_and_jacobian(state_in)
+		return self.environment.measure_and_jacobian(state_in)
 
-		# Add noise to the measurement
-		y_t = (np.array([y_t.get_measurement()]) + np.random.randn() * (9.375)).T
 
-		# Create prediction given the estimated state
-		predicted_y_t, _, _ = self.measure(self.estimated_state_mean)
-		predicted_y_t = np.array([predicted_y_t.get_measurement()]).T
+	# Update estimate and covariance given observation jacobian and the (2,1) innovation
+	def correct(self, H, innovation):
 
-	
 		sigma_m = self.covariance
-		inv_mat = np.linalg.inv(H.dot(sigma_m).dot(H.T) + self.R)
+		S = H.dot(sigma_m).dot(H.T) + self.R
+		inv_mat = self.invert_innovation_covariance(S)
 		x_hat = np.array([self.estimated_state_mean.get_state()]).T
 
-		# Update estimate and covariance given observation jacobian
-		x_hat += sigma_m.dot(H.T).dot(inv_mat).dot((y_t - predicted_y_t))
+		x_hat += sigma_m.dot(H.T).dot(inv_mat).dot(innovation)
 		x_hat = np.squeeze(x_hat)
 		self.covariance = sigma_m - sigma_m.dot(H.T).dot(inv_mat).dot(H).dot(sigma_m)
 		self.estimated_state_mean = state.State(x_hat[0], x_hat[1], x_hat[2])
+		self.record_innovation(np.ravel(innovation), S)
+
+
+	# Keep the (2,) innovation and (2,2) innovation covariance of a measurement update, and feed the monitor
+	def record_innovation(self, innovation, S):
+
+		self.last_innovation = innovation
+		self.last_innovation_covariance = S
+		if self.monitor is not None:
+			self.monitor.update(innovation, S)
+
+
+	# Inverse of the (2,2) innovation covariance
+	def invert_innovation_covariance(self, S):
+
+		return np.linalg.inv(S)
 
 
 	# Returns the observation jacobian given the state and which wall each sensor is reading
@@ -265,4 +339,78 @@ class TwoWheeledRobot:
 				min_pos_df = df[i]
 				front_wall_idx = i + 1
 
-		return measurement.Measurement(min_pos_df, min_pos_dr), front_wall_idx, right_wall_idx
\ No newline at end of file
+		return measurement.Measurement(min_pos_df, min_pos_dr), front_wall_idx, right_wall_idx
+
+
+# (2,2) noise variance from a matrix, a scalar variance of each of the two channels, or None for the default
+def noise_variance(value, default):
+
+	if value is None:
+		value = default
+	value = np.asarray(value, dtype=float)
+	if value.ndim == 0:
+		return np.eye(2) * value
+	return value
+
+
+# [front, right] values of a Measurement or a sequence of two ranges
+def measurement_values(y):
+
+	if isinstance(y, measurement.Measurement):
+		return y.get_measurement()
+	return tuple(np.ravel(y))
+
+
+# Heading independent part of one step of the motion model, cached per (b, r, w_l, w_r, dt)
+# Returns (d_theta, dx_body, dy_body, p_l, p_r, q_l, q_r, k):
+# - d_theta, the heading change, and (dx_body, dy_body), the displacement at heading 0, which rotated by
+#   the heading theta gives the displacement of the robot
+# - (p_l, p_r) and (q_l, q_r), the derivatives of dx_body and dy_body with respect to the left and right
+#   wheel speeds, and k = d(d_theta)/d(w_r) = -d(d_theta)/d(w_l), the body terms of the process noise
+#   jacobian, see rotate_process_noise_jacobian
+@lru_cache(maxsize=4096)
+def motion_primitive(b, r, w_l, w_r, dt):
+
+	k = dt * r / b
+	d_theta = k * (w_r - w_l)
+
+	if w_r == w_l:
+		dx_body = r * w_r * dt
+		dy_body = 0.0
+		# Limits of the arc terms below as w_r - w_l goes to 0
+		p_l = p_r = r * dt / 2.0
+		q_r = dx_body * k / 2.0
+		q_l = -1.0 * q_r
+	else:
+		R = b / 2.0 * (w_r + w_l)/(w_r - w_l) # Circle radius
+		cos = math.cos(d_theta)
+		sin = math.sin(d_theta)
+		dx_body = R * sin
+		dy_body = R * (1.0 - cos)
+		# dx_body = R sin(d_theta) and dy_body = R (1 - cos(d_theta)), with R and d_theta both depending on
+		# the wheel speeds
+		dR_l = b * w_r / (w_r - w_l)**2
+		dR_r = -1.0 * b * w_l / (w_r - w_l)**2
+		p_l = dR_l * sin - R * cos * k
+		p_r = dR_r * sin + R * cos * k
+		q_l = dR_l * (1.0 - cos) - R * sin * k
+		q_r = dR_r * (1.0 - cos) + R * sin * k
+
+	return d_theta, dx_body, dy_body, p_l, p_r, q_l, q_r, k
+
+
+# Process noise jacobian at heading theta from the body terms of a motion primitive: the body frame
+# derivatives (p, q) rotated by theta, and the heading derivatives -k and k
+def rotate_process_noise_jacobian(cos_theta, sin_theta, p_l, p_r, q_l, q_r, k):
+
+	return np.array([[cos_theta * p_l - sin_theta * q_l, cos_theta * p_r - sin_theta * q_r],
+		[sin_theta * p_l + cos_theta * q_l, sin_theta * p_r + cos_theta * q_r],
+		[-1.0 * k, k]])
+
+
+# Cosine and sine of a heading, nan (as with numpy) instead of an error for a diverged, infinite heading
+def cos_sin(theta):
+
+	if math.isinf(theta):
+		return math.nan, math.nan
+	return math.cos(theta), math.sin(theta)
@@ -0,0 +1,176 @@
+from functools import lru_cache
+import math
+import state
+import measurement
+import rangefinder
+import twowheeledrobot as twr
+from batchtwowheeledrobot import motion_model
+import numpy as np
+
+
+# Scaled sigma point weights for an n dimensional state, computed once per configuration
+# Returns the mean weights, the covariance weights and the sigma point spread sqrt(n + lambda)
+@lru_cache(maxsize=None)
+def sigma_weights(n, alpha, beta, kappa):
+
+	lambda_ = alpha ** 2 * (n + kappa) - n
+	W_m = np.full(2 * n + 1, 1.0 / (2.0 * (n + lambda_)))
+	W_c = W_m.copy()
+	W_m[0] = lambda_ / (n + lambda_)
+	W_c[0] = lambda_ / (n + lambda_) + (1 - alpha ** 2 + beta)
+	W_m.flags.writeable = False
+	W_c.flags.writeable = False
+	return W_m, W_c, np.sqrt(n + lambda_)
+
+
+# Lower triangular matrix square root of a small covariance
+# Plain Python Cholesky, which beats the LAPACK call overhead at these sizes, falling back to the
+# eigendecomposition when the covariance is only semidefinite (e.g. the initial zero covariance)
+def covariance_sqrt(P):
+
+	n = len(P)
+	P_list = P.tolist()
+	L = [[0.0] * n for _ in range(n)]
+	for j in range(n):
+		diagonal = P_list[j][j] - sum(L[j][k] ** 2 for k in range(j))
+		if not diagonal > 0:
+			eigenvalues, eigenvectors = np.linalg.eigh((P + P.T) / 2.0)
+			return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+		L[j][j] = math.sqrt(diagonal)
+		for i in range(j + 1, n):
+			L[i][j] = (P_list[i][j] - sum(L[i][k] * L[j][k] for k in range(j))) / L[j][j]
+	return np.array(L)
+
+
+# Sigma points of a mean and the square root L of its covariance, as a (2n+1, n) array
+def sigma_points(mean, L, spread):
+
+	L = L * spread
+	points = np.empty((2 * len(mean) + 1, len(mean)))
+	points[:] = mean
+	points[1:len(mean) + 1] += L.T
+	points[len(mean) + 1:] -= L.T
+	return points
+
+
+# Weighted mean of [x, y, theta] points using a circular mean for the heading
+def state_mean(points, W_m):
+
+	mean = np.dot(W_m, points)
+	mean[2] = np.arctan2(np.dot(W_m, np.sin(points[:, 2])), np.dot(W_m, np.cos(points[:, 2]))) % (2 * np.pi)
+	return mean
+
+
+# Residuals of [x, y, theta] points from a state, with the heading residual wrapped to [-pi, pi)
+def state_residuals(points, mean):
+
+	residuals = points - mean
+	residuals[:, 2] = (residuals[:, 2] + np.pi) % (2 * np.pi) - np.pi
+	return residuals
+
+
+# Unscented Kalman filter version of TwoWheeledRobot
+# The time update augments the state with the 2D wheel noise, so no process noise or dynamics jacobian
+# is needed, and the measurement update pushes sigma points through the rangefinder model directly,
+# avoiding the 1/cos terms of the observation jacobian near axis aligned headings.
+# The measurement update reuses the sigma points of the time update, and each stage sends all of them through
+# the motion or rangefinder model in one call. That still does not meet the target of half the speed of the
+# EKF: a step costs about 2.3x an EKF step with association 'truth' (127 us against 55 us, best of 40 runs of
+# the benchmark.py step loop), mostly numpy call overhead on 11 points, though it is on par with the EKF at its
+# default association 'best' (140 us).
+class UnscentedTwoWheeledRobot(twr.TwoWheeledRobot):
+
+	def __init__(self, b=85.0, r=20.0, initial_state=state.State(0,0,0), f_s=1, environment=None,
+			alpha=1.0, beta=2.0, kappa=0.0, seed=None):
+		twr.TwoWheeledRobot.__init__(self, b=b, r=r, initial_state=initial_state, f_s=f_s, environment=environment,
+			seed=seed)
+		self.alpha = alpha # Sigma point spread
+		self.beta = beta # Prior knowledge of the distribution, 2 is optimal for a Gaussian
+		self.kappa = kappa # Secondary scaling parameter
+		self._Q_sqrt = (None, None) # Q and its square root, recomputed when Q is replaced
+		self._L = np.zeros((5, 5)) # Augmented covariance square root, its off diagonal blocks stay zero
+		# (covariance, sigma points, residuals) of the last time update, used by the measurement update
+		# while the covariance is still the one they were computed for
+		self._prior_points = (None, None, None)
+
+
+	# Updating the state estimate by propagating the augmented [x, y, theta, noise_l, noise_r] sigma points
+	def estimated_state_update(self, u, dt=None):
+
+		W_m, W_c, spread = sigma_weights(5, self.alpha, self.beta, self.kappa)
+
+		mean = np.zeros(5)
+		mean[0:3] = self.estimated_state_mean.get_state()
+		# The augmented covariance is block diagonal, so is its square root
+		L = self._L
+		L[0:3, 0:3] = covariance_sqrt(self.covariance)
+		Q, Q_sqrt = self._Q_sqrt
+		if Q is not self.Q:
+			Q_sqrt = covariance_sqrt(self.Q)
+			self._Q_sqrt = (self.Q, Q_sqrt)
+			L[3:5, 3:5] = Q_sqrt
+		points = sigma_points(mean, L, spread)
+
+		# All sigma points go through the motion model in one call, each with its own wheel noise
+		noisy_u = np.array(u.get_input(), dtype=float) + points[:, 3:5]
+		propagated, _ = motion_model(points[:, 0:3], noisy_u, self.b, self.r, self.d_t if dt is None else dt)
+
+		x_hat = state_mean(propagated, W_m)
+		residuals = state_residuals(propagated, x_hat)
+		self.estimated_state_mean = state.State(x_hat[0], x_hat[1], x_hat[2])
+		self.covariance = np.dot(residuals.T * W_c, residuals)
+		self._prior_points = (self.covariance, propagated, residuals)
+
+
+	# Update state and covariance given measurements, simulated from the real state unless y is given
+	def measurement_update(self, y=None):
+
+		self.last_innovation = self.last_innovation_covariance = None
+		if self.environment is None:
+			measure_and_jacobian = rangefinder.measure_and_jacobian
+			measure_batch = rangefinder.measure_batch
+		else:
+			measure_and_jacobian = self.environment.measure_and_jacobian
+			measure_batch = self.environment.measure
+
+		if y is None:
+			# Simulate the rangefinder readings from the real state, with the same noise as TwoWheeledRobot
+			y_t, _, _ = measure_and_jacobian(self.real_state)
+			y_t = y_t + np.array(self.noise.measurement.next()) * (9.375)
+		else:
+			y_t = np.array(twr.measurement_values(y), dtype=float)
+		self.last_measurement = measurement.Measurement(y_t[0], y_t[1])
+		# Skip sensor dropouts, as TwoWheeledRobot does (a sum is finite only if every term is)
+		if not math.isfinite(y_t[0] + y_t[1]):
+			return
+
+		# Push the sigma points of the prior through the rangefinder model in one call: the points propagated
+		# by the time update, whose weighted covariance is the prior, or new ones from the prior when the
+		# covariance was replaced or already updated since
+		x_hat = np.array(self.estimated_state_mean.get_state(), dtype=float)
+		covariance, points, x_residuals = self._prior_points
+		if covariance is not self.covariance:
+			W_m, W_c, spread = sigma_weights(3, self.alpha, self.beta, self.kappa)
+			points = sigma_points(x_hat, covariance_sqrt(self.covariance), spread)
+			x_residuals = state_residuals(points, x_hat)
+		else:
+			W_m, W_c, _ = sigma_weights(5, self.alpha, self.beta, self.kappa)
+		predicted, _ = measure_batch(points)
+		# and skip the update when a sigma point sees no wall
+		if not math.isfinite(predicted.sum()):
+			return
+
+		predicted_y_t = np.dot(W_m, predicted)
+		y_residuals = predicted - predicted_y_t
+		S = np.dot(y_residuals.T * W_c, y_residuals) + self.R
+		cross_covariance = np.dot(x_residuals.T * W_c, y_residuals)
+
+		# Kalman gain K = P_xy S^-1, with the 2x2 innovation covariance inverted in closed form
+		det = S[0, 0] * S[1, 1] - S[0, 1] * S[1, 0]
+		S_inv = np.array([[S[1, 1], -S[0, 1]], [-S[1, 0], S[0, 0]]]) / det
+		K = cross_covariance.dot(S_inv)
+		innovation = y_t - predicted_y_t
+		x_hat = x_hat + np.dot(K, innovation)
+		self.covariance = self.covariance - K.dot(S).dot(K.T)
+		self.estimated_state_mean = state.State(x_hat[0], x_hat[1], x_hat[2] % (2 * np.pi))
+		self.record_innovation(innovation, S)